@@ -1,8 +1,30 @@
 import os
 import subprocess
-from PIL import Image
-import re
-import pytesseract
+import threading
+
+from lazyimport import lazy_import
+
+from adbshell import ShellSession
+from adbclient import AdbClient
+from screencap import RawFrame, frame_size
+from capture import FrameCapture
+from videocapture import VideoCapture, exec_stream, screenrecord_command
+from inputbatch import InputBatch, TouchDevice, ROTATIONS
+from devicestate import DeviceState, parse_resolution
+from discovery import DeviceWatcher, emulator_ports, parse_device_list
+from ocr import OcrEngine, OcrCache
+from changedetect import ChangeDetector
+from transform import Transform
+from gesture import Gesture
+import transfer
+from scheduler import DeviceScheduler
+from resilience import INPUT_RETRY, CircuitBreaker, RetryPolicy, DeviceOffline, call, from_result
+from uidump import UI_DUMP, UiIndex, parse_hierarchy, parse_activity_top, iter_lines, center
+import instrument
+from tools import find_tool, walk
+
+Image = lazy_import('PIL.Image')
+pytesseract = lazy_import('pytesseract')
 
 def find_all_elements_with_text(target_list, text):
     """
@@ -11,92 +33,376 @@ def find_all_elements_with_text(target_list, text):
     return [item for item in target_list if text in item]
 
 class BaseDevice:
-    def __init__(self, adb_path=None) -> None:
+    def __init__(self, adb_path=None, backend='cli', start_server=True, client=None) -> None:
         self.BASE_RESOLUTION_EMU = [1920,1080] #scale 16:9 aspect ratio
         self.BASE_RESOLUTION_PHN = [2400,1080] #scale, device samsung galaxy s21, 9:20 aspect ratio
-        self.LANDSCAPE = True #default True
+        self.ORIENTATION = ''
+        self.LANDSCAPE = True #default True, scale from BASE_RESOLUTION_EMU, False scales phone to phone from BASE_RESOLUTION_PHN
 
         self.res_scalar_x = 1 #default 1
         self.res_scalar_y = 1 #default 1
+        self.transform = Transform() #base resolution -> screen pixels, res_scalar_x/y are its scale
+        self.fit_mode = 'stretch' #or 'letterbox', how the base resolution maps onto the screen
+        self.insets = None #(left, top, right, bottom) screen pixels to keep clear, eg. a display cutout
+        self._currentapp = '' #default ''
+
+        self.sessions = {} #device_identifier -> ShellSession
+        self._sessions_lock = threading.Lock()
+        if backend not in ('cli', 'socket'):
+            raise ValueError(f'unknown backend: {backend}')
+        self.client = (client or AdbClient()) if backend == 'socket' else None #talk to the adb server directly
+        self._frame_sizes = {} #device_identifier -> raw screencap size, for preallocating
+        self._touch_devices = {} #device_identifier -> TouchDevice, for the sendevent input backend
+        self.states = {} #device_identifier -> DeviceState, cached resolution/rotation/focus
+        self._serials = {} #device_identifier -> get-serialno, never changes
+        self.archive = None #archive.FrameArchive, every screenshot is also queued to it
+        self.timeout = 30.0 #seconds an adb command may go without answering, None waits forever
+        self.retry = RetryPolicy() #for failed reads, RetryPolicy(attempts=1) turns retries off
+        self.input_retry = INPUT_RETRY #for input, never repeated once it may have reached the device
+        self.breakers = {} #device_identifier -> CircuitBreaker, quarantines a device that keeps failing
+        self.schedulers = {} #device_identifier -> DeviceScheduler, orders and paces input and state queries
+        self.rates = {'input': (20.0, 5)} #lane -> (actions per second, burst) of new schedulers, fast taps get dropped by the device
         
-        current_dir = os.getcwd()
-        self.adb = adb_path or self.find_executable('adb.exe', current_dir)
+        self.adb = adb_path or find_tool('adb', os.getcwd())
         if not self.adb:
-            raise FileNotFoundError("adb.exe not found in the current directory or subdirectories.")
-        
-        subprocess.call(['taskkill', '/F', '/IM', 'adb.exe'])
-        server = subprocess.run(f'"{self.adb}" start-server', shell=True,capture_output=True,text=True)
+            raise FileNotFoundError("adb not found on PATH, ADBAPI_ADB, adbapi.json or under the current directory.")
+
+        if start_server: #False when the server is shared, eg. by a DeviceFleet
+            self.start_server()
+
+    def server_running(self) -> bool:
+        """True when an adb server already answers on its port (ANDROID_ADB_SERVER_PORT or 5037)."""
+        client = self.client or AdbClient(timeout=1)
+        try:
+            client.version()
+            return True
+        except (OSError, ValueError):
+            return False
+
+    def start_server(self, restart=False) -> None:
+        """Reuse a running adb server, start one otherwise. restart=True kills it first (adb kill-server)."""
+        if restart:
+            subprocess.run([self.adb, 'kill-server'], capture_output=True)
+        elif self.server_running():
+            return
+        server = subprocess.run([self.adb, 'start-server'], capture_output=True, text=True)
         self.check_connection(server)
         print(server.stderr)
 
-        #resolution scalar
-        subprocess.run(f'"{self.adb}" devices', shell=True)
+        subprocess.run([self.adb, 'devices'])
 
-    def check_connection(self,CompletedProcess):
+    def check_connection(self,CompletedProcess, device_identifier=None):
         if(CompletedProcess.returncode == 0): #good connection
             return True
-        else:                                  #bad connection
-            raise ConnectionError
+        else:                                  #bad connection, DeviceOffline, DeviceUnauthorized or CommandFailed
+            raise from_result(CompletedProcess, device_identifier)
+
+    def breaker(self, device_identifier) -> CircuitBreaker:
+        with self._sessions_lock:
+            breaker = self.breakers.get(device_identifier)
+            if breaker is None:
+                breaker = self.breakers[device_identifier] = CircuitBreaker(device_identifier)
+                breaker.subscribe(self._health_changed)
+        return breaker
+
+    @staticmethod
+    def _health_changed(breaker, old, new) -> None:
+        if new == 'open':
+            print(f'{breaker.device} quarantined for {breaker.retry_in():.1f}s: {breaker.last_error!r}')
+        elif new == 'closed':
+            print(f'{breaker.device} is healthy again')
+
+    def execute(self, device_identifier, command, action, retry=None):
+        """action() under the device's circuit breaker with retry (default self.retry), see resilience.call."""
+        return call(action, device_identifier, command, self.breaker(device_identifier), retry or self.retry,
+                    lambda error: self.recover(device_identifier, error))
+
+    def recover(self, device_identifier, error) -> None:
+        """Before a retry: drop the device's shell session, and have adb reconnect it when it went offline."""
+        with self._sessions_lock:
+            session = self.sessions.pop(device_identifier, None)
+        if session is not None:
+            session.close()
+        if isinstance(error, DeviceOffline):
+            try:
+                if self.client:
+                    self.client.reconnect(device_identifier)
+                else:
+                    subprocess.run([self.adb, '-s', device_identifier, 'reconnect'], capture_output=True, timeout=self.timeout)
+            except (OSError, subprocess.TimeoutExpired): #not there to reconnect, the retry reports it
+                pass
+
+    def shell(self, device_identifier, command, timeout=None, retry=None) -> subprocess.CompletedProcess:
+        """Run a command in the persistent shell session of the device, timed out (default self.timeout) and retried
+        with retry (default self.retry, pass self.input_retry for commands that must not run twice)."""
+        timeout = self.timeout if timeout is None else timeout
+        with instrument.span('shell', device_identifier, command):
+            return self.execute(device_identifier, command, lambda: self._shell(device_identifier, command, timeout), retry)
+
+    def _shell(self, device_identifier, command, timeout) -> subprocess.CompletedProcess:
+        if self.client:
+            return self.client.shell(device_identifier, command, timeout)
+        with self._sessions_lock:
+            session = self.sessions.get(device_identifier)
+            if session is None:
+                session = self.sessions[device_identifier] = ShellSession(self.adb, device_identifier)
+        return session.run(command, timeout)
+
+    def list_devices(self) -> dict:
+        """serial -> DeviceInfo (state, transport, model...) of everything the adb server knows."""
+        if self.client:
+            return parse_device_list(self.client.devices(long=True))
+        devices_output = subprocess.run(f'"{self.adb}" devices -l', shell=True, capture_output=True, text=True, timeout=self.timeout)
+        self.check_connection(devices_output)
+        return parse_device_list(devices_output.stdout)
+
+    def watch_devices(self) -> DeviceWatcher:
+        """Started DeviceWatcher on this device's adb server, for attach/detach events."""
+        return DeviceWatcher(self.client).start()
+
+    def device_state(self, device_identifier) -> DeviceState:
+        with self._sessions_lock:
+            state = self.states.get(device_identifier)
+            if state is None:
+                state = self.states[device_identifier] = DeviceState(lambda command: self.scheduler(device_identifier).call(
+                    self.shell, device_identifier, command, key=('shell', command))) #threads asking at once share one dumpsys
+        return state
+
+    def scheduler(self, device_identifier) -> DeviceScheduler:
+        """The device's DeviceScheduler, input goes through its 'input' lane and DeviceState through 'query'."""
+        with self._sessions_lock:
+            scheduler = self.schedulers.get(device_identifier)
+            if scheduler is None:
+                scheduler = self.schedulers[device_identifier] = DeviceScheduler(device_identifier, self.rates)
+        return scheduler
+
+    def _input(self, device_identifier, command) -> subprocess.CompletedProcess:
+        """Input lane of the scheduler, with self.input_retry so a tap or gesture script never lands twice."""
+        return self.scheduler(device_identifier).call(self.shell, device_identifier, command, lane='input', retry=self.input_retry)
+
+    def serialno(self, device_identifier) -> str:
+        if device_identifier not in self._serials:
+            self._serials[device_identifier] = self.execute(device_identifier, 'get-serialno', lambda: self._serialno(device_identifier))
+        return self._serials[device_identifier]
+
+    def _serialno(self, device_identifier) -> str:
+        if self.client:
+            return self.client.serialno(device_identifier)
+        serial = subprocess.run(f'"{self.adb}" -s {device_identifier} get-serialno', shell=True, capture_output=True, text=True,
+                                timeout=self.timeout)
+        self.check_connection(serial, device_identifier)
+        return serial.stdout.strip()
+
+    def close(self) -> None:
+        with self._sessions_lock:
+            for state in self.states.values(): #watchers would open new schedulers
+                state.stop_watch()
+            schedulers, self.schedulers = self.schedulers, {}
+        for scheduler in schedulers.values(): #queued actions still need the sessions
+            scheduler.close()
+        with self._sessions_lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions.clear()
         
     def get_info(self, device_identifier) -> None:
         print(f'\nInfo for device: {device_identifier}')
         #subprocess.run(f'"{self.adb}" -s {device_identifier} shell dumpsys battery', shell=True)
-        subprocess.run(f'"{self.adb}" -s {device_identifier} shell wm size', check=True, shell=True)
+        state = self.device_state(device_identifier)
+        print(f'{device_identifier} Resolution: {state.get("resolution")}')
+        print(f'{device_identifier} App in focus: {state.get("focus")}')
+        print(f'{device_identifier} Orientation: {state.get("rotation")}')
         print(f'{device_identifier} Landscape: {self.LANDSCAPE}')
         print(f'{device_identifier} Resolution scalar X: {self.res_scalar_x}')
         print(f'{device_identifier} Resolution scalar Y: {self.res_scalar_y}')
-        subprocess.run(f'"{self.adb}" -s {device_identifier} get-serialno', shell=True)
+        print(f'{device_identifier} Serial: {self.serialno(device_identifier)}')
+
+    @staticmethod
+    def find_executable(filename, search_path) -> None:
+        """Search for an executable file in the given directory and subdirectories, each walk is done once."""
+        return walk(filename, search_path)
+
+    def stream(self, device_identifier, command):
+        """Raw stdout of command as bytes chunks while it runs, for parsing long dumps incrementally."""
+        with instrument.span('exec.transfer', device_identifier, command, stream=True):
+            if self.client:
+                with self.client.open_service(device_identifier, f'exec:{command}', self.timeout) as sock:
+                    yield from iter(lambda: sock.recv(65536), b'')
+                return
+            proc = subprocess.Popen([self.adb, '-s', device_identifier, 'exec-out', command], stdout=subprocess.PIPE)
+            try:
+                yield from iter(lambda: proc.stdout.read1(65536), b'')
+            except GeneratorExit: #consumer stopped early, eg. after the closing tag
+                proc.kill()
+                raise
+            finally:
+                proc.stdout.close()
+                proc.wait()
+            self.check_connection(proc, device_identifier)
+
+    def ui_dump(self, device_identifier) -> UiIndex:
+        """Every node of the current UI (uiautomator), parsed while it streams in."""
+        return UiIndex(parse_hierarchy(self.stream(device_identifier, UI_DUMP)))
+
+    def tap_element(self, device_identifier, resource_id=None, text=None, contains=None, ui=None):
+        """Tap the center of the first matching UI node, ui is a previous ui_dump() to reuse. Returns the node."""
+        node = (ui or BaseDevice.ui_dump(self, device_identifier)).first(resource_id=resource_id, text=text, contains=contains)
+        x, y = center(node)
+        BaseDevice.screenInput(self, device_identifier, round(x), round(y)) #node bounds are already screen pixels
+        return node
+
+    def activity_top(self, device_identifier) -> list:
+        """ActivityInfo (package, activity, pid, task, bounds, app bounds) of the resumed activities."""
+        return list(parse_activity_top(iter_lines(self.stream(device_identifier, 'dumpsys activity top'))))
+
+    def app_resolution(self, device_identifier) -> None: #for tsting
+        for activity in BaseDevice.activity_top(self, device_identifier):
+            print(f'{activity.package}/{activity.activity} bounds: {activity.bounds} app bounds: {activity.app_bounds}')
+        #adb shell dumpsys window | find "app="
+        pass
+
+    def screencap(self, device_identifier, buffer=None) -> RawFrame:
+        """Raw screencap streamed into memory with exec-out, nothing is written on the device or the host.
+
+        When buffer is given the frame is placed in it, BufferError if it does not fit.
+        """
+        if self.client:
+            size = self._frame_sizes.get(device_identifier)
+            if buffer is None and size is not None:
+                buffer = bytearray(size)
+        data = self.execute(device_identifier, 'screencap', lambda: self._screencap(device_identifier, buffer))
+        frame = RawFrame(data)
+        self._frame_sizes[device_identifier] = frame_size(frame.width, frame.height, frame.pixel_format)
+        return frame
+
+    def _screencap(self, device_identifier, buffer):
+        if self.client:
+            if buffer is None:
+                return self.client.exec_out(device_identifier, 'screencap', timeout=self.timeout)
+            return self.client.exec_out(device_identifier, 'screencap', buffer, self.timeout) #memoryview, no copy
+        with instrument.span('exec.transfer', device_identifier, 'screencap', backend='cli'): #wait included
+            capture = subprocess.run([self.adb, '-s', device_identifier, 'exec-out', 'screencap'], capture_output=True,
+                                     timeout=self.timeout)
+        self.check_connection(capture, device_identifier)
+        data = capture.stdout
+        if buffer is not None:
+            if len(data) > len(buffer):
+                raise BufferError(f'frame is larger than the {len(buffer)} byte buffer')
+            buffer[:len(data)] = data
+            data = memoryview(buffer)[:len(data)]
+        return data
+
+    def capture(self, device_identifier, slots=4, interval=0) -> FrameCapture:
+        """Started background capture of the device into a ring of `slots` frames, stop() it when done."""
+        return FrameCapture(lambda buffer: self.screencap(device_identifier, buffer), slots, interval).start()
+
+    def video(self, device_identifier, size=None, bit_rate=8_000_000, slots=4) -> VideoCapture:
+        """Started screenrecord H.264 capture decoded on the host (needs PyAV), same frames as capture(), stop() it when done.
+        size (width, height) scales the video on the device, frame pixels are then video pixels, not screen pixels."""
+        command = screenrecord_command(size, bit_rate)
+        return VideoCapture(lambda: exec_stream(self.client, self.adb, device_identifier, command), slots, device_identifier).start()
+
+    def push(self, device_identifier, files, skip='stat', mode=None) -> list:
+        """Push {remote path: local path, bytes or file} in one sync session, unchanged files are skipped
+        ('stat', 'hash' or None, see transfer.push). Returns a TransferResult per file."""
+        with instrument.span('sync.push', device_identifier, skip=skip):
+            return self.execute(device_identifier, 'sync.push', lambda: self._sync(device_identifier, transfer.push, files, skip, mode))
+
+    def pull(self, device_identifier, files, skip='stat') -> list:
+        """Pull {remote path: local path, file or None} in one sync session, None targets come back in
+        TransferResult.data. Returns a TransferResult per file."""
+        with instrument.span('sync.pull', device_identifier, skip=skip):
+            return self.execute(device_identifier, 'sync.pull', lambda: self._sync(device_identifier, transfer.pull, files, skip))
+
+    def _sync(self, device_identifier, direction, files, skip, *args) -> list:
+        with (self.client or AdbClient()).sync(device_identifier, self.timeout) as sync:
+            return direction(sync, files, skip, lambda command: self.shell(device_identifier, command), *args)
+
+    def screenshot(self, device_identifier, stream=False, as_array=False) -> Image:
+        if stream: #in memory, PIL image (read only) or writable numpy array over the raw buffer
+            frame = self.screencap(device_identifier)
+            if not as_array:
+                if self.archive is not None:
+                    self.archive.add(frame, device_identifier, copy=False)
+                with instrument.span('screenshot.decode', device_identifier, as_array=as_array):
+                    return frame.to_image()
+            with instrument.span('screenshot.decode', device_identifier, as_array=as_array):
+                array = frame.to_array()
+            writable = array.flags.writeable #a fresh bytearray, or bytes (cli backend, first socket capture)
+            if self.archive is not None:
+                self.archive.add(frame, device_identifier, copy=writable) #bytes cannot change under the archive
+            return array if writable else array.copy() #the same array type whatever the backend
 
-    def find_executable(self, filename, search_path) -> None:
-        """Search for an executable file in the given directory and subdirectories."""
-        for root, dirs, files in os.walk(search_path):
-            if filename in files:
-                return os.path.join(root, filename)
-        return None
-
-    def screenshot(self, device_identifier) -> Image:
         screenshot_path = os.path.join(os.getcwd(), f'{device_identifier}.png')
         temp_screenshot_path = '/data/local/tmp/image.png'
         
-        take_screenshot = subprocess.run(f'"{self.adb}" -s {device_identifier} shell screencap -p {temp_screenshot_path}', shell=True, text=True)
-        fetch_screenshot = subprocess.run(f'"{self.adb}" -s {device_identifier} pull {temp_screenshot_path} "{screenshot_path}"', shell=True, text=True)
-        
-        self.check_connection(take_screenshot)
-        self.check_connection(fetch_screenshot)
+        take_screenshot = self.shell(device_identifier, f'screencap -p {temp_screenshot_path}')
+        self.check_connection(take_screenshot, device_identifier)
 
-        return Image.open(screenshot_path)
+        if self.client:
+            BaseDevice.pull(self, device_identifier, {temp_screenshot_path: screenshot_path}, skip=None)
+        else:
+            fetch_screenshot = subprocess.run(f'"{self.adb}" -s {device_identifier} pull {temp_screenshot_path} "{screenshot_path}"', shell=True, text=True,
+                                              timeout=self.timeout)
+            self.check_connection(fetch_screenshot, device_identifier)
 
-    def resolution(self, device_identifier) -> list:
-        #orientation = subprocess.run(f'"{self.adb}" -s {device_identifier} shell dumpsys input',shell=True, text=True,capture_output=True)
-        #dump_info = orientation.stdout.splitlines()
-        #_orientation = find_all_elements_with_text(dump_info,text='Orientation:') #search dump for Transoform (ROT)
+        image = Image.open(screenshot_path)
+        if self.archive is not None:
+            self.archive.add(image, device_identifier)
+        return image
 
-        res = subprocess.run(f'"{self.adb}" -s {device_identifier} shell wm size', shell=True, text=True, capture_output=True)
-        self.check_connection(res) 
-        #self.check_connection(orientation) #uncomment
+    def currentfocus(self, device_identifier) -> str:
+        return self.device_state(device_identifier).get('focus') #cached, see DeviceState
 
-        res = res.stdout.split()[-1] #formattex in mxn, type=str
-        res_list = res.replace('x', ' ').split()
-        res_list_int = list(map(int, res_list))
-        res_list_int.sort(reverse=True) #sort x,y
+    def orientation(self, device_identifier) -> str:
+        #ROTATION_0 AND ROTATION_360 ARE THE SAME, PORTRAIT
+        #ROTATION_90 AND ROTATION_270 ARE THE SAME, LANDSCAPE
+        return self.device_state(device_identifier).get('rotation')
 
-        return res_list_int #in the format, x is biggest, y smallest
+    def resolution(self, device_identifier) -> list:
+        return list(self.device_state(device_identifier).get('resolution')) #in the format, x is biggest, y smallest
 
     def screenInput(self, device_identifier, x, y) -> None:
         print(f'Input {device_identifier} at: {x}, {y}')
-        subprocess.Popen(f'"{self.adb}" -s {device_identifier} shell input tap {x} {y}', shell=True, text=True)
+        self.check_connection(self._input(device_identifier, f'input tap {x} {y}'), device_identifier)
 
     def screenSwipe(self, device_identifier, x1, y1, x2, y2) -> None:
         print(f'Swiping from: {x1}, {y1} -> {x2}, {y2}')
-        subprocess.Popen(f'"{self.adb}" -s {device_identifier} shell input touchscreen swipe {x1} {y1} {x2} {y2}', shell=True)
+        self.check_connection(self._input(device_identifier, f'input touchscreen swipe {x1} {y1} {x2} {y2}'), device_identifier)
+
+    def fit(self, screen, base=None) -> Transform:
+        """Transform from base (default BASE_RESOLUTION_EMU) onto a screen (w, h) in its current orientation, sets the res scalars."""
+        self.transform = Transform.fit(base or self.BASE_RESOLUTION_EMU, screen, self.fit_mode, self.insets)
+        self.res_scalar_x, self.res_scalar_y = self.transform.scale_x, self.transform.scale_y
+        return self.transform
+
+    def batch(self, device_identifier, scale_x=1, scale_y=1, backend='input', transform=None) -> InputBatch:
+        """Input steps collected and sent as one shell script, see InputBatch."""
+        touch = self.touch_device(device_identifier) if backend == 'sendevent' else None
+        return InputBatch(lambda script: self._input(device_identifier, script), scale_x, scale_y, backend, touch, transform)
+
+    def touch_device(self, device_identifier) -> TouchDevice:
+        """Probed once per device, the rotation is taken from the DeviceState cache on every call."""
+        touch = self._touch_devices.get(device_identifier)
+        if touch is None:
+            touch = self._touch_devices[device_identifier] = TouchDevice.probe(lambda command: self.shell(device_identifier, command))
+        touch.rotation = ROTATIONS.get(self.device_state(device_identifier).cached('rotation'), 0)
+        return touch
+
+    def gesture(self, device_identifier, backend='sendevent', transform=None, rate=None) -> Gesture:
+        """Multi point / multi touch gesture played in one shell call, see Gesture."""
+        touch = self.touch_device(device_identifier) if backend == 'sendevent' else None
+        return Gesture(lambda script: self._input(device_identifier, script), transform, backend, touch, rate)
 
 
 class Phone(BaseDevice):
-    def __init__(self, name, force_pc_resolution=True, vertical=True,adb_path=None) -> None:
-        super().__init__(adb_path)
+    def __init__(self, name, force_pc_resolution=True, vertical=True,adb_path=None, backend='cli', start_server=True, client=None, watch_interval=1.0) -> None:
+        super().__init__(adb_path, backend, start_server, client)
         self.name = name #device name
+        self.LANDSCAPE = force_pc_resolution #True scales from the 1920x1080 pc resolution, False phone to phone
         
-        subprocess.run(f'"{self.adb}" devices', shell=True)
+        if not self.client: #the socket backend lists devices natively, see find_device
+            subprocess.run(f'"{self.adb}" devices', shell=True)
         if(self.name == None): #unknown device name
             self.name = self.find_device()
 
@@ -107,64 +413,110 @@ class Phone(BaseDevice):
             print(f'Connecting to default unit: {self.name}')
             print(f'Recomended to change device name to: {self.name}\nTo avoid errors.')
 
-        phone_resolution = self.resolution() #[x,y]
-        if force_pc_resolution: #forces scaling to landscape 1920x1080, default
-            self.LANDSCAPE = True
-            self.res_scalar_x = phone_resolution[0]/self.BASE_RESOLUTION_EMU[0]
-            self.res_scalar_y = phone_resolution[1]/self.BASE_RESOLUTION_EMU[1]
-
-        if not force_pc_resolution: #phone to phone scaling
-            self.LANDSCAPE = False
-            self.res_scalar_x = phone_resolution[1]/self.BASE_RESOLUTION_PHN[0]
-            self.res_scalar_y = phone_resolution[0]/self.BASE_RESOLUTION_PHN[1]
-        
+        self.rescale()
+        self.device_state(self.name).subscribe(self.rescale) #taps stay correct when the phone is rotated
+        if watch_interval: #seconds between background rotation checks, None leaves refreshing to rescale()/get_info()
+            self.device_state(self.name).start_watch(watch_interval)
+
         self.get_info() #post info about system
         #subprocess.run(f'"{self.adb}" -s {self.name} shell wm size', check=True)
 
     def find_device(self) -> str: 
         print(f'Finding device..')
-        devices_output = subprocess.run(f'"{self.adb}" devices', shell=True, capture_output=True, text=True)
-        super().check_connection(devices_output)
-
-        phones = devices_output.stdout.split() #list
-        phones = phones[4:] #formatting
-        device_name = [i for i in phones if i != 'device']
-        phone_name = [name for name in device_name if 'emulator' not in name]
+        phone_name = [serial for serial, info in self.list_devices().items()
+                      if info.state == 'device' and info.transport != 'emulator']
 
         if(phone_name == []): #no phone
             raise ConnectionError
         
         return phone_name
 
+    def rescale(self, state=None, changed=None) -> None:
+        """Resolution scalars for the current rotation, also called by DeviceState when rotation/resolution change."""
+        if changed is not None and not changed & {'rotation', 'resolution'}: #focus only, the scale is the same
+            return
+        phone_resolution = self.resolution() #[x,y]
+        self.ORIENTATION = self.orientation() #str
+        self._currentapp = self.currentfocus() #str
+        self.fit_orientation(phone_resolution)
+
+    def fit_orientation(self, phone_resolution) -> Transform:
+        """fit() for self.ORIENTATION, from BASE_RESOLUTION_EMU when LANDSCAPE else BASE_RESOLUTION_PHN (AsyncPhone shares it)."""
+        base = self.BASE_RESOLUTION_EMU if self.LANDSCAPE else self.BASE_RESOLUTION_PHN
+        if(self.ORIENTATION == 'ROTATION_90' or self.ORIENTATION == 'ROTATION_270'):
+            return self.fit(phone_resolution, base) #eg 2400/1920
+        return self.fit(phone_resolution[::-1], base)
+
     def get_info(self) -> None:
         super().get_info(self.name)
     
-    def screenshot(self) -> Image:
-        return super().screenshot(self.name)
+    def screenshot(self, stream=False, as_array=False) -> Image:
+        return super().screenshot(self.name, stream, as_array)
 
-    def screenInput(self, x, y) -> None: #scaled
-        x_scaled = x*self.res_scalar_x #scaling values for normalization
-        y_scaled = y*self.res_scalar_y
+    def capture(self, slots=4, interval=0) -> FrameCapture:
+        return super().capture(self.name, slots, interval)
 
-        super().screenInput(self.name, x_scaled, y_scaled)
+    def video(self, size=None, bit_rate=8_000_000, slots=4) -> VideoCapture:
+        return super().video(self.name, size, bit_rate, slots)
 
+    def push(self, files, skip='stat', mode=None) -> list:
+        return super().push(self.name, files, skip, mode)
+
+    def pull(self, files, skip='stat') -> list:
+        return super().pull(self.name, files, skip)
+
+    def screenInput(self, x, y) -> None: #scaled, self.transform is kept current by the watcher calling rescale()
+        x_scaled, y_scaled = self.transform.point(x, y) #base resolution to screen pixels
+
+        super().screenInput(self.name, x_scaled, y_scaled)
 
     def screenSwipe(self, x1, y1, x2, y2) -> None:
-        x1_scaled = x1*self.res_scalar_x #scaling values for normalization
-        y1_scaled = y1*self.res_scalar_y
-        x2_scaled = x2*self.res_scalar_x 
-        y2_scaled = y2*self.res_scalar_y
+        (x1_scaled, y1_scaled), (x2_scaled, y2_scaled) = self.transform.apply([(x1, y1), (x2, y2)]).tolist()
 
         super().screenSwipe(self.name, x1_scaled, y1_scaled, x2_scaled, y2_scaled)
 
+    def batch(self, backend='input') -> InputBatch: #scaled
+        return super().batch(self.name, backend=backend, transform=self.transform)
+
+    def gesture(self, backend='sendevent', rate=None) -> Gesture: #scaled
+        return super().gesture(self.name, backend, self.transform, rate)
+
+    def locate(self, locator, names=None, threshold=0.8, roi=None, max_hits=1) -> list: #scaled
+        """Find a Locator's templates on screen, hits are in base resolution like screenInput takes."""
+        frame = self.screenshot(stream=True, as_array=True)
+        return locator.locate(frame, names, threshold, roi, max_hits=max_hits, transform=self.transform)
+
+    def changes(self, tile=64, step=4, threshold=24, slots=4, interval=0) -> ChangeDetector: #scaled
+        """ChangeDetector on a background capture, use wait_until_stable() after input instead of a sleep. close() it when done."""
+        return ChangeDetector(self.capture(slots, interval), tile, step, threshold, close_source=True, transform=self.transform)
 
     def resolution(self) -> list:
         res = super().resolution(self.name)
         return res
 
+    def orientation(self) -> str:
+        ori = super().orientation(self.name)
+        return ori
+
+    def currentfocus(self) -> str:
+        focus = super().currentfocus(self.name)
+        return focus
+
+    def app_resolution(self) -> None:
+        super().app_resolution(self.name)
+
+    def ui_dump(self) -> UiIndex:
+        return super().ui_dump(self.name)
+
+    def tap_element(self, resource_id=None, text=None, contains=None, ui=None):
+        return super().tap_element(self.name, resource_id, text, contains, ui)
+
+    def activity_top(self) -> list:
+        return super().activity_top(self.name)
+
 class Emulator(BaseDevice):
-    def __init__(self, port, devices, emulator=True,name=None, adb_path=None) -> None:
-        super().__init__(adb_path)
+    def __init__(self, port, devices, emulator=True,name=None, adb_path=None, backend='cli', start_server=True, client=None) -> None:
+        super().__init__(adb_path, backend, start_server, client)
         self.port = port
         self.devices = devices
         self.emulator = emulator
@@ -176,19 +528,14 @@ class Emulator(BaseDevice):
             raise SystemError
 
         emulator_resolution = self.resolution() #[x,y]
-        self.res_scalar_x = emulator_resolution[0]/self.BASE_RESOLUTION_EMU[0]
-        self.res_scalar_y = emulator_resolution[1]/self.BASE_RESOLUTION_EMU[1]
+        self.fit(emulator_resolution)
 
         self.get_info() #post info about system
 
     def generate_ports(self) -> list:
         if self.devices == 0:
             print(f'Finding devices..')
-            devices_output = subprocess.run(f'"{self.adb}" devices', shell=True, capture_output=True, text=True)
-            super().check_connection(devices_output)
-
-            emulator_ports = re.findall(r'emulator-(\d+)', devices_output.stdout)
-            ports = [int(port) for port in emulator_ports]
+            ports = self.running_ports()
 
             if not ports:
                 print(f'No adb device detected')
@@ -201,6 +548,10 @@ class Emulator(BaseDevice):
         if self.devices == -1: #manual port
             return [self.port]
 
+        running = self.running_ports()
+        if len(running) >= self.devices: #real ports beat guessing
+            return running[:self.devices]
+
         if self.devices == 1: #default port
             return [5554]
         
@@ -210,72 +561,145 @@ class Emulator(BaseDevice):
         if self.devices > 2:
             return [(5554 + 2 * i) for i in range(self.devices)]
 
+    def running_ports(self) -> list:
+        return emulator_ports(self.list_devices())
+
     def connect_emulators(self) -> None:
         ports = self.generate_ports()
         print(f'Ports: {ports}')
         for port in ports:
-            subprocess.run(f'"{self.adb}" connect 127.0.0.1:{port}', check=True)
-            subprocess.run(f'"{self.adb}" -s emulator-{port} shell wm size', check=True)
+            if self.client:
+                print(self.client.connect(f'127.0.0.1:{port}'))
+            else:
+                subprocess.run(f'"{self.adb}" connect 127.0.0.1:{port}', shell=True, check=True)
+            self.check_connection(self.shell(f'emulator-{port}', 'wm size'), f'emulator-{port}')
 
     def get_info(self):
         identifier = f"emulator-{self.port}" if self.emulator else self.name
         return super().get_info(identifier)
     
-    def screenshot(self) -> Image:
+    def screenshot(self, stream=False, as_array=False) -> Image:
+        identifier = f"emulator-{self.port}" if self.emulator else self.name
+        return super().screenshot(identifier, stream, as_array)
+
+    def capture(self, slots=4, interval=0) -> FrameCapture:
+        identifier = f"emulator-{self.port}" if self.emulator else self.name
+        return super().capture(identifier, slots, interval)
+
+    def video(self, size=None, bit_rate=8_000_000, slots=4) -> VideoCapture:
         identifier = f"emulator-{self.port}" if self.emulator else self.name
-        return super().screenshot(identifier)
+        return super().video(identifier, size, bit_rate, slots)
+
+    def push(self, files, skip='stat', mode=None) -> list:
+        identifier = f"emulator-{self.port}" if self.emulator else self.name
+        return super().push(identifier, files, skip, mode)
+
+    def pull(self, files, skip='stat') -> list:
+        identifier = f"emulator-{self.port}" if self.emulator else self.name
+        return super().pull(identifier, files, skip)
 
     def screenInput(self, x, y) -> None: 
         identifier = f"emulator-{self.port}" if self.emulator else self.name
-        x_scaled = x*self.res_scalar_x #scaling values for normalization
-        y_scaled = y*self.res_scalar_y
+        x_scaled, y_scaled = self.transform.point(x, y) #base resolution to screen pixels
 
         super().screenInput(identifier, x_scaled, y_scaled)
 
     def screenSwipe(self, x1, y1, x2, y2) -> None:
         identifier = f"emulator-{self.port}" if self.emulator else self.name
-        x1_scaled = x1*self.res_scalar_x #scaling values for normalization
-        y1_scaled = y1*self.res_scalar_y
-        x2_scaled = x2*self.res_scalar_x 
-        y2_scaled = y2*self.res_scalar_y
+        (x1_scaled, y1_scaled), (x2_scaled, y2_scaled) = self.transform.apply([(x1, y1), (x2, y2)]).tolist()
 
         super().screenSwipe(identifier, x1_scaled, y1_scaled, x2_scaled, y2_scaled)
+
+    def batch(self, backend='input') -> InputBatch:
+        identifier = f"emulator-{self.port}" if self.emulator else self.name
+        return super().batch(identifier, backend=backend, transform=self.transform)
+
+    def gesture(self, backend='sendevent', rate=None) -> Gesture:
+        identifier = f"emulator-{self.port}" if self.emulator else self.name
+        return super().gesture(identifier, backend, self.transform, rate)
+
+    def locate(self, locator, names=None, threshold=0.8, roi=None, max_hits=1) -> list:
+        frame = self.screenshot(stream=True, as_array=True)
+        return locator.locate(frame, names, threshold, roi, max_hits=max_hits, transform=self.transform)
+
+    def changes(self, tile=64, step=4, threshold=24, slots=4, interval=0) -> ChangeDetector:
+        return ChangeDetector(self.capture(slots, interval), tile, step, threshold, close_source=True, transform=self.transform)
     
     def resolution(self):
         identifier = f"emulator-{self.port}" if self.emulator else self.name
         return super().resolution(identifier)
 
+    def currentfocus(self) -> str:
+        identifier = f"emulator-{self.port}" if self.emulator else self.name
+        return super().currentfocus(identifier)
+
+    def orientation(self) -> str:
+        identifier = f"emulator-{self.port}" if self.emulator else self.name
+        return super().orientation(identifier)
+
+    def app_resolution(self) -> None:
+        identifier = f"emulator-{self.port}" if self.emulator else self.name
+        super().app_resolution(identifier)
+
+    def ui_dump(self) -> UiIndex:
+        identifier = f"emulator-{self.port}" if self.emulator else self.name
+        return super().ui_dump(identifier)
+
+    def tap_element(self, resource_id=None, text=None, contains=None, ui=None):
+        identifier = f"emulator-{self.port}" if self.emulator else self.name
+        return super().tap_element(identifier, resource_id, text, contains, ui)
+
+    def activity_top(self) -> list:
+        identifier = f"emulator-{self.port}" if self.emulator else self.name
+        return super().activity_top(identifier)
+
 class ImageOcr:
-    def __init__(self,im,res_scalar_x,res_scalar_y) -> None:
-        # Search for tesseract.exe in the current directory or subdirectories
-        current_dir = os.getcwd()
-        tesseract_path = self.find_executable('tesseract.exe', current_dir)
+    engine = None #OcrEngine shared by every ImageOcr, created on first get_regions
+    text_cache = OcrCache(max_entries=256) #get_text results by image hash
+    tesseract_cmd = None #resolved by the first ImageOcr
+
+    def __init__(self,im,res_scalar_x=1,res_scalar_y=1,transform=None) -> None: #transform, eg. phone.transform, wins over the scalars
+        # Search for tesseract on PATH, TESSERACT_CMD, adbapi.json, then the current directory or subdirectories
+        tesseract_path = find_tool('tesseract', os.getcwd())
         if not tesseract_path:
-            raise FileNotFoundError("tesseract.exe not found in the current directory or subdirectories.")
+            raise FileNotFoundError("tesseract not found on PATH, TESSERACT_CMD, adbapi.json or under the current directory.")
         
-        pytesseract.pytesseract.tesseract_cmd = tesseract_path
+        ImageOcr.tesseract_cmd = tesseract_path #handed to pytesseract when it is first used
 
         self.res_scalar_x = res_scalar_x
         self.res_scalar_y = res_scalar_y
+        self.transform = transform or Transform.scale(res_scalar_x, res_scalar_y)
         self.im = im 
 
     def find_executable(self, filename, search_path) -> None:
-        for root, dirs, files in os.walk(search_path):
-            if filename in files:
-                return os.path.join(root, filename)
-        return None
+        return walk(filename, search_path)
 
     def crop_image(self,x1,y1,x2,y2) -> Image:
-        x1_scaled = x1*self.res_scalar_x #scaling values for normalization
-        y1_scaled = y1*self.res_scalar_y
-        x2_scaled = x2*self.res_scalar_x 
-        y2_scaled = y2*self.res_scalar_y
+        x1_scaled, y1_scaled, x2_scaled, y2_scaled = self.transform.rect(x1, y1, x2, y2) #scaling values for normalization
 
         _im = self.im.crop((x1_scaled, y1_scaled, x2_scaled, y2_scaled))
         return _im
     
+    def get_regions(self, regions, engine=None) -> list:
+        """OcrResult (text, confidence, box) per (x1, y1, x2, y2) region, all regions read in one batched OCR call."""
+        scaled = self.transform.rects(regions).tolist() if len(regions) else [] #scaling values for normalization
+        if engine is None:
+            if ImageOcr.engine is None:
+                ImageOcr.engine = OcrEngine(tesseract_cmd=self.tesseract_cmd)
+            engine = ImageOcr.engine
+        return engine.read_regions(self.im, scaled)
+
     def get_text(self) -> str:
-        # Extracting text from the image using pytesseract
-        text = pytesseract.image_to_string(self.im).split()
+        # Extracting text from the image using pytesseract, unchanged images come from the cache
+        key = self.text_cache.key(self.im, 'image_to_string')
+        text = self.text_cache.get(key)
+        if text is None:
+            pytesseract.pytesseract.tesseract_cmd = self.tesseract_cmd
+            with instrument.span('ocr', call='image_to_string'):
+                text = pytesseract.image_to_string(self.im).split()
+            self.text_cache.put(key, text)
         print(text)
         return text
+
+#add support for
+#adb shell dumpsys window | find "app="
@@ -0,0 +1,292 @@
+import os
+import socket
+import struct
+import subprocess
+import time
+
+import instrument
+
+SYNC_DATA_MAX = 64 * 1024 #largest DATA chunk adbd accepts
+SHELL_MARKER = '__adbapi_rc__' #fixed so recorded transcripts replay, one command per connection
+
+
+def encode_request(service) -> bytes:
+    """Frame a service request the way the adb server expects it, 4 hex digits of length then the payload."""
+    payload = service.encode()
+    return f'{len(payload):04x}'.encode() + payload
+
+
+def read_exact(sock, size) -> bytes:
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError(f'adb connection closed after {len(data)} of {size} bytes')
+        data += chunk
+    return bytes(data)
+
+
+def read_all(sock) -> bytes:
+    chunks = []
+    while True:
+        chunk = sock.recv(SYNC_DATA_MAX)
+        if not chunk:
+            return b''.join(chunks)
+        chunks.append(chunk)
+
+
+def read_into(sock, buffer) -> int:
+    """Receive until the peer closes, straight into buffer, returns the number of bytes written."""
+    view = memoryview(buffer)
+    filled = 0
+    while True:
+        if filled == len(view):
+            if sock.recv(1):
+                raise BufferError(f'stream is larger than the {len(view)} byte buffer')
+            return filled
+        count = sock.recv_into(view[filled:])
+        if not count:
+            return filled
+        filled += count
+
+
+def check_status(sock) -> None:
+    status = read_exact(sock, 4)
+    if status == b'OKAY':
+        return
+    if status == b'FAIL':
+        length = int(read_exact(sock, 4), 16)
+        raise ConnectionError(read_exact(sock, length).decode(errors='replace'))
+    raise ConnectionError(f'unexpected adb server reply: {status!r}')
+
+
+def shell_service(command) -> str:
+    """shell: request for command, stderr merged into stdout and the exit code appended after SHELL_MARKER."""
+    return f'shell:{{ {command}\n}} 2>&1; echo "{SHELL_MARKER}$?"'
+
+
+def parse_shell_output(device_identifier, command, output) -> subprocess.CompletedProcess:
+    output = output.decode(errors='replace').replace('\r\n', '\n')
+    head, sep, tail = output.rpartition(SHELL_MARKER)
+    if not sep:
+        raise ConnectionError(f'adb shell to {device_identifier} ended early: {output.strip()}')
+    return subprocess.CompletedProcess(command, int(tail.strip()), head, '')
+
+
+def parse_framebuffer_header(header) -> dict:
+    """Decode the framebuffer: service header (version 1 and 2) into its fields."""
+    version = struct.unpack_from('<I', header)[0]
+    if version == 1:
+        names = ['bpp', 'size', 'width', 'height', 'red_offset', 'red_length', 'blue_offset', 'blue_length',
+                 'green_offset', 'green_length', 'alpha_offset', 'alpha_length']
+    elif version == 2:
+        names = ['bpp', 'colorspace', 'size', 'width', 'height', 'red_offset', 'red_length', 'blue_offset', 'blue_length',
+                 'green_offset', 'green_length', 'alpha_offset', 'alpha_length']
+    else:
+        raise ValueError(f'unsupported framebuffer version {version}')
+    fields = dict(zip(names, struct.unpack_from(f'<{len(names)}I', header, 4)))
+    fields['version'] = version
+    return fields
+
+
+class SyncConnection:
+    """One sync: session on a device, any number of stat/push/pull calls before close."""
+
+    def __init__(self, sock) -> None:
+        self.sock = sock
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _send(self, command, data=b'') -> None:
+        self.sock.sendall(command + struct.pack('<I', len(data)) + data)
+
+    def _fail(self, length) -> None:
+        raise ConnectionError(read_exact(self.sock, length).decode(errors='replace'))
+
+    def stat(self, remote_path) -> tuple:
+        """Returns (mode, size, mtime), mode is 0 when the path does not exist."""
+        return self.stat_many([remote_path])[0]
+
+    def stat_many(self, remote_paths) -> list:
+        """(mode, size, mtime) per path, every STAT is sent before the first reply is read (one round trip)."""
+        remote_paths = list(remote_paths)
+        self.sock.sendall(b''.join(b'STAT' + struct.pack('<I', len(path.encode())) + path.encode() for path in remote_paths))
+        out = []
+        for _ in remote_paths:
+            reply = read_exact(self.sock, 16)
+            if reply[:4] != b'STAT':
+                raise ConnectionError(f'unexpected sync reply: {reply[:4]!r}')
+            out.append(struct.unpack('<III', reply[4:]))
+        return out
+
+    def push(self, data, remote_path, mode=0o644, mtime=None) -> None:
+        """Write bytes, or the contents of a readable file object, to remote_path."""
+        self.send_file(data, remote_path, mode, mtime)
+        self.read_ack(remote_path)
+
+    def send_file(self, data, remote_path, mode=0o644, mtime=None) -> int:
+        """First half of push(), without waiting for the reply, returns the bytes sent. Several files can be sent
+        before their read_ack()s, adbd answers in order, so a batch costs one round trip instead of one per file."""
+        self._send(b'SEND', f'{remote_path},{mode | 0o100000}'.encode())
+        size = 0
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            view = memoryview(data).cast('B')
+            for offset in range(0, len(view), SYNC_DATA_MAX):
+                self._send(b'DATA', view[offset:offset + SYNC_DATA_MAX])
+            size = len(view)
+        else:
+            for chunk in iter(lambda: data.read(SYNC_DATA_MAX), b''):
+                self._send(b'DATA', chunk)
+                size += len(chunk)
+        self.sock.sendall(b'DONE' + struct.pack('<I', int(time.time() if mtime is None else mtime)))
+        return size
+
+    def read_ack(self, remote_path='') -> None:
+        reply = read_exact(self.sock, 8)
+        length = struct.unpack('<I', reply[4:])[0]
+        if reply[:4] == b'FAIL':
+            raise ConnectionError(f'{remote_path}: {read_exact(self.sock, length).decode(errors="replace")}')
+        if reply[:4] != b'OKAY':
+            raise ConnectionError(f'unexpected sync reply: {reply[:4]!r}')
+
+    def pull(self, remote_path, target=None):
+        """Read remote_path into target (a writable file object), or return the bytes when target is None."""
+        self._send(b'RECV', remote_path.encode())
+        return self.receive(target)
+
+    def request_file(self, remote_path) -> None:
+        """First half of pull(), several RECVs can be queued before receive()ing the files in the same order."""
+        self._send(b'RECV', remote_path.encode())
+
+    def receive(self, target=None):
+        """Read the next requested file into target, or return its bytes when target is None."""
+        out = bytearray() if target is None else None
+        while True:
+            reply = read_exact(self.sock, 8)
+            length = struct.unpack('<I', reply[4:])[0]
+            if reply[:4] == b'DATA':
+                chunk = read_exact(self.sock, length)
+                if out is None:
+                    target.write(chunk)
+                else:
+                    out += chunk
+            elif reply[:4] == b'DONE':
+                return bytes(out) if out is not None else None
+            elif reply[:4] == b'FAIL':
+                self._fail(length)
+            else:
+                raise ConnectionError(f'unexpected sync reply: {reply[:4]!r}')
+
+    def close(self) -> None:
+        if self.sock is None:
+            return
+        try:
+            self._send(b'QUIT')
+        except OSError:
+            pass
+        self.sock.close()
+        self.sock = None
+
+
+class AdbClient:
+    """Talks to the adb server over its TCP socket instead of running adb for every command."""
+
+    def __init__(self, host='127.0.0.1', port=None, timeout=None) -> None:
+        self.host = host
+        self.port = port or int(os.environ.get('ANDROID_ADB_SERVER_PORT', 5037)) #same override as the adb binary
+        self.timeout = timeout
+
+    def _connect(self) -> socket.socket:
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def _host_query(self, service) -> str:
+        with self._connect() as sock:
+            sock.sendall(encode_request(service))
+            check_status(sock)
+            length = int(read_exact(sock, 4), 16)
+            return read_exact(sock, length).decode(errors='replace')
+
+    def version(self) -> int:
+        return int(self._host_query('host:version'), 16)
+
+    def devices(self, long=False) -> str:
+        """Same lines as `adb devices`, without the 'List of devices attached' header."""
+        return self._host_query('host:devices-l' if long else 'host:devices')
+
+    def serialno(self, device_identifier) -> str:
+        return self._host_query(f'host-serial:{device_identifier}:get-serialno')
+
+    def connect(self, address) -> str:
+        return self._host_query(f'host:connect:{address}')
+
+    def transport(self, device_identifier) -> socket.socket:
+        """Socket bound to the device, ready for one device service."""
+        sock = self._connect()
+        try:
+            sock.sendall(encode_request(f'host:transport:{device_identifier}'))
+            check_status(sock)
+        except BaseException:
+            sock.close()
+            raise
+        return sock
+
+    def reconnect(self, device_identifier) -> str:
+        """Have the server drop and reopen its connection to the device, like `adb -s <serial> reconnect`."""
+        return self._host_query(f'host-serial:{device_identifier}:reconnect')
+
+    def open_service(self, device_identifier, service, timeout=None) -> socket.socket:
+        """timeout is the seconds any one read or write of the service may wait, the client's own timeout when None."""
+        sock = self.transport(device_identifier)
+        try:
+            if timeout is not None:
+                sock.settimeout(timeout)
+            sock.sendall(encode_request(service))
+            check_status(sock)
+        except BaseException:
+            sock.close()
+            raise
+        return sock
+
+    def shell(self, device_identifier, command, timeout=None) -> subprocess.CompletedProcess:
+        with self.open_service(device_identifier, shell_service(command), timeout) as sock:
+            return parse_shell_output(device_identifier, command, read_all(sock))
+
+    def exec_out(self, device_identifier, command, buffer=None, timeout=None):
+        """Raw stdout of a command, binary safe (the exec: service has no pty and no newline translation).
+
+        With a preallocated buffer the output is received into it and a memoryview of the filled part is returned.
+        """
+        with self.open_service(device_identifier, f'exec:{command}', timeout) as sock:
+            if instrument.enabled:
+                with instrument.span('exec.wait', device_identifier, command): #until the device starts answering
+                    sock.recv(1, socket.MSG_PEEK)
+            with instrument.span('exec.transfer', device_identifier, command):
+                if buffer is None:
+                    return read_all(sock)
+                return memoryview(buffer)[:read_into(sock, buffer)]
+
+    def sync(self, device_identifier, timeout=None) -> SyncConnection:
+        return SyncConnection(self.open_service(device_identifier, 'sync:', timeout))
+
+    def push(self, device_identifier, local_path, remote_path, mode=None) -> None:
+        st = os.stat(local_path)
+        with open(local_path, 'rb') as f, self.sync(device_identifier) as sync:
+            sync.push(f, remote_path, mode=(st.st_mode & 0o777) if mode is None else mode, mtime=st.st_mtime)
+
+    def pull(self, device_identifier, remote_path, local_path) -> None:
+        with open(local_path, 'wb') as f, self.sync(device_identifier) as sync:
+            sync.pull(remote_path, f)
+
+    def framebuffer(self, device_identifier) -> tuple:
+        """Returns (header fields, pixel bytes) from the framebuffer: service."""
+        with self.open_service(device_identifier, 'framebuffer:') as sock:
+            version = read_exact(sock, 4)
+            count = 13 if struct.unpack('<I', version)[0] == 2 else 12
+            header = parse_framebuffer_header(version + read_exact(sock, count * 4))
+            return header, read_exact(sock, header['size'])
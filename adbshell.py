@@ -0,0 +1,90 @@
+import queue
+import subprocess
+import threading
+import time
+import uuid
+
+from resilience import CommandTimeout
+
+
+class ShellSession:
+    """Long lived `adb shell` process for one device, commands are framed with a marker line."""
+
+    def __init__(self, adb, device_identifier) -> None:
+        self.adb = adb
+        self.device_identifier = device_identifier
+        self.marker = f'__adbapi_{uuid.uuid4().hex}__'
+
+        self._lock = threading.Lock() #one command in flight per session
+        self._proc = None
+        self._lines = None
+
+    def _spawn(self) -> None:
+        self._proc = subprocess.Popen([self.adb, '-s', self.device_identifier, 'shell'],
+                                      stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        self._lines = queue.Queue()
+        reader = threading.Thread(target=self._read, args=(self._proc, self._lines), daemon=True)
+        reader.start()
+
+    @staticmethod
+    def _read(proc, lines) -> None:
+        for line in iter(proc.stdout.readline, b''):
+            lines.put(line)
+        lines.put(None) #EOF, shell died
+
+    def alive(self) -> bool:
+        return self._proc is not None and self._proc.poll() is None
+
+    def _send(self, command) -> None:
+        #group the command so its stderr is captured and a trailing newline is always present before the marker
+        script = f'{{ {command}\n}} 2>&1; printf "\\n{self.marker} %d\\n" $?\n'
+        self._proc.stdin.write(script.encode())
+        self._proc.stdin.flush()
+
+    def run(self, command, timeout=None) -> subprocess.CompletedProcess:
+        """Output and exit code of command, CommandTimeout (and a killed shell) when it takes more than timeout seconds."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            if not self.alive():
+                self._spawn()
+            try:
+                self._send(command)
+            except OSError: #broken pipe, nothing ran on the device, reconnect and retry once
+                self.close()
+                self._spawn()
+                self._send(command)
+
+            output = []
+            while True:
+                try:
+                    line = self._lines.get(timeout=None if deadline is None else max(0, deadline - time.monotonic()))
+                except queue.Empty: #hung command, the next call starts a fresh shell
+                    self.close()
+                    raise CommandTimeout(f'{command!r} on {self.device_identifier} timed out after {timeout}s',
+                                         self.device_identifier, command, output=b''.join(output).decode(errors='replace'))
+                if line is None:
+                    self.close() #next call reconnects
+                    raise ConnectionError(f'adb shell to {self.device_identifier} closed: {b"".join(output).decode(errors="replace").strip()}')
+
+                text = line.decode(errors='replace').rstrip('\r\n')
+                if text.startswith(self.marker):
+                    returncode = int(text.split()[-1])
+                    break
+                output.append(line)
+
+            stdout = b''.join(output).decode(errors='replace').replace('\r\n', '\n')
+            if stdout.endswith('\n'): #added by the framing printf
+                stdout = stdout[:-1]
+            return subprocess.CompletedProcess(command, returncode, stdout, '')
+
+    def close(self) -> None:
+        if self._proc is None:
+            return
+        try:
+            self._proc.stdin.close()
+        except OSError:
+            pass
+        if self._proc.poll() is None:
+            self._proc.kill()
+        self._proc.wait()
+        self._proc = None
@@ -0,0 +1,152 @@
+"""
+Latency and throughput of the adbapi hot paths against fakeadb.DeviceServer, no device or adb binary needed.
+
+    python apibench.py --devices 1,8,32 --iterations 50 --latency 5 --json bench.json
+
+Every operation runs `iterations` times on every device at once through a DeviceFleet (socket backend),
+calls/s is over the wall time of the whole round, p50/p99 over the individual calls.
+"""
+import argparse
+import contextlib
+import io
+import json
+import platform
+import sys
+import time
+
+from adbclient import AdbClient
+from fakeadb import DeviceServer
+from fleet import DeviceFleet
+
+OPERATIONS = ('tap', 'swipe', 'screenshot', 'resolution', 'dumpsys', 'push', 'ocr')
+OCR_REGIONS = [(30, 30, 330, 70), (670, 30, 970, 70), (1310, 30, 1610, 70), (30, 246, 330, 286)]
+PUSH_FILES = {f'/data/local/tmp/bench/asset{i}.bin': bytes(64 * 1024) for i in range(8)} #one sync session per call
+
+
+def percentile(values, fraction) -> float:
+    """Nearest rank percentile of an unsorted list."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+def _ocr_engine():
+    """Shared OcrEngine, or the reason OCR cannot be benchmarked here."""
+    engine = None
+    try:
+        from PIL import Image
+        from ocr import OcrEngine
+        engine = OcrEngine(workers=2, cache=None)
+        engine.read_regions(Image.new('L', (400, 100), 255), OCR_REGIONS[:1])
+        return engine, None
+    except Exception as e: #tesseract or pytesseract missing...
+        if engine is not None:
+            engine.close()
+        return None, f'{type(e).__name__}: {e}'
+
+
+def operation(name, engine=None):
+    """function(device) for one benchmarked call."""
+    if name == 'tap':
+        return lambda device: device.screenInput(960, 540)
+    if name == 'swipe':
+        return lambda device: device.screenSwipe(100, 540, 1800, 540)
+    if name == 'screenshot':
+        return lambda device: device.screenshot(stream=True)
+    if name == 'resolution': #cached path, what callers hit between rotations
+        return lambda device: device.resolution()
+    if name == 'dumpsys': #forced refresh of resolution, rotation and focus
+        return lambda device: device.device_state(f'emulator-{device.port}').refresh()
+    if name == 'push':
+        return lambda device: device.push(PUSH_FILES, skip=None)
+    if name == 'ocr':
+        return lambda device: engine.read_regions(device.screenshot(stream=True), OCR_REGIONS)
+    raise ValueError(f'unknown operation: {name}')
+
+
+def _timed(function, device, iterations) -> tuple:
+    latencies, errors = [], 0
+    for _ in range(iterations):
+        started = time.perf_counter()
+        try:
+            function(device)
+        except Exception:
+            errors += 1
+            continue
+        latencies.append(time.perf_counter() - started)
+    return latencies, errors
+
+
+def run_round(fleet, name, iterations, engine=None) -> dict:
+    function = operation(name, engine)
+    started = time.perf_counter()
+    results = fleet.results(fleet.map(lambda device: _timed(function, device, iterations)))
+    seconds = time.perf_counter() - started
+
+    latencies, errors = [], 0
+    for result in results.values():
+        if isinstance(result, Exception):
+            errors += iterations
+            continue
+        latencies += result[0]
+        errors += result[1]
+    return {'op': name, 'devices': len(results), 'calls': len(latencies), 'errors': errors, 'seconds': round(seconds, 4),
+            'calls_per_s': round(len(latencies) / seconds, 1) if seconds else None,
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 3) if latencies else None,
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 3) if latencies else None}
+
+
+def bench(device_counts=(1, 8, 32), iterations=50, latency_ms=5.0, jitter_ms=1.0, operations=OPERATIONS, warmup=3) -> dict:
+    engine, ocr_skipped = (None, None)
+    if 'ocr' in operations:
+        engine, ocr_skipped = _ocr_engine()
+
+    results = []
+    for count in device_counts:
+        with DeviceServer.emulators(count, latency_ms / 1000, jitter_ms / 1000) as server:
+            client = AdbClient(port=server.port)
+            with contextlib.redirect_stdout(io.StringIO()): #adbapi prints every tap
+                fleet = DeviceFleet([5554 + 2 * i for i in range(count)], adb_path='adb', client=client,
+                                    start_server=False, max_workers=max(count, 1))
+                for identifier, device in fleet.devices.items():
+                    device.scheduler(identifier).limit('input', None) #measure the code path, not the tap pacing
+                try:
+                    for name in operations:
+                        if name == 'ocr' and engine is None:
+                            continue
+                        run_round(fleet, name, warmup, engine)
+                        result = run_round(fleet, name, iterations, engine)
+                        results.append(result)
+                        print(f"{count:>3} devices {name:<11} {result['calls_per_s']:>9} calls/s  p50 {result['p50_ms']:>8} ms  "
+                              f"p99 {result['p99_ms']:>8} ms  errors {result['errors']}", file=sys.stderr)
+                finally:
+                    fleet.close()
+
+    if engine is not None:
+        engine.close()
+    return {'config': {'devices': list(device_counts), 'iterations': iterations, 'latency_ms': latency_ms,
+                       'jitter_ms': jitter_ms, 'python': platform.python_version(), 'platform': platform.platform()},
+            'skipped': {'ocr': ocr_skipped} if ocr_skipped else {},
+            'results': results}
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--devices', default='1,8,32', help='comma separated device counts')
+    parser.add_argument('--iterations', type=int, default=50, help='calls per device per operation')
+    parser.add_argument('--latency', type=float, default=5.0, help='fake device latency per request, ms')
+    parser.add_argument('--jitter', type=float, default=1.0, help='extra uniform random latency, ms')
+    parser.add_argument('--ops', default=','.join(OPERATIONS), help='comma separated: ' + ', '.join(OPERATIONS))
+    parser.add_argument('--json', help='write the results here, - for stdout')
+    args = parser.parse_args(argv)
+
+    report = bench([int(n) for n in args.devices.split(',')], args.iterations, args.latency, args.jitter,
+                   tuple(op.strip() for op in args.ops.split(',')))
+    if args.json == '-':
+        json.dump(report, sys.stdout, indent=1)
+    elif args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
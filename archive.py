@@ -0,0 +1,348 @@
+"""
+Append-only archive of captured frames, written off the hot path and replayable offline.
+
+An archive directory holds frames.bin, every encoded frame back to back, and index.jsonl, one JSON line
+per frame (device, timestamp, format, offset, length, size, region, tags). Both files are only ever
+appended to, an index line is written after its bytes are flushed, so a crash loses at most the frames
+still queued.
+
+    archive = FrameArchive('runs/today', format='webp')
+    device.archive = archive #every screenshot() is queued as well
+    ...
+    archive.close()
+    for record, array in ArchiveReader('runs/today').replay(device='emulator-5554'):
+        ...
+
+Formats: 'raw' pixels (read back as numpy.memmap views, no decode at all), 'webp' (quality, or lossless=True)
+and 'qoi' (lossless, encoded with numpy, a 1080p screen with flat areas takes ~40ms where Pillow's QOI
+writer takes most of a second).
+"""
+import collections
+import io
+import json
+import os
+import queue
+import struct
+import threading
+import time
+
+from lazyimport import lazy_import
+
+np = lazy_import('numpy')
+Image = lazy_import('PIL.Image')
+
+FORMATS = ('raw', 'webp', 'qoi')
+
+ArchiveRecord = collections.namedtuple('ArchiveRecord', ['seq', 'device', 'timestamp', 'format', 'offset', 'length',
+                                                         'width', 'height', 'mode', 'region', 'tags'])
+
+_QOI_END = bytes(7) + b'\x01'
+
+
+def encode_qoi(array) -> bytes:
+    """QOI image of a (h, w, 3) RGB or (h, w, 4) RGBA uint8 array, every op chosen with whole array numpy passes.
+
+    Only pixels that differ from their predecessor need an op of their own, the rest are runs. The encoder's
+    64 entry index holds, per hash, the latest such pixel, so a pixel is an INDEX hit when the previous one
+    with its hash is the same color, found with a stable sort on the hashes.
+    """
+    height, width, channels = array.shape
+    pixels = np.ascontiguousarray(array, dtype=np.uint8).reshape(-1, channels)
+    if channels == 3:
+        pixels = np.concatenate([pixels, np.full((len(pixels), 1), 255, np.uint8)], axis=1)
+    count = len(pixels)
+    packed = pixels.view(np.uint32).ravel()
+    same = np.empty(count, bool)
+    same[0] = packed[0] == np.array([0, 0, 0, 255], np.uint8).view(np.uint32)[0] #the encoder starts from opaque black
+    np.equal(packed[1:], packed[:-1], out=same[1:])
+
+    #runs, flushed at their end or every 62 pixels
+    indexes = np.arange(count, dtype=np.int32)
+    position = indexes - np.maximum.accumulate(np.where(same, np.int32(-1), indexes)) #1.. inside a run
+    run_ends = np.flatnonzero(same & (np.append(~same[1:], True) | (position % 62 == 0)))
+    run_ops = (0xc0 | ((position[run_ends] - 1) % 62)).astype(np.uint8)
+
+    changed = np.flatnonzero(~same)
+    current = pixels[changed]
+    values = packed[changed]
+    with np.errstate(over='ignore'): #uint8 wraps at 256, a multiple of 64, so the hash survives
+        hashes = (current[:, 0] * np.uint8(3) + current[:, 1] * np.uint8(5) + current[:, 2] * np.uint8(7)
+                  + current[:, 3] * np.uint8(11)) & np.uint8(63)
+    order = np.argsort(hashes, kind='stable') #radix sort on uint8
+    follows = hashes[order[1:]] == hashes[order[:-1]] #same hash as the one sorted before it
+    before = np.zeros(len(changed), np.uint32) #index content for the pixel's hash, zeros until first written
+    before[order[1:][follows]] = values[order[:-1][follows]]
+    indexed = before == values
+
+    last = pixels[changed - 1] if len(changed) else current
+    if len(changed) and changed[0] == 0:
+        last[0] = (0, 0, 0, 255)
+    delta = (current - last).view(np.int8) #uint8 subtraction wraps, as the format wants
+    dr, dg, db = delta[:, 0].astype(np.int16), delta[:, 1].astype(np.int16), delta[:, 2].astype(np.int16)
+    alpha_same = delta[:, 3] == 0
+    small = ~indexed & alpha_same & (dr >= -2) & (dr <= 1) & (dg >= -2) & (dg <= 1) & (db >= -2) & (db <= 1)
+    dr_dg, db_dg = dr - dg, db - dg
+    luma = ~indexed & alpha_same & ~small & (dg >= -32) & (dg <= 31) & (dr_dg >= -8) & (dr_dg <= 7) & (db_dg >= -8) & (db_dg <= 7)
+    rgb = ~indexed & alpha_same & ~small & ~luma
+    rgba = ~indexed & ~alpha_same
+
+    rows = np.zeros((len(changed), 5), np.uint8)
+    lengths = np.ones(len(changed), np.uint8)
+    rows[indexed, 0] = hashes[indexed]
+    rows[small, 0] = 0x40 | ((dr[small] + 2) << 4) | ((dg[small] + 2) << 2) | (db[small] + 2)
+    rows[luma, 0] = 0x80 | (dg[luma] + 32)
+    rows[luma, 1] = ((dr_dg[luma] + 8) << 4) | (db_dg[luma] + 8)
+    lengths[luma] = 2
+    rows[rgb, 0] = 0xfe
+    rows[rgb, 1:4] = current[rgb, :3]
+    lengths[rgb] = 4
+    rows[rgba, 0] = 0xff
+    rows[rgba, 1:5] = current[rgba]
+    lengths[rgba] = 5
+
+    #one op row per changed pixel and per run end, back in pixel order
+    ops = np.concatenate([rows, np.pad(run_ops[:, None], ((0, 0), (0, 4)))])
+    lengths = np.concatenate([lengths, np.ones(len(run_ends), np.uint8)])
+    ordered = np.argsort(np.concatenate([changed, run_ends]), kind='stable')
+    ops, lengths = ops[ordered], lengths[ordered]
+    body = ops[np.arange(5) < lengths[:, None]] #row major, so the bytes stay in op order
+    #colorspace 0 (sRGB, linear alpha) as screens are, Pillow writes 1 (all linear), the ops are the same
+    return b'qoif' + struct.pack('>IIBB', width, height, channels, 0) + body.tobytes() + _QOI_END
+
+
+def _pixels(frame) -> tuple:
+    """(array view, mode) of a capture Frame, RawFrame, DecodedFrame, PIL image or numpy array."""
+    raw = getattr(frame, 'raw', frame) #capture.Frame
+    if hasattr(raw, 'to_array'):
+        return raw.to_array(), raw.rawmode
+    if hasattr(frame, 'getbands'): #PIL
+        return np.asarray(frame), frame.mode
+    array = np.asarray(frame)
+    return array, 'L' if array.ndim == 2 else {1: 'L', 3: 'RGB', 4: 'RGBA'}[array.shape[2]]
+
+
+def _normalize(array, mode) -> tuple:
+    """RGB/RGBA/L array in display channel order."""
+    if mode == 'BGRA':
+        return array[..., [2, 1, 0, 3]], 'RGBA'
+    if mode == 'RGBX':
+        return array[..., :3], 'RGB'
+    if array.ndim == 3 and array.shape[2] == 1:
+        return array[..., 0], 'L'
+    return array, mode
+
+
+class FrameArchive:
+    """Queues frames from any thread and encodes and appends them on its own writer thread.
+
+    add() costs a crop and a copy, when the writer falls behind and queue_size frames are waiting new frames
+    are dropped (counted in dropped) rather than slowing the capture down. region (x1, y1, x2, y2 frame
+    pixels) keeps only that part of every frame, add() can override it per frame.
+    """
+
+    def __init__(self, directory, format='raw', region=None, queue_size=16, quality=80, lossless=False) -> None:
+        if format not in FORMATS:
+            raise ValueError(f'unknown archive format: {format}')
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.format = format
+        self.region = region
+        self.quality = quality
+        self.lossless = lossless
+        self.written = 0
+        self.dropped = 0
+        self.error = None #exception that stopped the writer thread
+
+        self._data = open(os.path.join(directory, 'frames.bin'), 'ab')
+        self._index = open(os.path.join(directory, 'index.jsonl'), 'a')
+        self._offset = self._data.tell()
+        self._seq = sum(1 for _ in read_index(directory))
+        self._pending = [] #index lines waiting for their bytes to be flushed
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._followers = []
+        self._stopping = False #followers exit, set before _closed so none of them adds to a closed archive
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True, name='archive')
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def add(self, frame, device=None, timestamp=None, region=None, copy=True, **tags) -> bool:
+        """Queue a frame, False when it was dropped. copy=False for buffers nobody reuses (a fresh screencap),
+        frames from a FrameCapture ring must be copied. tags are stored with the record."""
+        if self.error is not None:
+            raise self.error
+        if self._closed:
+            raise ValueError('archive is closed')
+        array, mode = _pixels(frame)
+        region = region or self.region
+        if region:
+            x1, y1, x2, y2 = (int(round(v)) for v in region)
+            array = array[y1:y2, x1:x2]
+        if copy:
+            array = np.array(array)
+        timestamp = timestamp or getattr(frame, 'timestamp', None) or time.time()
+        try:
+            self._queue.put_nowait((device, timestamp, array, mode, list(region) if region else None, tags))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def follow(self, capture, device=None, every=1) -> threading.Thread:
+        """Archive every `every`-th frame (by capture index) of a running FrameCapture / VideoCapture until close().
+        Frames captured while one is being added are picked up after it, unless the ring overwrote them."""
+        def run():
+            last = max(0, capture.index - 1) #starting with the current frame
+            while not self._stopping and self.error is None:
+                frame = capture.wait_next(last, timeout=0.5)
+                if frame is None:
+                    if capture.error is not None or not capture.running:
+                        return
+                    continue
+                last = frame.index
+                if (frame.index - 1) % every == 0:
+                    self.add(frame, device, frame.timestamp)
+        thread = threading.Thread(target=run, daemon=True, name='archive-follow')
+        self._followers.append(thread)
+        thread.start()
+        return thread
+
+    def _encode(self, array, mode) -> bytes:
+        if self.format == 'raw':
+            return memoryview(np.ascontiguousarray(array)).cast('B')
+        if self.format == 'qoi' and mode in ('RGB', 'RGBA'):
+            return encode_qoi(array)
+        out = io.BytesIO()
+        image = Image.fromarray(np.ascontiguousarray(array), mode)
+        if self.format == 'qoi': #grayscale, QOI has no such channel count
+            image.convert('RGB').save(out, 'QOI')
+        else:
+            image.save(out, 'WEBP', quality=self.quality, lossless=self.lossless, method=0) #method 0 is the fastest
+        return out.getvalue()
+
+    def _write(self, device, timestamp, array, mode, region, tags) -> None:
+        array, mode = _normalize(array, mode)
+        payload = self._encode(array, mode)
+        self._data.write(payload)
+        length = memoryview(payload).nbytes
+        record = {'seq': self._seq, 'device': device, 'timestamp': timestamp, 'format': self.format,
+                  'offset': self._offset, 'length': length, 'width': array.shape[1], 'height': array.shape[0],
+                  'mode': mode, 'region': region, 'tags': tags}
+        self._pending.append(json.dumps(record))
+        self._offset += length
+        self._seq += 1
+        self.written += 1
+
+    def _flush(self) -> None:
+        if not self._pending:
+            return
+        self._data.flush() #bytes first, an index line never points past the end of frames.bin
+        self._index.write('\n'.join(self._pending) + '\n')
+        self._index.flush()
+        self._pending = []
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    self._flush()
+                    return
+                self._write(*item)
+                if self._queue.empty():
+                    self._flush()
+            except Exception as e:
+                self.error = e
+                return
+
+    def close(self) -> None:
+        """Write everything queued, then close the files."""
+        if self._stopping:
+            return
+        self._stopping = True
+        for thread in self._followers:
+            thread.join()
+        self._closed = True
+        if self.error is None:
+            self._queue.put(None)
+        self._thread.join()
+        self._data.close()
+        self._index.close()
+
+
+def read_index(directory):
+    """Index lines as dicts, a torn last line (crash mid write) is skipped."""
+    path = os.path.join(directory, 'index.jsonl')
+    if not os.path.exists(path):
+        return
+    with open(path) as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+class ArchiveReader:
+    """Random access and replay over an archive directory, also while a FrameArchive is still appending."""
+
+    def __init__(self, directory) -> None:
+        self.directory = directory
+        self._memmap = None
+        self.records = []
+        self.reload()
+
+    def reload(self) -> None:
+        fields = ArchiveRecord._fields
+        self.records = [ArchiveRecord(**{name: entry.get(name) for name in fields}) for entry in read_index(self.directory)]
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __iter__(self):
+        return self.replay()
+
+    def devices(self) -> list:
+        return sorted({record.device for record in self.records}, key=str)
+
+    def select(self, device=None, start=None, end=None) -> list:
+        """Records of device (every device when None) with start <= timestamp < end."""
+        return [record for record in self.records
+                if (device is None or record.device == device)
+                and (start is None or record.timestamp >= start) and (end is None or record.timestamp < end)]
+
+    def _bytes(self, record):
+        end = record.offset + record.length
+        if self._memmap is None or len(self._memmap) < end: #(re)mapped as frames.bin grows
+            self._memmap = np.memmap(os.path.join(self.directory, 'frames.bin'), dtype=np.uint8, mode='r')
+        return self._memmap[record.offset:end]
+
+    def array(self, record):
+        """(h, w[, c]) uint8 pixels, raw records are read only views straight into the memory map."""
+        data = self._bytes(record)
+        if record.format == 'raw':
+            channels = {'L': 1, 'RGB': 3, 'RGBA': 4}[record.mode]
+            shape = (record.height, record.width) if channels == 1 else (record.height, record.width, channels)
+            return data.reshape(shape)
+        return np.asarray(Image.open(io.BytesIO(data.tobytes())))
+
+    def image(self, record) -> Image:
+        return Image.fromarray(np.asarray(self.array(record)), record.mode)
+
+    def replay(self, device=None, start=None, end=None, speed=None):
+        """(record, array) in recording order, speed=1.0 sleeps to reproduce the original timing (2.0 twice as
+        fast), None delivers as fast as the consumer takes them."""
+        started = first = None
+        for record in self.select(device, start, end):
+            if speed:
+                if first is None:
+                    started, first = time.monotonic(), record.timestamp
+                wait = (record.timestamp - first) / speed - (time.monotonic() - started)
+                if wait > 0:
+                    time.sleep(wait)
+            yield record, self.array(record)
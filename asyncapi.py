@@ -0,0 +1,211 @@
+import asyncio
+import os
+
+from adbapi import BaseDevice, Phone, parse_resolution
+from devicestate import WINDOW_QUERY, parse_window_dump
+from discovery import emulator_ports, parse_device_list
+from adbclient import encode_request, shell_service, parse_shell_output
+from resilience import CommandFailed, classify
+from screencap import RawFrame
+from transform import Transform
+from tools import find_tool
+import instrument
+
+
+class AsyncBaseDevice:
+    """asyncio counterpart of BaseDevice, every call is one non blocking connection to the adb server.
+
+    Calls take a timeout (seconds, default self.timeout), on timeout or cancellation the connection is closed
+    and asyncio.TimeoutError / CancelledError propagates.
+    """
+
+    def __init__(self, adb_path=None, host='127.0.0.1', server_port=None, timeout=10) -> None:
+        self.BASE_RESOLUTION_EMU = [1920,1080] #scale 16:9 aspect ratio
+        self.BASE_RESOLUTION_PHN = [2400,1080] #scale, device samsung galaxy s21, 9:20 aspect ratio
+        self.ORIENTATION = ''
+        self.LANDSCAPE = True #see BaseDevice
+
+        self.res_scalar_x = 1 #default 1
+        self.res_scalar_y = 1 #default 1
+        self.transform = Transform() #base resolution -> screen pixels, see BaseDevice.fit
+        self.fit_mode = 'stretch'
+        self.insets = None
+        self._currentapp = '' #default ''
+
+        self.adb = adb_path
+        self.host = host
+        self.server_port = server_port or int(os.environ.get('ANDROID_ADB_SERVER_PORT', 5037))
+        self.timeout = timeout
+
+    async def _status(self, reader, device_identifier=None) -> None:
+        status = await reader.readexactly(4)
+        if status == b'FAIL': #DeviceOffline, DeviceUnauthorized... see resilience.classify
+            length = int(await reader.readexactly(4), 16)
+            raise classify((await reader.readexactly(length)).decode(errors='replace'), device_identifier)
+        if status != b'OKAY':
+            raise ConnectionError(f'unexpected adb server reply: {status!r}')
+
+    async def _request(self, device_identifier, service, host_reply=False) -> bytes:
+        reader, writer = await asyncio.open_connection(self.host, self.server_port)
+        try:
+            if device_identifier is not None:
+                writer.write(encode_request(f'host:transport:{device_identifier}'))
+                await self._status(reader, device_identifier)
+            writer.write(encode_request(service))
+            await self._status(reader, device_identifier)
+            if host_reply: #length prefixed reply of host: services
+                length = int(await reader.readexactly(4), 16)
+                return await reader.readexactly(length)
+            return await reader.read()
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+
+    async def _call(self, coroutine, timeout):
+        return await asyncio.wait_for(coroutine, self.timeout if timeout is None else timeout)
+
+    async def start_server(self, timeout=None) -> None:
+        """Start the adb server unless one is already listening."""
+        try:
+            await self._call(self._request(None, 'host:version', host_reply=True), timeout)
+            return
+        except OSError:
+            pass
+        self.adb = self.adb or find_tool('adb', os.getcwd())
+        if not self.adb:
+            raise FileNotFoundError("adb not found on PATH, ADBAPI_ADB, adbapi.json or under the current directory.")
+        proc = await asyncio.create_subprocess_exec(self.adb, 'start-server')
+        try:
+            await self._call(proc.wait(), timeout) #always reaped, no zombies
+        except BaseException:
+            proc.kill()
+            await proc.wait()
+            raise
+        if proc.returncode != 0:
+            raise ConnectionError(f'adb start-server exited with {proc.returncode}')
+
+    async def devices(self, timeout=None) -> str:
+        reply = await self._call(self._request(None, 'host:devices', host_reply=True), timeout)
+        return reply.decode(errors='replace')
+
+    async def shell(self, device_identifier, command, timeout=None):
+        with instrument.span('shell', device_identifier, command, backend='async'):
+            output = await self._call(self._request(device_identifier, shell_service(command)), timeout)
+        return parse_shell_output(device_identifier, command, output)
+
+    async def _checked_shell(self, device_identifier, command, timeout) -> str:
+        result = await self.shell(device_identifier, command, timeout)
+        if result.returncode != 0:
+            raise CommandFailed(f'{command!r} on {device_identifier} exited with {result.returncode}', device_identifier, command,
+                                result.returncode, result.stdout)
+        return result.stdout
+
+    async def screencap(self, device_identifier, timeout=None) -> RawFrame:
+        with instrument.span('exec.transfer', device_identifier, 'screencap', backend='async'): #wait included
+            return RawFrame(await self._call(self._request(device_identifier, 'exec:screencap'), timeout))
+
+    async def screenshot(self, device_identifier, as_array=False, timeout=None):
+        frame = await self.screencap(device_identifier, timeout)
+        with instrument.span('screenshot.decode', device_identifier, as_array=as_array):
+            return frame.to_array() if as_array else frame.to_image()
+
+    async def resolution(self, device_identifier, timeout=None) -> list:
+        return parse_resolution(await self._checked_shell(device_identifier, 'wm size', timeout))
+
+    async def window_state(self, device_identifier, timeout=None) -> dict:
+        """resolution, rotation and focus from one filtered dumpsys, parsed like the sync DeviceState."""
+        result = await self.shell(device_identifier, WINDOW_QUERY, timeout)
+        if result.returncode not in (0, 1): #grep exits 1 when nothing matched
+            raise CommandFailed(f'dumpsys window on {device_identifier} exited with {result.returncode}', device_identifier,
+                                WINDOW_QUERY, result.returncode, result.stdout)
+        return parse_window_dump(result.stdout)
+
+    async def orientation(self, device_identifier, timeout=None) -> str:
+        return (await AsyncBaseDevice.window_state(self, device_identifier, timeout)).get('rotation', '')
+
+    async def current_focus(self, device_identifier, timeout=None) -> str:
+        return (await AsyncBaseDevice.window_state(self, device_identifier, timeout)).get('focus', '')
+
+    async def tap(self, device_identifier, x, y, timeout=None) -> None:
+        await self._checked_shell(device_identifier, f'input tap {x} {y}', timeout)
+
+    async def swipe(self, device_identifier, x1, y1, x2, y2, timeout=None) -> None:
+        await self._checked_shell(device_identifier, f'input touchscreen swipe {x1} {y1} {x2} {y2}', timeout)
+
+
+class _AsyncScaledDevice(AsyncBaseDevice):
+    """Shared part of AsyncPhone and AsyncEmulator, self.identifier is set by create()."""
+
+    identifier = None
+
+    async def screenshot(self, as_array=False, timeout=None):
+        return await super().screenshot(self.identifier, as_array, timeout)
+
+    async def resolution(self, timeout=None) -> list:
+        return await super().resolution(self.identifier, timeout)
+
+    async def window_state(self, timeout=None) -> dict:
+        return await super().window_state(self.identifier, timeout)
+
+    async def orientation(self, timeout=None) -> str:
+        return await super().orientation(self.identifier, timeout)
+
+    async def current_focus(self, timeout=None) -> str:
+        return await super().current_focus(self.identifier, timeout)
+
+    fit = BaseDevice.fit
+
+    async def tap(self, x, y, timeout=None) -> None: #scaled
+        await super().tap(self.identifier, *self.transform.point(x, y), timeout)
+
+    async def swipe(self, x1, y1, x2, y2, timeout=None) -> None:
+        (x1, y1), (x2, y2) = self.transform.apply([(x1, y1), (x2, y2)]).tolist()
+        await super().swipe(self.identifier, x1, y1, x2, y2, timeout)
+
+
+class AsyncPhone(_AsyncScaledDevice):
+    @classmethod
+    async def create(cls, name=None, force_pc_resolution=True, adb_path=None, timeout=10, server_port=None):
+        """Connect like Phone(name, force_pc_resolution), picks the first online non emulator device when name is None."""
+        self = cls(adb_path, server_port=server_port, timeout=timeout)
+        self.LANDSCAPE = force_pc_resolution
+        await self.start_server()
+        if name is None:
+            phones = [serial for serial, info in parse_device_list(await self.devices()).items()
+                      if info.state == 'device' and info.transport != 'emulator'] #same pick as Phone.find_device
+            if not phones:
+                raise ConnectionError
+            name = phones[0]
+            print(f'Connecting to default unit: {name}')
+        self.name = self.identifier = name
+
+        phone_resolution, window = await asyncio.gather(self.resolution(), self.window_state())
+        self.ORIENTATION, self._currentapp = window.get('rotation', ''), window.get('focus', '')
+        self.fit_orientation(phone_resolution)
+        return self
+
+    fit_orientation = Phone.fit_orientation
+
+
+class AsyncEmulator(_AsyncScaledDevice):
+    @classmethod
+    async def create(cls, port, adb_path=None, timeout=10, server_port=None):
+        """Connect like Emulator(port, -1)."""
+        self = cls(adb_path, server_port=server_port, timeout=timeout)
+        await self.start_server()
+        self.port = port
+        self.identifier = f'emulator-{port}'
+        await self._call(self._request(None, f'host:connect:127.0.0.1:{port}', host_reply=True), None)
+
+        emulator_resolution = await self.resolution() #[x,y]
+        self.fit(emulator_resolution)
+        return self
+
+    @staticmethod
+    async def running_ports(adb_path=None, timeout=10, server_port=None) -> list:
+        device = AsyncBaseDevice(adb_path, server_port=server_port, timeout=timeout)
+        await device.start_server()
+        return emulator_ports(parse_device_list(await device.devices()))
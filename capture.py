@@ -0,0 +1,177 @@
+import threading
+import time
+
+from screencap import RawFrame, frame_size
+
+
+class Frame:
+    """One captured frame, its pixels live in a ring buffer slot that is reused `slots - 1` frames later."""
+
+    def __init__(self, index, timestamp, raw, slot) -> None:
+        self.index = index #sequence number, 1 for the first frame
+        self.timestamp = timestamp #time.time() when the capture finished
+        self.raw = raw
+        self._slot = slot
+
+    @property
+    def array(self):
+        return self.raw.to_array()
+
+    def image(self):
+        return self.raw.to_image()
+
+    def valid(self) -> bool:
+        """False once the slot has been overwritten by a newer frame."""
+        return self._slot.index == self.index
+
+    def copy(self):
+        return self.raw.to_array().copy()
+
+
+class _Slot:
+    def __init__(self, size) -> None:
+        self.buffer = bytearray(size)
+        self.index = 0
+
+
+class FrameCapture:
+    """Background thread that keeps grabbing frames into a fixed ring of preallocated buffers.
+
+    grab(buffer) must fill buffer with raw screencap output and return a RawFrame over it, when buffer is None
+    it may allocate. Consumers read with latest(), wait_newer(), wait_next() or frames(), the oldest frame is dropped when
+    they fall behind.
+    """
+
+    def __init__(self, grab, slots=4, interval=0) -> None:
+        if slots < 2:
+            raise ValueError('a ring buffer needs at least 2 slots')
+        self.grab = grab
+        self.interval = interval #minimum seconds between captures, 0 captures back to back
+        self.slot_count = slots
+
+        self.slots = []
+        self.index = 0 #index of the latest frame
+        self.dropped = 0 #frames skipped by frames() consumers
+        self.error = None #exception that stopped the capture thread
+
+        self._frames = [None] * slots
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    def _allocate(self, size) -> None:
+        self.slots = [_Slot(size) for _ in range(self.slot_count)]
+
+    def _capture_once(self) -> None:
+        index = self.index + 1
+        slot = self.slots[index % self.slot_count] if self.slots else None
+        if slot is None:
+            raw = self.grab(None)
+        else:
+            slot.index = -1 #being written, frames still pointing here are invalid
+            try:
+                raw = self.grab(slot.buffer)
+            except BufferError: #frame grew (resolution change), reallocate the ring
+                raw = self.grab(None)
+                slot = None
+
+        if slot is None: #first frame or reallocation, move it into the ring
+            self._allocate(frame_size(raw.width, raw.height, raw.pixel_format))
+            slot = self.slots[index % self.slot_count]
+            slot.buffer[:len(raw.data)] = raw.data
+            raw = RawFrame(memoryview(slot.buffer)[:len(raw.data)])
+        self._publish(index, raw, slot)
+
+    def _publish(self, index, raw, slot) -> None:
+        """Make the frame written into slot the latest one and wake the consumers."""
+        with self._cond:
+            slot.index = index
+            self._frames[index % self.slot_count] = Frame(index, time.time(), raw, slot)
+            self.index = index
+            self._cond.notify_all()
+
+    def _run(self) -> None:
+        while self._running:
+            started = time.monotonic()
+            try:
+                self._capture_once()
+            except Exception as e:
+                self.error = e
+                with self._cond:
+                    self._running = False
+                    self._cond.notify_all()
+                return
+            wait = self.interval - (time.monotonic() - started)
+            if wait > 0:
+                time.sleep(wait)
+
+    @property
+    def running(self) -> bool:
+        """True from start() until stop() or an error ends the capture thread."""
+        return self._running
+
+    def start(self):
+        if self._running:
+            return self
+        self._running = True
+        self.error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def _check(self) -> None:
+        if self.error is not None:
+            raise self.error
+
+    def latest(self) -> Frame:
+        """Newest frame, None before the first capture."""
+        with self._cond:
+            return self._frames[self.index % self.slot_count] if self.index else None
+
+    def wait_newer(self, index=0, timeout=None) -> Frame:
+        """Block until a frame newer than index exists and return the newest one, None on timeout."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.index > index or not self._running, timeout):
+                return None
+            if self.index <= index: #stopped
+                self._check()
+                return None
+            return self._frames[self.index % self.slot_count]
+
+    def wait_next(self, index=0, timeout=None) -> Frame:
+        """Block until a frame newer than index exists and return the one right after it, or the oldest one still
+        in the ring when that was overwritten, None on timeout."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.index > index or not self._running, timeout):
+                return None
+            if self.index <= index: #stopped
+                self._check()
+                return None
+            oldest = self.index - self.slot_count + 2 #the slot after the latest is being overwritten
+            return self._frames[max(index + 1, oldest) % self.slot_count]
+
+    def frames(self, timeout=None):
+        """Yield every frame in order, skipping (and counting in dropped) the ones already overwritten."""
+        index = self.index
+        while True:
+            frame = self.wait_next(index, timeout)
+            if frame is None:
+                return
+            with self._cond:
+                self.dropped += frame.index - index - 1
+            index = frame.index
+            yield frame
@@ -0,0 +1,171 @@
+import time
+
+from lazyimport import lazy_import
+from transform import Transform
+
+np = lazy_import('numpy')
+
+
+def signature(array, step) -> 'np.ndarray':
+    """Cheap int16 luma of every step-th pixel of a (h, w, channels) uint8 frame, what frames are diffed on."""
+    pixels = array[::step, ::step]
+    if pixels.ndim == 2:
+        return pixels.astype(np.int16)
+    pixels = pixels.astype(np.int16)
+    return (pixels[..., 0] + 2 * pixels[..., 1] + pixels[..., 2]) >> 2
+
+
+def tile_diff(previous, current, cells) -> 'np.ndarray':
+    """Max absolute difference per tile of cells x cells signature pixels, edge tiles are padded."""
+    diff = np.abs(current - previous)
+    rows, cols = -(-diff.shape[0] // cells), -(-diff.shape[1] // cells)
+    padded = np.zeros((rows * cells, cols * cells), dtype=diff.dtype)
+    padded[:diff.shape[0], :diff.shape[1]] = diff
+    return padded.reshape(rows, cells, cols, cells).max(axis=(1, 3))
+
+
+def overlaps(box, region) -> bool:
+    return box[0] < region[2] and region[0] < box[2] and box[1] < region[3] and region[1] < box[3]
+
+
+class ChangeDetector:
+    """Tells when the screen changed or settled by diffing consecutive frames tile by tile.
+
+    source is a FrameCapture (started by the detector when needed) or a callable returning a (h, w, channels)
+    array, e.g. lambda: phone.screenshot(stream=True, as_array=True). Frames are compared on every step-th
+    pixel, a tile counts as dirty when one of its pixels moved more than threshold luma levels.
+    Regions and dirty tiles are (x1, y1, x2, y2) in base resolution, given the device's transform or res scalars.
+    close() stops the capture if the detector started it or close_source is set.
+    """
+
+    def __init__(self, source, tile=64, step=4, threshold=24, res_scalar_x=1, res_scalar_y=1, close_source=False,
+                 transform=None) -> None:
+        if tile % step:
+            raise ValueError('tile must be a multiple of step')
+        self.source = source
+        self.tile = tile #frame pixels
+        self.step = step
+        self.threshold = threshold
+        self.transform = transform or Transform.scale(res_scalar_x, res_scalar_y) #base resolution -> frame pixels
+
+        self.index = 0 #capture index of the last frame read
+        self.frame = None #last Frame (or array for callable sources)
+        self.dirty = [] #tiles that changed between the last two frames read
+
+        self._signature = None
+        self._started = close_source
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self._started:
+            self.source.stop()
+            self._started = False
+
+    def _read(self, timeout=None) -> tuple:
+        """Next (frame, signature), None on timeout."""
+        if not hasattr(self.source, 'wait_newer'):
+            array = self.source()
+            return array, signature(array, self.step)
+
+        if not self.source.running and self.source.error is None:
+            self.source.start()
+            self._started = True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0, deadline - time.monotonic())
+            frame = self.source.wait_newer(self.index, remaining)
+            if frame is None:
+                return None
+            sig = signature(frame.array, self.step)
+            self.index = frame.index
+            if frame.valid(): #not overwritten while we read it
+                return frame, sig
+
+    def _to_frame(self, region) -> tuple:
+        """Base resolution region to signature slice bounds."""
+        x1, y1, x2, y2 = self.transform.rect(*region)
+        return (max(0, int(x1)) // self.step, max(0, int(y1)) // self.step, -(-int(x2) // self.step), -(-int(y2) // self.step))
+
+    def _changed(self, previous, current, region) -> bool:
+        if previous.shape != current.shape: #resolution or rotation change
+            return True
+        if region is not None:
+            x1, y1, x2, y2 = self._to_frame(region)
+            previous, current = previous[y1:y2, x1:x2], current[y1:y2, x1:x2]
+        return current.size > 0 and int(np.abs(current - previous).max()) > self.threshold
+
+    def dirty_tiles(self, previous, current) -> list:
+        """Boxes of the tiles that differ between two signatures, the whole screen when their shapes differ."""
+        height, width = current.shape[0] * self.step, current.shape[1] * self.step
+        if previous is None or previous.shape != current.shape:
+            return [self.transform.inverse().rect(0, 0, width, height)]
+        grid = tile_diff(previous, current, self.tile // self.step)
+        rows, cols = np.nonzero(grid > self.threshold)
+        if not len(rows):
+            return []
+        x1, y1 = cols * self.tile, rows * self.tile
+        boxes = np.stack([x1, y1, np.minimum(x1 + self.tile, width), np.minimum(y1 + self.tile, height)], axis=1)
+        return [tuple(box) for box in self.transform.inverse().rects(boxes).tolist()]
+
+    def update(self, timeout=None) -> list:
+        """Read the next frame, returns (and keeps in self.dirty) the tiles changed since the previous one."""
+        read = self._read(timeout)
+        if read is None:
+            return []
+        self.frame, current = read
+        self.dirty = self.dirty_tiles(self._signature, current)
+        self._signature = current
+        return self.dirty
+
+    def is_dirty(self, region) -> bool:
+        """Whether region overlaps a tile changed on the last update, regions that are not can skip OCR/matching."""
+        return any(overlaps(box, region) for box in self.dirty)
+
+    def wait_for_change(self, region=None, timeout=5.0):
+        """Block until region (the whole screen when None) differs from how it looks now.
+
+        Returns the first changed frame, None on timeout.
+        """
+        deadline = time.monotonic() + timeout
+        read = self._read(timeout)
+        if read is None:
+            return None
+        baseline = read[1]
+        while True:
+            read = self._read(max(0, deadline - time.monotonic()))
+            if read is None:
+                return None
+            frame, current = read
+            if self._changed(baseline, current, region):
+                self.dirty = self.dirty_tiles(baseline, current)
+                self.frame, self._signature = frame, current
+                return frame
+            if time.monotonic() >= deadline:
+                return None
+
+    def wait_until_stable(self, region=None, ms=300, timeout=10.0):
+        """Block until region did not change for ms milliseconds, returns the settled frame, None on timeout."""
+        deadline = time.monotonic() + timeout
+        read = self._read(timeout)
+        if read is None:
+            return None
+        frame, previous = read
+        still_since = time.monotonic()
+        while True:
+            if time.monotonic() - still_since >= ms / 1000:
+                self.frame, self._signature, self.dirty = frame, previous, []
+                return frame
+            read = self._read(max(0, deadline - time.monotonic()))
+            if read is None:
+                return None
+            frame, current = read
+            if self._changed(previous, current, region):
+                still_since = time.monotonic()
+            previous = current
+            if time.monotonic() >= deadline:
+                return None
@@ -0,0 +1,128 @@
+import re
+import threading
+import time
+
+WINDOW_QUERY = 'dumpsys window | grep -E "mCurrentFocus|mCurrentRotation|mRotation=| init="'
+
+DEFAULT_TTLS = {'resolution': 30.0, 'rotation': 2.0, 'focus': 1.0} #seconds
+
+
+def parse_resolution(wm_size) -> list:
+    """[x, y] from `wm size` output, x is the biggest."""
+    res = wm_size.split()[-1] #formattex in mxn, type=str
+    res_list = res.replace('x', ' ').split()
+    res_list_int = list(map(int, res_list))
+    res_list_int.sort(reverse=True) #sort x,y
+
+    return res_list_int
+
+
+def parse_window_dump(text) -> dict:
+    """resolution ([x, y], x biggest), rotation ('ROTATION_90') and focus (the mCurrentFocus line) from `dumpsys window`."""
+    state = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith('mCurrentFocus=') and 'focus' not in state:
+            state['focus'] = line
+            continue
+        rotation = re.search(r'\bm(?:Current)?Rotation=(ROTATION_\d+|\d)\b', line)
+        if rotation and 'rotation' not in state:
+            value = rotation.group(1)
+            state['rotation'] = value if value.startswith('ROTATION_') else f'ROTATION_{int(value) * 90}'
+        sizes = dict((name, (int(x), int(y))) for name, x, y in re.findall(r'\b(init|base)=(\d+)x(\d+)', line))
+        if sizes and 'resolution' not in state:
+            state['resolution'] = sorted(sizes.get('base', sizes.get('init')), reverse=True) #override size wins
+    return state
+
+
+class DeviceState:
+    """Resolution, rotation and focus of one device from a single filtered dumpsys, cached per field TTL.
+
+    Listeners get callback(state, changed) with the set of fields whose value changed on a refresh, that is
+    where dependants (resolution scalars, touch rotation...) recompute. Hot paths read cached() and leave the
+    refreshing to start_watch(), so a tap never waits for a dumpsys.
+    """
+
+    def __init__(self, shell, ttls=None) -> None:
+        self.shell = shell #shell(command) -> CompletedProcess
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.values = {}
+        self.updated = {} #field -> time.monotonic() of the refresh that set it
+        self.listeners = []
+
+        self._lock = threading.Lock()
+        self._watch = None
+
+    def subscribe(self, callback) -> None:
+        self.listeners.append(callback)
+
+    def stale(self, field) -> bool:
+        ttl = self.ttls.get(field)
+        updated = self.updated.get(field)
+        return updated is None or (ttl is not None and time.monotonic() - updated > ttl)
+
+    def invalidate(self, *fields) -> None:
+        """Force a refresh on next access, of every field when none are given."""
+        for field in fields or list(self.updated):
+            self.updated.pop(field, None)
+
+    def refresh(self, field=None) -> set:
+        """Query the device now, returns the changed fields. With a field only if it is still stale once the
+        lock is held, threads that found it stale together cost one query."""
+        with self._lock:
+            if field is not None and not self.stale(field):
+                return set()
+            dump = self.shell(WINDOW_QUERY)
+            if dump.returncode not in (0, 1): #grep exits 1 when nothing matched
+                raise ConnectionError(f'dumpsys window exited with {dump.returncode}')
+            fresh = dict({'rotation': '', 'focus': ''}, **parse_window_dump(dump.stdout))
+            if 'resolution' not in fresh: #no display section, fall back to wm size
+                size = self.shell('wm size')
+                if size.returncode != 0:
+                    raise ConnectionError(f'wm size exited with {size.returncode}')
+                fresh['resolution'] = parse_resolution(size.stdout)
+
+            now = time.monotonic()
+            changed = set()
+            for field, value in fresh.items():
+                if field in self.values and self.values[field] != value:
+                    changed.add(field)
+                self.values[field] = value
+                self.updated[field] = now
+
+        if changed:
+            for callback in self.listeners:
+                callback(self, changed)
+        return changed
+
+    def get(self, field):
+        if self.stale(field):
+            self.refresh(field)
+        return self.values.get(field)
+
+    def cached(self, field):
+        """The value from the last refresh however old, queries the device only when there has been none."""
+        if field not in self.values:
+            self.refresh(field)
+        return self.values.get(field)
+
+    def start_watch(self, interval=1.0) -> None:
+        """Refresh in the background so listeners fire without anyone asking."""
+        if self._watch is not None:
+            return
+        stop = threading.Event()
+
+        def watch():
+            while not stop.wait(interval):
+                try:
+                    self.refresh()
+                except ConnectionError:
+                    pass
+
+        self._watch = stop
+        threading.Thread(target=watch, daemon=True).start()
+
+    def stop_watch(self) -> None:
+        if self._watch is not None:
+            self._watch.set()
+            self._watch = None
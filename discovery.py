@@ -0,0 +1,173 @@
+import collections
+import socket
+import threading
+
+from adbclient import AdbClient, encode_request, check_status, read_exact
+
+DeviceInfo = collections.namedtuple('DeviceInfo', ['serial', 'state', 'transport', 'model', 'product', 'device', 'transport_id'])
+
+
+def transport_type(serial) -> str:
+    if serial.startswith('emulator-'):
+        return 'emulator'
+    if ':' in serial or '._tcp' in serial: #adb connect host:port, or an mdns wireless debugging name
+        return 'tcp'
+    return 'usb'
+
+
+def parse_device_list(text) -> dict:
+    """serial -> DeviceInfo from `adb devices [-l]` / host:devices[-l] / host:track-devices[-l] text."""
+    devices = {}
+    for line in text.splitlines():
+        parts = line.split()
+        if len(parts) < 2 or line.startswith(('List of devices', '*')):
+            continue
+        serial, state = parts[0], parts[1]
+        if state == 'no' and parts[2:3] == ['permissions']: #"no permissions (...)" on linux without udev rules
+            state = 'no permissions'
+        fields = dict(part.split(':', 1) for part in parts[2:] if ':' in part)
+        transport_id = fields.get('transport_id')
+        devices[serial] = DeviceInfo(serial, state, transport_type(serial), fields.get('model'), fields.get('product'),
+                                     fields.get('device'), int(transport_id) if transport_id else None)
+    return devices
+
+
+def emulator_ports(devices) -> list:
+    """Sorted console ports of the online emulators in a parse_device_list() result."""
+    return sorted(int(serial.split('-')[1]) for serial, info in devices.items()
+                  if info.transport == 'emulator' and info.state == 'device')
+
+
+class DeviceWatcher:
+    """Live registry of the adb server's devices, fed by host:track-devices.
+
+    Subscribers get callback(event, info) with event 'attached', 'detached' or 'changed' (state or details).
+    The stream is reopened if the server goes away.
+    """
+
+    def __init__(self, client=None, retry=1.0) -> None:
+        self.client = client or AdbClient()
+        self.retry = retry #seconds before reconnecting to the server
+        self.devices = {} #serial -> DeviceInfo
+        self.subscribers = []
+        self.error = None #last connection error, None while streaming
+
+        self._cond = threading.Condition()
+        self._sock = None
+        self._running = False
+        self._stopped = threading.Event()
+        self._thread = None
+        self._synced = threading.Event() #first list received
+        self._answered = threading.Event() #first list received or first connection failed
+
+    def subscribe(self, callback, replay=True) -> None:
+        """replay=True calls back 'attached' for devices already known."""
+        with self._cond:
+            self.subscribers.append(callback)
+            known = list(self.devices.values()) if replay else []
+        for info in known:
+            callback('attached', info)
+
+    def unsubscribe(self, callback) -> None:
+        with self._cond:
+            self.subscribers.remove(callback)
+
+    def _open(self):
+        for service in ('host:track-devices-l', 'host:track-devices'): #-l needs a recent server
+            sock = self.client._connect()
+            try:
+                sock.sendall(encode_request(service))
+                check_status(sock)
+                sock.settimeout(None)
+                return sock
+            except ConnectionError:
+                sock.close()
+        raise ConnectionError('adb server refused host:track-devices')
+
+    def _update(self, devices) -> None:
+        events = []
+        with self._cond:
+            for serial, info in devices.items():
+                old = self.devices.get(serial)
+                if old is None:
+                    events.append(('attached', info))
+                elif old != info:
+                    events.append(('changed', info))
+            for serial, info in self.devices.items():
+                if serial not in devices:
+                    events.append(('detached', info))
+            self.devices = devices
+            subscribers = list(self.subscribers)
+            self._cond.notify_all()
+        for event, info in events:
+            for callback in subscribers:
+                callback(event, info)
+
+    def _run(self) -> None:
+        while self._running:
+            try:
+                self._sock = self._open()
+                self.error = None
+                while self._running:
+                    length = int(read_exact(self._sock, 4), 16)
+                    self._update(parse_device_list(read_exact(self._sock, length).decode(errors='replace')))
+                    self._synced.set()
+                    self._answered.set()
+            except (ConnectionError, OSError, ValueError) as e:
+                if not self._running:
+                    break
+                self.error = e
+                self._update({}) #server gone, every device is detached
+                self._answered.set()
+                self._stopped.wait(self.retry)
+            finally:
+                if self._sock is not None:
+                    self._sock.close()
+                    self._sock = None
+
+    def start(self, timeout=5):
+        """Start watching, waits up to timeout for the first device list. Raises the connection error (and
+        stops) when the server cannot be reached, an empty registry always means no devices are attached."""
+        if not self._running:
+            self._running = True
+            self._stopped.clear()
+            self._answered.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        self._answered.wait(timeout)
+        if not self._synced.is_set() and self.error is not None:
+            error = self.error
+            self.stop()
+            raise error
+        return self
+
+    def stop(self) -> None:
+        self._running = False
+        self._stopped.set()
+        if self._sock is not None:
+            try:
+                self._sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def online(self, transport=None) -> list:
+        """Serials in the 'device' state, optionally of one transport type."""
+        with self._cond:
+            return [info.serial for info in self.devices.values()
+                    if info.state == 'device' and (transport is None or info.transport == transport)]
+
+    def wait_for(self, serial, state='device', timeout=None) -> DeviceInfo:
+        """Block until serial is in state, None on timeout."""
+        with self._cond:
+            if self._cond.wait_for(lambda: serial in self.devices and self.devices[serial].state == state, timeout):
+                return self.devices[serial]
+            return None
@@ -0,0 +1,406 @@
+"""
+Local stand ins for the adb server, for exercising AdbClient without a device.
+
+A transcript is a list of conversations, one per client connection. Each conversation is a list of
+steps {"expect": <bytes the client sends>, "reply": <bytes sent back>}, stored as latin-1 strings so the
+whole thing round trips through JSON. TranscriptRecorder produces them by proxying a real server.
+
+DeviceServer is the free form counterpart, an adb server with FakeDevices that answer shell and exec
+commands from canned outputs after a configurable latency, for benchmarks (see apibench.py).
+"""
+import collections
+import hashlib
+import json
+import random
+import re
+import shlex
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+from adbclient import read_exact, SHELL_MARKER
+
+
+def _to_bytes(text) -> bytes:
+    return text.encode('latin-1')
+
+
+def _to_text(data) -> str:
+    return data.decode('latin-1')
+
+
+def load_transcript(path) -> list:
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_transcript(path, transcript) -> None:
+    with open(path, 'w') as f:
+        json.dump(transcript, f, indent=1)
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 256 #adb opens a connection per command, many devices at once overflow the default 5
+
+
+class _FakeServer:
+    """Runs a handler per connection on 127.0.0.1, port 0 picks a free port."""
+
+    def __init__(self, port=0) -> None:
+        outer = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                try:
+                    outer.handle(self.request)
+                except (ConnectionError, OSError):
+                    pass
+
+        self.server = _Server(('127.0.0.1', port), Handler)
+        self.port = self.server.server_address[1]
+        self._thread = None
+
+    def handle(self, sock) -> None:
+        raise NotImplementedError
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+class TranscriptServer(_FakeServer):
+    """Replays recorded conversations, a connection gets the first unused one that starts with its request."""
+
+    def __init__(self, transcript, port=0) -> None:
+        super().__init__(port)
+        self.conversations = [[(_to_bytes(s['expect']), _to_bytes(s['reply'])) for s in c] for c in transcript]
+        self.used = [False] * len(self.conversations)
+        self.errors = [] #mismatches, for the caller to assert on
+        self._lock = threading.Lock()
+
+    def _claim(self, request) -> list:
+        with self._lock:
+            for i, conversation in enumerate(self.conversations):
+                if not self.used[i] and conversation and conversation[0][0].startswith(request):
+                    self.used[i] = True
+                    return conversation
+        return None
+
+    def _fail(self, sock, message) -> None:
+        self.errors.append(message)
+        payload = message.encode()
+        sock.sendall(b'FAIL' + f'{len(payload):04x}'.encode() + payload)
+
+    def handle(self, sock) -> None:
+        length = read_exact(sock, 4)
+        request = length + read_exact(sock, int(length, 16))
+        conversation = self._claim(request)
+        if conversation is None:
+            return self._fail(sock, f'no recorded conversation for {request!r}')
+
+        received = request
+        for expect, reply in conversation:
+            if len(received) < len(expect):
+                received += read_exact(sock, len(expect) - len(received))
+            if received != expect:
+                return self._fail(sock, f'expected {expect!r}, got {received!r}')
+            received = b''
+            sock.sendall(reply)
+
+    def unused(self) -> int:
+        return self.used.count(False)
+
+
+class TranscriptRecorder(_FakeServer):
+    """Proxies to a real adb server and records every connection as a conversation."""
+
+    def __init__(self, upstream_host='127.0.0.1', upstream_port=5037, port=0) -> None:
+        super().__init__(port)
+        self.upstream = (upstream_host, upstream_port)
+        self.transcript = []
+        self._lock = threading.Lock()
+
+    def handle(self, sock) -> None:
+        steps = [] #(direction, bytes), consecutive chunks of the same direction merged
+        steps_lock = threading.Lock()
+
+        def log(direction, chunk):
+            with steps_lock:
+                if steps and steps[-1][0] == direction:
+                    steps[-1] = (direction, steps[-1][1] + chunk)
+                else:
+                    steps.append((direction, chunk))
+
+        def pump(src, dst, direction):
+            try:
+                for chunk in iter(lambda: src.recv(65536), b''):
+                    log(direction, chunk)
+                    dst.sendall(chunk)
+            except OSError:
+                pass
+            finally:
+                try:
+                    dst.shutdown(socket.SHUT_WR)
+                except OSError:
+                    pass
+
+        with socket.create_connection(self.upstream) as upstream:
+            replies = threading.Thread(target=pump, args=(upstream, sock, 'reply'))
+            replies.start()
+            pump(sock, upstream, 'expect')
+            replies.join()
+
+        conversation = []
+        for direction, chunk in steps:
+            if direction == 'expect' or not conversation:
+                conversation.append({'expect': _to_text(chunk) if direction == 'expect' else '', 'reply': ''})
+            if direction == 'reply':
+                conversation[-1]['reply'] += _to_text(chunk)
+        with self._lock:
+            self.transcript.append(conversation)
+
+    def save(self, path) -> None:
+        save_transcript(path, self.transcript)
+
+
+class FakeDevice:
+    """Canned answers of one device, outputs maps a command prefix to its stdout (longest prefix wins)."""
+
+    def __init__(self, serial, width=1920, height=1080, rotation='ROTATION_0', focus='Window{1f2e3d u0 com.example.game/.MainActivity}',
+                 latency=0.0, jitter=0.0, outputs=None, frame=None) -> None:
+        self.serial = serial
+        self.width = width #current orientation, like the screencap header
+        self.height = height
+        self.latency = latency #seconds before every reply
+        self.jitter = jitter #extra uniform random seconds
+        self.calls = collections.Counter() #service kind -> count
+        self.outputs = {
+            'wm size': f'Physical size: {width}x{height}\n',
+            'dumpsys window': f'    init={width}x{height} 420dpi cur={width}x{height} app={width}x{height}\n'
+                              f'  mCurrentFocus={focus}\n  mCurrentRotation={rotation}\n',
+            'input ': '',
+            'getevent -pl': 'add device 1: /dev/input/event2\n  name:     "fake_touchscreen"\n  events:\n    ABS (0003): '
+                            'ABS_MT_POSITION_X     : value 0, min 0, max 32767\n'
+                            '                ABS_MT_POSITION_Y     : value 0, min 0, max 32767\n',
+            'sendevent ': '',
+            'screencap -p': '',
+        }
+        self.outputs.update(outputs or {})
+        self._frame = frame
+        self.files = {} #path -> (data, mode, mtime), what sync: pushes and pulls
+        self.state = 'device' #or 'offline' / 'unauthorized', refused like the real server does, reconnect fixes offline
+
+    def frame(self) -> bytes:
+        """Raw screencap output, a v2 header and RGBA_8888 pixels, built on first use."""
+        if self._frame is None:
+            from PIL import Image, ImageDraw
+            image = Image.new('RGBA', (self.width, self.height), (40, 44, 52, 255))
+            draw = ImageDraw.Draw(image)
+            for i in range(12):
+                draw.text((40 + (i % 3) * self.width // 3, 40 + (i // 3) * self.height // 5), f'Score {i * 1234}', fill=(255, 255, 255, 255))
+            self._frame = struct.pack('<IIII', self.width, self.height, 1, 0) + image.tobytes()
+        return self._frame
+
+    def wait(self) -> None:
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def run(self, command) -> tuple:
+        """(stdout, returncode) of a shell command, scripts of several commands (InputBatch, Gesture) included."""
+        self.calls['shell'] += 1
+        if '\n' not in command and ';' not in command:
+            return self._run_one(command)
+        output, returncode = [], 0
+        for line in command.splitlines():
+            lexer = shlex.shlex(line, posix=True, punctuation_chars=';')
+            lexer.whitespace_split = True
+            words = []
+            for token in list(lexer) + [';']:
+                if token != ';':
+                    words.append(token)
+                elif words:
+                    stdout, returncode = self._builtin(words, returncode)
+                    output.append(stdout)
+                    words = []
+        return ''.join(output), returncode
+
+    def _builtin(self, words, returncode) -> tuple:
+        """echo (with $? and $(date ...) expanded) and sleep, anything else is looked up in outputs."""
+        if words[0] == 'echo':
+            text = ' '.join(words[1:]).replace('$?', str(returncode))
+            return re.sub(r'\$\(date [^)]*\)', lambda m: f'{time.time():.9f}', text) + '\n', 0
+        if words[0] == 'sleep':
+            time.sleep(float(words[1]))
+            return '', 0
+        return self._run_one(' '.join(words))
+
+    def _run_one(self, command) -> tuple:
+        if command.startswith('md5sum '):
+            return ''.join(f'{hashlib.md5(self.files[path][0]).hexdigest()}  {path}\n'
+                           for path in shlex.split(command)[1:] if path in self.files), 0
+        matches = [prefix for prefix in self.outputs if command.startswith(prefix)]
+        if not matches:
+            return f'/system/bin/sh: {command.split()[0] if command.split() else command}: not found\n', 127
+        return self.outputs[max(matches, key=len)], 0
+
+    def exec(self, command) -> bytes:
+        self.calls['exec'] += 1
+        if command.startswith('screencap') and '-p' not in command:
+            return self.frame()
+        return self.run(command)[0].encode()
+
+
+class DeviceServer(_FakeServer):
+    """adb server stand in for FakeDevices: host:version/devices/connect/get-serialno, shell:, exec: and sync: services.
+
+    Emulator style devices (emulator-<port>) are what host:connect:127.0.0.1:<port> reports as connected.
+    """
+
+    SHELL_REQUEST = re.compile(r'shell:\{ (.*)\n\} 2>&1; echo "' + SHELL_MARKER + r'\$\?"$', re.S) #shell_service()
+
+    def __init__(self, devices=(), port=0) -> None:
+        super().__init__(port)
+        self.devices = {device.serial: device for device in devices}
+
+    @classmethod
+    def emulators(cls, count, latency=0.0, jitter=0.0, **kwargs):
+        """Server with count FakeDevices named emulator-5554, emulator-5556..."""
+        return cls([FakeDevice(f'emulator-{5554 + 2 * i}', latency=latency, jitter=jitter, **kwargs) for i in range(count)])
+
+    def _read_request(self, sock) -> str:
+        return read_exact(sock, int(read_exact(sock, 4), 16)).decode(errors='replace')
+
+    def _okay(self, sock, payload=None) -> None:
+        if payload is None:
+            sock.sendall(b'OKAY')
+        else:
+            data = payload.encode()
+            sock.sendall(b'OKAY' + f'{len(data):04x}'.encode() + data)
+
+    def _fail(self, sock, message) -> None:
+        data = message.encode()
+        sock.sendall(b'FAIL' + f'{len(data):04x}'.encode() + data)
+
+    def _listing(self) -> str:
+        return ''.join(f'{serial}\t{device.state}\n' for serial, device in self.devices.items())
+
+    def _unavailable(self, serial) -> str:
+        """The server's refusal for a device that cannot take services, None when it can."""
+        device = self.devices.get(serial)
+        if device is None:
+            return f"device '{serial}' not found"
+        if device.state == 'offline':
+            return 'device offline'
+        if device.state == 'unauthorized':
+            return "device unauthorized.\nThis adb server's $ADB_VENDOR_KEYS is not set"
+        return None
+
+    def handle(self, sock) -> None:
+        request = self._read_request(sock)
+        if request == 'host:version':
+            return self._okay(sock, '0029')
+        if request in ('host:devices', 'host:devices-l'):
+            return self._okay(sock, self._listing())
+        if request.startswith('host:connect:'):
+            serial = f'emulator-{request.rsplit(":", 1)[1]}'
+            if serial not in self.devices:
+                return self._okay(sock, f'failed to connect to {request[len("host:connect:"):]}')
+            return self._okay(sock, f'already connected to {request[len("host:connect:"):]}')
+        if request.startswith('host-serial:') and request.endswith(':get-serialno'):
+            serial = request[len('host-serial:'):-len(':get-serialno')]
+            if self._unavailable(serial):
+                return self._fail(sock, self._unavailable(serial))
+            return self._okay(sock, serial)
+        if request.startswith('host-serial:') and request.endswith(':reconnect'):
+            serial = request[len('host-serial:'):-len(':reconnect')]
+            if serial not in self.devices:
+                return self._fail(sock, f"device '{serial}' not found")
+            if self.devices[serial].state == 'offline':
+                self.devices[serial].state = 'device'
+            return self._okay(sock, f'reconnecting {serial} [{self.devices[serial].state}]')
+        if not request.startswith('host:transport:'):
+            return self._fail(sock, f'unsupported service {request!r}')
+
+        serial = request[len('host:transport:'):]
+        if self._unavailable(serial):
+            return self._fail(sock, self._unavailable(serial))
+        device = self.devices[serial]
+        self._okay(sock)
+
+        service = self._read_request(sock)
+        device.wait()
+        shell = self.SHELL_REQUEST.match(service)
+        if shell:
+            output, returncode = device.run(shell.group(1))
+            self._okay(sock)
+            sock.sendall(f'{output}{SHELL_MARKER}{returncode}\n'.encode())
+        elif service.startswith('shell:'):
+            self._okay(sock)
+            sock.sendall(device.run(service[len('shell:'):])[0].encode())
+        elif service.startswith('exec:'):
+            self._okay(sock)
+            sock.sendall(device.exec(service[len('exec:'):]))
+        elif service == 'sync:':
+            self._okay(sock)
+            device.calls['sync'] += 1
+            self._sync(sock, device)
+        else:
+            self._fail(sock, f'unsupported service {service!r}')
+
+    def _sync(self, sock, device) -> None:
+        """STAT, SEND, RECV and QUIT against device.files, replies wait the device latency like every request."""
+        while True:
+            try:
+                header = read_exact(sock, 8)
+            except ConnectionError:
+                return
+            command, length = header[:4], struct.unpack('<I', header[4:])[0]
+            argument = read_exact(sock, length)
+            if command == b'QUIT':
+                return
+            if command == b'STAT':
+                device.wait()
+                data, mode, mtime = device.files.get(argument.decode(), (b'', 0, 0))
+                sock.sendall(b'STAT' + struct.pack('<III', mode, len(data), mtime))
+            elif command == b'SEND':
+                path, _, mode = argument.decode().rpartition(',')
+                chunks = []
+                while True:
+                    header = read_exact(sock, 8)
+                    length = struct.unpack('<I', header[4:])[0]
+                    if header[:4] == b'DONE':
+                        break
+                    chunks.append(read_exact(sock, length))
+                device.files[path] = (b''.join(chunks), int(mode), length) #DONE carries the mtime
+                device.wait()
+                sock.sendall(b'OKAY' + struct.pack('<I', 0))
+            elif command == b'RECV':
+                device.wait()
+                if argument.decode() not in device.files:
+                    message = b'No such file or directory'
+                    sock.sendall(b'FAIL' + struct.pack('<I', len(message)) + message)
+                    return
+                data = device.files[argument.decode()][0]
+                for offset in range(0, len(data), 64 * 1024):
+                    chunk = data[offset:offset + 64 * 1024]
+                    sock.sendall(b'DATA' + struct.pack('<I', len(chunk)) + chunk)
+                sock.sendall(b'DONE' + struct.pack('<I', 0))
+            else:
+                return
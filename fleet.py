@@ -0,0 +1,171 @@
+import os
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from adbapi import Emulator
+from adbclient import AdbClient
+from discovery import DeviceWatcher, emulator_ports, parse_device_list
+from tools import find_tool
+
+
+class DeviceFleet:
+    """Many Emulator instances behind one adb server, built and driven concurrently.
+
+    The server is started once (never killed), every emulator is connected and probed in parallel and the
+    fan out calls return {identifier: Future}.
+    """
+
+    def __init__(self, ports=None, devices=0, adb_path=None, backend='socket', max_workers=32, client=None, start_server=True) -> None:
+        self.adb = adb_path or find_tool('adb', os.getcwd())
+        if not self.adb:
+            raise FileNotFoundError("adb not found on PATH, ADBAPI_ADB, adbapi.json or under the current directory.")
+        self.backend = backend
+        self.client = client or AdbClient()
+
+        if start_server and not self._server_running(): #False for a server that is already up, eg. a fakeadb.DeviceServer
+            server = subprocess.run([self.adb, 'start-server'], capture_output=True, text=True)
+            if server.returncode != 0:
+                raise ConnectionError(server.stderr)
+
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='fleet')
+        self.devices = {} #identifier -> Emulator
+        self.errors = {} #identifier -> exception raised while connecting
+        self.watcher = None
+        self._lock = threading.Lock()
+
+        ports = ports or self.generate_ports(devices)
+        print(f'Connecting {len(ports)} emulators: {ports}')
+        futures = {f'emulator-{port}': self.pool.submit(self._connect, port) for port in ports}
+        for identifier, future in futures.items():
+            try:
+                self.devices[identifier] = future.result()
+            except Exception as e:
+                self.errors[identifier] = e
+                print(f'{identifier} failed: {e!r}')
+
+    def _server_running(self) -> bool:
+        try:
+            self.client.version()
+            return True
+        except (OSError, ValueError):
+            return False
+
+    def generate_ports(self, devices) -> list:
+        """Running emulators when devices is 0, else the default 5554 + 2*i console ports. The running ports
+        come from discovery.emulator_ports, like Emulator.running_ports."""
+        if devices == 0:
+            if self.backend == 'socket':
+                listing = self.client.devices()
+            else:
+                listing = subprocess.run(f'"{self.adb}" devices', shell=True, capture_output=True, text=True).stdout
+            ports = emulator_ports(parse_device_list(listing))
+            if not ports:
+                raise SystemError('No adb device detected')
+            return ports
+        return [5554 + 2 * i for i in range(devices)]
+
+    def _connect(self, port) -> Emulator:
+        return Emulator(port, -1, adb_path=self.adb, backend=self.backend, start_server=False, client=self.client)
+
+    def watch(self) -> DeviceWatcher:
+        """Hot add emulators as they come online and drop the ones that go away."""
+        if self.watcher is None:
+            watcher = DeviceWatcher(self.client)
+            watcher.subscribe(self._on_device)
+            self.watcher = watcher.start() #raises when the server is unreachable, the next watch() tries again
+        return self.watcher
+
+    def _on_device(self, event, info) -> None:
+        if info.transport != 'emulator':
+            return
+        with self._lock:
+            if event == 'detached' or info.state != 'device':
+                device = self.devices.pop(info.serial, None)
+                if device is not None:
+                    print(f'{info.serial} left the fleet ({info.state})')
+                    device.close()
+                return
+            if info.serial in self.devices:
+                return
+            self.devices[info.serial] = None #reserved while connecting
+
+        def add(future):
+            with self._lock:
+                if future.exception() is not None:
+                    self.errors[info.serial] = future.exception()
+                    self.devices.pop(info.serial, None)
+                elif info.serial in self.devices:
+                    self.devices[info.serial] = future.result()
+                    print(f'{info.serial} joined the fleet')
+        self.pool.submit(self._connect, int(info.serial.split('-')[1])).add_done_callback(add)
+
+    def _ready(self) -> dict:
+        with self._lock:
+            return {identifier: device for identifier, device in self.devices.items() if device is not None}
+
+    def __len__(self) -> int:
+        return len(self._ready())
+
+    def __iter__(self):
+        return iter(self._ready().values())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def submit(self, method, *args, **kwargs) -> dict:
+        """Call the named Emulator method on every device, returns {identifier: Future}."""
+        return {identifier: self.pool.submit(getattr(device, method), *args, **kwargs)
+                for identifier, device in self._ready().items()}
+
+    def map(self, function) -> dict:
+        """Run function(device) on every device, returns {identifier: Future}."""
+        return {identifier: self.pool.submit(function, device) for identifier, device in self._ready().items()}
+
+    def tap(self, x, y) -> dict: #scaled per device, like Emulator.screenInput
+        return self.submit('screenInput', x, y)
+
+    def swipe(self, x1, y1, x2, y2) -> dict:
+        return self.submit('screenSwipe', x1, y1, x2, y2)
+
+    def screenshot(self, stream=True, as_array=False) -> dict:
+        return self.submit('screenshot', stream, as_array)
+
+    def push(self, files, skip='stat', mode=None) -> dict:
+        """Same files to every device at once, one sync session each, local md5s are computed once."""
+        return self.submit('push', files, skip, mode)
+
+    def pull(self, files, skip='stat') -> dict:
+        """files maps remote paths to None (bytes in TransferResult.data) or to a local path with '{serial}' in it."""
+        return {identifier: self.pool.submit(device.pull, {remote: target if target is None else str(target).format(serial=identifier)
+                                                            for remote, target in files.items()}, skip)
+                for identifier, device in self._ready().items()}
+
+    def health(self) -> dict:
+        """{identifier: 'closed', 'open' (quarantined) or 'half_open'}, each device's circuit breaker.
+
+        Quarantined devices stay in the fleet, their calls fail at once with DeviceQuarantined so they do not
+        hold up a fan out, and after the cooldown the next call probes whether they are back.
+        """
+        return {identifier: device.breaker(identifier).state for identifier, device in self._ready().items()}
+
+    @staticmethod
+    def results(futures, timeout=None) -> dict:
+        """Wait for a fan out, {identifier: result or the exception it raised}."""
+        out = {}
+        for identifier, future in futures.items():
+            try:
+                out[identifier] = future.result(timeout)
+            except Exception as e:
+                out[identifier] = e
+        return out
+
+    def close(self) -> None:
+        if self.watcher is not None:
+            self.watcher.stop()
+        for device in self._ready().values():
+            device.close()
+        self.pool.shutdown(wait=True)
@@ -0,0 +1,164 @@
+from lazyimport import lazy_import
+
+from inputbatch import (InputBatch, EV_SYN, EV_KEY, EV_ABS, SYN_REPORT, BTN_TOUCH,
+                        ABS_MT_SLOT, ABS_MT_POSITION_X, ABS_MT_POSITION_Y, ABS_MT_TRACKING_ID)
+from transform import Transform
+
+np = lazy_import('numpy')
+
+DEFAULT_RATES = {'sendevent': 60, 'motionevent': 10} #samples per second, every `input` call starts a JVM
+
+
+def resample(points, duration, rate) -> tuple:
+    """(times, points) along a polyline at constant speed, one sample every 1000/rate ms plus both ends."""
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if len(points) == 1 or duration <= 0:
+        return np.zeros(1), points[:1]
+    lengths = np.concatenate([[0], np.cumsum(np.hypot(*np.diff(points, axis=0).T))])
+    times = np.append(np.arange(0, duration, 1000 / rate), duration)
+    if lengths[-1] == 0:
+        return times, np.repeat(points[:1], len(times), axis=0)
+    distance = times / duration * lengths[-1]
+    return times, np.stack([np.interp(distance, lengths, points[:, 0]), np.interp(distance, lengths, points[:, 1])], axis=1)
+
+
+class Gesture:
+    """Touch pointers on a host side millisecond timeline, played back by one shell script in one round trip.
+
+    Every pointer goes down at its first point, follows its path and lifts after its hold. Points are in base
+    resolution and mapped by transform (then by the TouchDevice for raw events) as whole arrays.
+    backend='sendevent' writes multitouch events to the TouchDevice and handles several pointers at once,
+    backend='motionevent' uses `input motionevent` (Android 11+), single pointer only and far coarser timing.
+    """
+
+    def __init__(self, shell, transform=None, backend='sendevent', touch=None, rate=None) -> None:
+        if backend not in DEFAULT_RATES:
+            raise ValueError(f'unknown gesture backend: {backend}')
+        if backend == 'sendevent' and touch is None:
+            raise ValueError('the sendevent backend needs a TouchDevice')
+        self.shell = shell
+        self.transform = transform or Transform()
+        self.backend = backend
+        self.touch = touch
+        self.rate = rate or DEFAULT_RATES[backend]
+        self.pointers = [] #(times in ms from the gesture start, (n, 2) int device positions, up time)
+
+    def __len__(self) -> int:
+        return len(self.pointers)
+
+    @property
+    def duration(self) -> float:
+        """ms from the first down to the last up."""
+        return max((up for _, _, up in self.pointers), default=0)
+
+    def _device(self, points) -> 'np.ndarray':
+        transform = self.transform.then(self.touch.transform) if self.backend == 'sendevent' else self.transform
+        return np.rint(transform.apply(points)).astype(int)
+
+    def path(self, points, duration=300, start=0, press=0, hold=0):
+        """Pointer down at points[0] at start ms, stays press ms, moves through every point in duration ms
+        at constant speed and lifts hold ms after arriving."""
+        times, path = resample(points, duration, self.rate)
+        times = times + start + press
+        if press:
+            times = np.concatenate([[start], times])
+            path = np.concatenate([path[:1], path])
+        self.pointers.append((times, self._device(path), float(times[-1] + hold)))
+        return self
+
+    def tap(self, x, y, start=0, hold=50):
+        return self.path([(x, y)], 0, start, hold=hold)
+
+    def long_press(self, x, y, hold=800, start=0):
+        return self.path([(x, y)], 0, start, hold=hold)
+
+    def swipe(self, x1, y1, x2, y2, duration=300, start=0, hold=0):
+        return self.path([(x1, y1), (x2, y2)], duration, start, hold=hold)
+
+    def drag(self, x1, y1, x2, y2, duration=500, press=600, hold=200, start=0):
+        """Long press to pick up, move, hold so the drop registers."""
+        return self.path([(x1, y1), (x2, y2)], duration, start, press, hold)
+
+    def pinch(self, x, y, start_distance, end_distance, duration=400, angle=0, start=0, hold=0):
+        """Two pointers moving symmetrically around (x, y), end_distance > start_distance zooms in.
+        Distances are in base resolution pixels, angle in degrees from the x axis."""
+        direction = np.array([np.cos(np.radians(angle)), np.sin(np.radians(angle))]) / 2
+        for side in (1, -1):
+            self.path([(x, y) + side * start_distance * direction, (x, y) + side * end_distance * direction],
+                      duration, start, hold=hold)
+        return self
+
+    def _events(self) -> list:
+        """(time, order, pointer, kind, x, y) sorted, at equal times downs and moves come before ups."""
+        events = []
+        for pointer, (times, positions, up) in enumerate(self.pointers):
+            events.append((times[0], 0, pointer, 'down', *positions[0]))
+            events.extend((time, 1, pointer, 'move', *position) for time, position in zip(times[1:], positions[1:]))
+            events.append((up, 2, pointer, 'up', *positions[-1]))
+        events.sort(key=lambda event: event[:3])
+        return events
+
+    def _frames(self) -> list:
+        """[(time, [events])] grouped by timestamp."""
+        frames = []
+        for event in self._events():
+            if frames and frames[-1][0] == event[0]:
+                frames[-1][1].append(event)
+            else:
+                frames.append((event[0], [event]))
+        return frames
+
+    def _sendevent_frame(self, events, slots, last) -> list:
+        """sendevent (type, code, value) triples for one frame, slots maps pointer -> slot, last is per slot."""
+        out = []
+        for _, _, pointer, kind, x, y in events:
+            if kind == 'down':
+                slot = min(set(range(len(slots) + 1)) - set(slots.values()))
+                if not slots:
+                    out.append((EV_KEY, BTN_TOUCH, 1))
+                slots[pointer] = slot
+                out += [(EV_ABS, ABS_MT_SLOT, slot), (EV_ABS, ABS_MT_TRACKING_ID, pointer),
+                        (EV_ABS, ABS_MT_POSITION_X, x), (EV_ABS, ABS_MT_POSITION_Y, y)]
+                last[slot] = (x, y)
+            elif kind == 'move':
+                slot = slots[pointer]
+                if last[slot] != (x, y):
+                    out += [(EV_ABS, ABS_MT_SLOT, slot), (EV_ABS, ABS_MT_POSITION_X, x), (EV_ABS, ABS_MT_POSITION_Y, y)]
+                    last[slot] = (x, y)
+            else:
+                out += [(EV_ABS, ABS_MT_SLOT, slots.pop(pointer)), (EV_ABS, ABS_MT_TRACKING_ID, 0xffffffff)]
+                if not slots:
+                    out.append((EV_KEY, BTN_TOUCH, 0))
+        return out + [(EV_SYN, SYN_REPORT, 0)] if out else out
+
+    def script(self) -> str:
+        """The whole gesture as shell code, frames separated by sleeps."""
+        lines = []
+        slots, last, down = {}, {}, 0
+        previous = None
+        for time, events in self._frames():
+            if self.backend == 'sendevent':
+                code = self.touch.events(*self._sendevent_frame(events, slots, last))
+            else:
+                actions = []
+                for _, _, pointer, kind, x, y in events:
+                    down += {'down': 1, 'up': -1}.get(kind, 0)
+                    if down > 1:
+                        raise ValueError('motionevent plays one pointer at a time, use the sendevent backend')
+                    if kind == 'move' and last.get(pointer) == (x, y): #every call is a JVM start, skip idle moves
+                        continue
+                    last[pointer] = (x, y)
+                    actions.append(f'input motionevent {kind.upper()} {x} {y}')
+                code = '; '.join(actions)
+            if code:
+                if previous is not None and time > previous:
+                    lines.append(f'sleep {(time - previous) / 1000:.4f}')
+                lines.append(code)
+                previous = time
+        return '\n'.join(lines)
+
+    def run(self):
+        """Play the gesture, returns its StepTiming (seconds on the device clock)."""
+        timing = InputBatch(self.shell).gesture(self).run()[0]
+        self.pointers = []
+        return timing
@@ -0,0 +1,178 @@
+import collections
+import re
+
+from transform import Transform
+
+STEP_MARKER = '__adbapi_step'
+TIMESTAMP = '$(date +%s.%N)'
+
+#linux input event codes used by the sendevent backend
+EV_SYN, EV_KEY, EV_ABS = 0, 1, 3
+SYN_REPORT = 0
+BTN_TOUCH = 0x14a
+ABS_MT_SLOT = 0x2f
+ABS_MT_POSITION_X = 0x35
+ABS_MT_POSITION_Y = 0x36
+ABS_MT_TRACKING_ID = 0x39
+
+ROTATIONS = {'ROTATION_0': 0, 'ROTATION_90': 1, 'ROTATION_180': 2, 'ROTATION_270': 3}
+
+StepTiming = collections.namedtuple('StepTiming', ['kind', 'args', 'returncode', 'start', 'duration'])
+
+
+class TouchDevice:
+    """Touchscreen /dev/input node and its axis ranges, as reported by `getevent -pl`."""
+
+    def __init__(self, path, max_x, max_y, width, height, rotation=0) -> None:
+        self.path = path
+        self.max_x = max_x
+        self.max_y = max_y
+        self.width = width #display size in the panel's natural orientation
+        self.height = height
+        self.rotation = rotation #0-3, quarter turns like Surface.ROTATION_*
+
+    @classmethod
+    def probe(cls, shell, rotation=0):
+        """Find the multitouch device, shell(command) runs a command on the device."""
+        events = shell('getevent -pl').stdout
+        size = re.search(r'(\d+)x(\d+)', shell('wm size').stdout.splitlines()[0])
+        path = None
+        for line in events.splitlines():
+            found = re.match(r'add device \d+: (\S+)', line)
+            if found:
+                path, max_x = found.group(1), None
+                continue
+            axis = re.search(r'ABS_MT_POSITION_([XY]).*max (\d+)', line)
+            if path and axis:
+                if axis.group(1) == 'X':
+                    max_x = int(axis.group(2))
+                elif max_x is not None:
+                    return cls(path, max_x, int(axis.group(2)), int(size.group(1)), int(size.group(2)), rotation)
+        raise ConnectionError('no multitouch input device found')
+
+    @property
+    def transform(self) -> Transform:
+        """Display coordinates (in the current rotation) to raw axis values."""
+        return Transform.rotation(self.rotation, self.width, self.height).then(
+            Transform.scale((self.max_x + 1) / self.width, (self.max_y + 1) / self.height))
+
+    def to_raw(self, x, y) -> tuple:
+        raw_x, raw_y = self.transform.point(x, y)
+        return round(raw_x), round(raw_y)
+
+    def events(self, *events) -> str:
+        return '; '.join(f'sendevent {self.path} {kind} {code} {value}' for kind, code, value in events)
+
+    def down(self, x, y, tracking_id=0) -> str:
+        raw_x, raw_y = self.to_raw(x, y)
+        return self.events((EV_ABS, ABS_MT_SLOT, 0), (EV_ABS, ABS_MT_TRACKING_ID, tracking_id), (EV_KEY, BTN_TOUCH, 1),
+                           (EV_ABS, ABS_MT_POSITION_X, raw_x), (EV_ABS, ABS_MT_POSITION_Y, raw_y), (EV_SYN, SYN_REPORT, 0))
+
+    def move(self, x, y) -> str:
+        raw_x, raw_y = self.to_raw(x, y)
+        return self.events((EV_ABS, ABS_MT_POSITION_X, raw_x), (EV_ABS, ABS_MT_POSITION_Y, raw_y), (EV_SYN, SYN_REPORT, 0))
+
+    def up(self) -> str:
+        return self.events((EV_ABS, ABS_MT_TRACKING_ID, 0xffffffff), (EV_KEY, BTN_TOUCH, 0), (EV_SYN, SYN_REPORT, 0))
+
+
+class InputBatch:
+    """Collects scaled input steps and runs them as one shell script, one adb round trip for the whole batch.
+
+    backend='input' uses the `input` command, backend='sendevent' writes raw touch events to the TouchDevice
+    and skips the input JVM entirely (keyevents still go through `input`). Coordinates are mapped by transform,
+    or by plain scale_x/scale_y when there is none.
+    """
+
+    def __init__(self, shell, scale_x=1, scale_y=1, backend='input', touch=None, transform=None) -> None:
+        if backend not in ('input', 'sendevent'):
+            raise ValueError(f'unknown input backend: {backend}')
+        if backend == 'sendevent' and touch is None:
+            raise ValueError('the sendevent backend needs a TouchDevice')
+        self.shell = shell
+        self.transform = transform or Transform.scale(scale_x, scale_y)
+        self.backend = backend
+        self.touch = touch
+        self.steps = [] #(kind, args, shell code)
+
+    def __len__(self) -> int:
+        return len(self.steps)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc) -> None:
+        if exc_type is None and self.steps:
+            self.run()
+
+    def _scale(self, x, y) -> tuple:
+        x, y = self.transform.point(x, y)
+        return round(x), round(y)
+
+    def tap(self, x, y):
+        sx, sy = self._scale(x, y)
+        if self.backend == 'sendevent':
+            code = f'{self.touch.down(sx, sy)}; {self.touch.up()}'
+        else:
+            code = f'input tap {sx} {sy}'
+        self.steps.append(('tap', (x, y), code))
+        return self
+
+    def swipe(self, x1, y1, x2, y2, duration=None, steps=10):
+        """duration in milliseconds, device default when None (sendevent: steps moves spread over it)."""
+        sx1, sy1 = self._scale(x1, y1)
+        sx2, sy2 = self._scale(x2, y2)
+        if self.backend == 'sendevent':
+            pause = f'sleep {(duration or 300) / 1000 / steps:.4f}; '
+            moves = ''.join(f'{pause}{self.touch.move(sx1 + (sx2 - sx1) * i / steps, sy1 + (sy2 - sy1) * i / steps)}; '
+                            for i in range(1, steps + 1))
+            code = f'{self.touch.down(sx1, sy1)}; {moves}{self.touch.up()}'
+        else:
+            code = f'input touchscreen swipe {sx1} {sy1} {sx2} {sy2}' + (f' {int(duration)}' if duration else '')
+        self.steps.append(('swipe', (x1, y1, x2, y2), code))
+        return self
+
+    def gesture(self, gesture):
+        """A Gesture (paths, pinches, long presses) as one step, played with its own timing."""
+        self.steps.append(('gesture', (len(gesture), gesture.duration), gesture.script()))
+        return self
+
+    def key(self, keycode):
+        self.steps.append(('key', (keycode,), f'input keyevent {keycode}'))
+        return self
+
+    def wait(self, seconds):
+        self.steps.append(('wait', (seconds,), f'sleep {seconds}'))
+        return self
+
+    def script(self) -> str:
+        lines = [f'echo "{STEP_MARKER} start 0 {TIMESTAMP}"']
+        for i, (kind, args, code) in enumerate(self.steps):
+            lines.append(f'{code}; echo "{STEP_MARKER} {i} $? {TIMESTAMP}"')
+        return '\n'.join(lines)
+
+    def run(self) -> list:
+        """Run every collected step in one shell call, returns a StepTiming per step (seconds, device clock)."""
+        result = self.shell(self.script())
+        stamps = {}
+        for line in result.stdout.splitlines():
+            parts = line.split()
+            if len(parts) == 4 and parts[0] == STEP_MARKER:
+                try:
+                    stamp = float(parts[3])
+                except ValueError: #date without %N support
+                    stamp = float(parts[3].split('.')[0])
+                stamps[parts[1]] = (int(parts[2]), stamp)
+
+        if 'start' not in stamps:
+            raise ConnectionError(f'input batch did not run: {result.stdout.strip()}')
+        timings = []
+        previous = start = stamps['start'][1]
+        for i, (kind, args, code) in enumerate(self.steps):
+            if str(i) not in stamps: #shell died part way
+                raise ConnectionError(f'input batch stopped before step {i} ({kind})')
+            returncode, stamp = stamps[str(i)]
+            timings.append(StepTiming(kind, args, returncode, previous - start, stamp - previous))
+            previous = stamp
+        self.steps = []
+        return timings
@@ -0,0 +1,234 @@
+"""
+Timing spans around adb commands, screenshot phases and OCR calls, fed to pluggable sinks.
+
+Off by default, span() then hands back one shared no-op context manager, a global check and a return.
+Shell commands are spans of kind 'shell', screenshots show up as 'exec.wait' (the device capturing, until
+the first byte), 'exec.transfer' and 'screenshot.decode', OCR as 'ocr', screenrecord frames as 'video.decode'.
+
+    histogram = instrument.enable() #or enable(Histogram(), FileExporter('spans.jsonl'))
+    ... drive devices ...
+    print(histogram.openmetrics())
+
+A sink is anything with record(span), called on the thread that ran the span.
+"""
+import bisect
+import json
+import math
+import threading
+import time
+
+enabled = False
+sinks = []
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, math.inf) #seconds
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+    def tag(self, **tags) -> None:
+        pass
+
+
+_NULL = _NullSpan()
+
+
+class Span:
+    """kind ('shell', 'exec.wait', 'ocr'...), device id, tags, start (time.time()), duration and error
+    (exception class name or None)."""
+
+    __slots__ = ('kind', 'device', 'tags', 'start', 'duration', 'error', '_started')
+
+    def __init__(self, kind, device, tags) -> None:
+        self.kind = kind
+        self.device = device
+        self.tags = tags
+        self.start = None
+        self.duration = None
+        self.error = None
+
+    def __enter__(self):
+        self.start = time.time()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, *exc) -> None:
+        self.duration = time.perf_counter() - self._started
+        self.error = exc_type.__name__ if exc_type else None
+        for sink in sinks:
+            sink.record(self)
+
+    def tag(self, **tags) -> None:
+        """Add tags known only part way, keep them low cardinality, every distinct set is a series."""
+        self.tags.update(tags)
+
+    def to_dict(self) -> dict:
+        return {'kind': self.kind, 'device': self.device, 'start': self.start, 'duration': self.duration,
+                'error': self.error, **self.tags}
+
+
+def span(kind, device=None, command=None, **tags):
+    """command is reduced to its first word as the 'command' tag, only when enabled."""
+    if not enabled:
+        return _NULL
+    if command is not None:
+        tags['command'] = command_kind(command)
+    return Span(kind, device, tags)
+
+
+def enable(*new_sinks):
+    """Start recording into new_sinks (a fresh Histogram when none are given), returns the first sink."""
+    global enabled
+    new_sinks = new_sinks or (Histogram(),)
+    sinks.extend(new_sinks)
+    enabled = True
+    return new_sinks[0]
+
+
+def disable() -> None:
+    """Stop recording and drop every sink, FileExporters are closed."""
+    global enabled
+    enabled = False
+    for sink in sinks:
+        if hasattr(sink, 'close'):
+            sink.close()
+    sinks.clear()
+
+
+def command_kind(command) -> str:
+    """Low cardinality tag for a shell command, its first word ('input', 'dumpsys', 'wm'...)."""
+    words = command.split(None, 1)
+    return words[0].rsplit('/', 1)[-1] if words else ''
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels) -> str:
+    return ','.join(f'{name}="{_escape(value)}"' for name, value in labels)
+
+
+class Histogram:
+    """Bucketed durations per (kind, device, tags), thread safe."""
+
+    def __init__(self, buckets=BUCKETS) -> None:
+        self.buckets = tuple(buckets)
+        self.series = {} #labels -> [bucket counts, count, sum, errors, max]
+        self._lock = threading.Lock()
+
+    def record(self, span) -> None:
+        labels = (('kind', span.kind), ('device', span.device or '')) + tuple(sorted(span.tags.items()))
+        with self._lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [[0] * len(self.buckets), 0, 0.0, 0, 0.0]
+            series[0][bisect.bisect_left(self.buckets, span.duration)] += 1
+            series[1] += 1
+            series[2] += span.duration
+            series[3] += span.error is not None
+            series[4] = max(series[4], span.duration)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.series.clear()
+
+    def quantile(self, q, kind=None, device=None) -> float:
+        """Estimated quantile (upper bucket bound) over the series matching kind/device, None when empty."""
+        counts = [0] * len(self.buckets)
+        with self._lock:
+            for labels, series in self.series.items():
+                fields = dict(labels)
+                if (kind is None or fields['kind'] == kind) and (device is None or fields['device'] == device):
+                    counts = [a + b for a, b in zip(counts, series[0])]
+        total = sum(counts)
+        if not total:
+            return None
+        running = 0
+        for bound, count in zip(self.buckets, counts):
+            running += count
+            if running >= q * total:
+                return bound
+        return self.buckets[-1]
+
+    def summary(self) -> list:
+        """One dict per series: labels, count, sum, mean, max and errors (seconds)."""
+        with self._lock:
+            return [dict(labels, count=s[1], sum=s[2], mean=s[2] / s[1], max=s[4], errors=s[3])
+                    for labels, s in sorted(self.series.items())]
+
+    def openmetrics(self) -> str:
+        """OpenMetrics text exposition of every series."""
+        lines = ['# TYPE adbapi_span_seconds histogram', '# UNIT adbapi_span_seconds seconds']
+        errors = []
+        with self._lock:
+            for labels, (counts, count, total, error_count, _) in sorted(self.series.items()):
+                running = 0
+                for bound, bucket in zip(self.buckets, counts):
+                    running += bucket
+                    le = '+Inf' if bound == math.inf else repr(bound)
+                    lines.append(f'adbapi_span_seconds_bucket{{{_labels(labels + (("le", le),))}}} {running}')
+                lines.append(f'adbapi_span_seconds_count{{{_labels(labels)}}} {count}')
+                lines.append(f'adbapi_span_seconds_sum{{{_labels(labels)}}} {total}')
+                errors.append(f'adbapi_span_errors_total{{{_labels(labels)}}} {error_count}')
+        lines += ['# TYPE adbapi_span_errors counter'] + errors + ['# EOF']
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port=9464, host='127.0.0.1'):
+        """Expose openmetrics() at http://host:port/metrics from a daemon thread, shutdown() the server to stop."""
+        import http.server
+        histogram = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = histogram.openmetrics().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/openmetrics-text; version=1.0.0; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+class FileExporter:
+    """Appends every span as one JSON line, buffered and flushed every flush_every spans and on close()."""
+
+    def __init__(self, path, flush_every=256) -> None:
+        self.path = path
+        self.flush_every = flush_every
+        self._pending = []
+        self._lock = threading.Lock()
+        self._file = open(path, 'a')
+
+    def record(self, span) -> None:
+        line = json.dumps(span.to_dict())
+        with self._lock:
+            self._pending.append(line)
+            if len(self._pending) >= self.flush_every:
+                self._flush()
+
+    def _flush(self) -> None:
+        if self._pending and self._file is not None:
+            self._file.write('\n'.join(self._pending) + '\n')
+            self._file.flush()
+        self._pending = []
+
+    def close(self) -> None:
+        with self._lock:
+            self._flush()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
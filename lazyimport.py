@@ -0,0 +1,34 @@
+import importlib
+import threading
+import types
+
+_lock = threading.RLock() #one import at a time, a module's import may itself touch another lazy module
+
+
+class _LazyModule(types.ModuleType):
+    """Stand in for a module that is imported on its first attribute access.
+
+    The import runs under _lock with a plain importlib.import_module, so threads that touch the module for the
+    first time together all wait for the finished module (importlib.util.LazyLoader hands them a half executed
+    one). Afterwards the module's attributes are copied in and lookups no longer go through __getattr__. A
+    module that is not installed raises ModuleNotFoundError on first use instead of on import.
+    """
+
+    def __getattr__(self, attribute):
+        with _lock:
+            module = self.__dict__.get('_module')
+            if module is None:
+                module = importlib.import_module(self.__name__)
+                self.__dict__.update(module.__dict__)
+                self.__dict__['_module'] = module
+        return getattr(module, attribute)
+
+
+def lazy_import(name) -> types.ModuleType:
+    """The module, imported on its first attribute access, eg. np = lazy_import('numpy').
+
+    Nothing is imported here, so importing adbapi does not pay for numpy, PIL or pytesseract until a
+    screenshot, gesture or OCR call needs them. Annotations like `-> np.ndarray` count as an access, keep
+    those quoted. sys.modules is left alone, a plain `import numpy` elsewhere gets the real module.
+    """
+    return _LazyModule(name)
@@ -0,0 +1,158 @@
+import collections
+
+from lazyimport import lazy_import
+from transform import Transform
+
+np = lazy_import('numpy')
+
+Match = collections.namedtuple('Match', ['name', 'x', 'y', 'score', 'scale', 'box'])
+
+GRAY = (0.299, 0.587, 0.114) #luma weights of R, G and B
+BATCH = 8 #templates correlated per inverse FFT call, bounds memory to BATCH correlation planes
+
+
+def to_gray(frame) -> 'np.ndarray':
+    """float32 grayscale from a PIL image or a (h, w[, channels]) uint8 array, e.g. screenshot(stream=True)."""
+    if not isinstance(frame, np.ndarray):
+        frame = np.asarray(frame.convert('RGB') if frame.mode not in ('L', 'RGB') else frame)
+    if frame.ndim == 3:
+        return frame[..., :3].astype(np.float32) @ np.array(GRAY, dtype=np.float32)
+    return frame.astype(np.float32)
+
+
+def resize(gray, height, width) -> 'np.ndarray':
+    """Bilinear resize with numpy only, for building template pyramids."""
+    ys = np.linspace(0, gray.shape[0] - 1, height, dtype=np.float32)
+    xs = np.linspace(0, gray.shape[1] - 1, width, dtype=np.float32)
+    y0 = np.floor(ys).astype(int)
+    x0 = np.floor(xs).astype(int)
+    y1 = np.minimum(y0 + 1, gray.shape[0] - 1)
+    x1 = np.minimum(x0 + 1, gray.shape[1] - 1)
+    wy = (ys - y0)[:, None]
+    wx = (xs - x0)[None, :]
+    top = gray[y0][:, x0] * (1 - wx) + gray[y0][:, x1] * wx
+    bottom = gray[y1][:, x0] * (1 - wx) + gray[y1][:, x1] * wx
+    return (top * (1 - wy) + bottom * wy).astype(np.float32)
+
+
+def downsample(gray, factor) -> 'np.ndarray':
+    """Block mean by an integer factor."""
+    if factor == 1:
+        return gray
+    height, width = gray.shape[0] // factor * factor, gray.shape[1] // factor * factor
+    return gray[:height, :width].reshape(height // factor, factor, width // factor, factor).mean(axis=(1, 3))
+
+
+class _Level:
+    """One pyramid level of a template: zero mean pixels, their norm and FFTs per frame shape."""
+
+    def __init__(self, name, scale, gray) -> None:
+        self.name = name
+        self.scale = scale
+        self.height, self.width = gray.shape
+        self.size = gray.size
+        self.pixels = gray - gray.mean()
+        self.norm = float(np.sqrt((self.pixels ** 2).sum()))
+        self._ffts = {}
+
+    def fft(self, shape) -> 'np.ndarray':
+        if shape not in self._ffts:
+            self._ffts[shape] = np.conj(np.fft.rfft2(self.pixels, s=shape)).astype(np.complex64)
+        return self._ffts[shape]
+
+
+class Locator:
+    """Finds templates in screenshots with FFT normalized cross correlation, vectorized over templates.
+
+    Templates are added once with the scales to search (their pyramid is precomputed), hits come back in the
+    base resolution space screenInput takes, given the device's transform (or plain res_scalar_x/res_scalar_y).
+    downsample > 1 matches on block averaged frames, faster at the cost of that many pixels of precision.
+    """
+
+    def __init__(self, downsample=2) -> None:
+        self.downsample = downsample
+        self.templates = {} #name -> (levels, roi)
+
+    def add(self, name, template, scales=(1.0,), roi=None) -> None:
+        """roi (x1, y1, x2, y2) in base resolution limits where this template is searched."""
+        gray = to_gray(template)
+        levels = []
+        for scale in scales:
+            scaled = gray
+            if scale != 1:
+                scaled = resize(gray, max(1, round(gray.shape[0] * scale)), max(1, round(gray.shape[1] * scale)))
+            scaled = downsample(scaled, self.downsample) #same block mean as the frame
+            if scaled.size:
+                levels.append(_Level(name, scale, scaled))
+        self.templates[name] = (levels, roi)
+
+    def remove(self, name) -> None:
+        self.templates.pop(name, None)
+
+    def _window_sums(self, integral, height, width) -> 'np.ndarray':
+        return integral[height:, width:] - integral[:-height, width:] - integral[height:, :-width] + integral[:-height, :-width]
+
+    def _search(self, gray, levels, threshold, max_hits) -> list:
+        """(level, row, col, score) peaks in gray (already downsampled)."""
+        shape = gray.shape
+        frame_fft = np.fft.rfft2(gray)
+        integral = np.pad(gray.astype(np.float64).cumsum(0).cumsum(1), ((1, 0), (1, 0)))
+        integral_sq = np.pad((gray.astype(np.float64) ** 2).cumsum(0).cumsum(1), ((1, 0), (1, 0)))
+
+        levels = [level for level in levels if level.height <= shape[0] and level.width <= shape[1] and level.norm > 0]
+        deviations = {} #(h, w) -> windowed standard deviation * sqrt(size), shared by same sized templates
+        peaks = []
+        for start in range(0, len(levels), BATCH):
+            batch = levels[start:start + BATCH]
+            correlations = np.fft.irfft2(frame_fft[None] * np.stack([level.fft(shape) for level in batch]), s=shape)
+            for level, correlation in zip(batch, correlations):
+                h, w = level.height, level.width
+                if (h, w) not in deviations:
+                    window = self._window_sums(integral, h, w)
+                    variance = self._window_sums(integral_sq, h, w) - window ** 2 / level.size
+                    deviation = np.sqrt(np.maximum(variance, 0)).astype(np.float32)
+                    deviation[variance < 1e-3] = np.inf #flat areas match anything, score them 0
+                    deviations[(h, w)] = deviation
+                scores = correlation[:shape[0] - h + 1, :shape[1] - w + 1] / (deviations[(h, w)] * level.norm)
+
+                for _ in range(max_hits):
+                    row, col = np.unravel_index(np.argmax(scores), scores.shape)
+                    score = float(scores[row, col])
+                    if score < threshold:
+                        break
+                    peaks.append((level, row, col, score))
+                    scores[max(0, row - h // 2):row + h // 2 + 1, max(0, col - w // 2):col + w // 2 + 1] = -1 #suppress
+        return peaks
+
+    def locate(self, frame, names=None, threshold=0.8, roi=None, res_scalar_x=1, res_scalar_y=1, max_hits=1, transform=None) -> list:
+        """Matches sorted by score, (x, y) is the hit center and box its (x1, y1, x2, y2), both in base resolution."""
+        transform = transform or Transform.scale(res_scalar_x, res_scalar_y)
+        gray = to_gray(frame)
+        groups = {} #roi -> levels, templates sharing a search area share the frame FFT
+        for name in names or self.templates:
+            levels, template_roi = self.templates[name]
+            groups.setdefault(roi or template_roi, []).extend(levels)
+
+        ds = self.downsample
+        hits = []
+        boxes = [] #frame pixels, mapped back to base resolution in one go
+        for area, levels in groups.items():
+            left, top = 0, 0
+            search = gray
+            if area is not None:
+                x1, y1, x2, y2 = transform.rect(*area)
+                left, top = max(0, int(x1)), max(0, int(y1))
+                left, top = left - left % ds, top - top % ds #stay on the downsample grid of the templates
+                search = gray[top:int(y2), left:int(x2)]
+
+            for level, row, col, score in self._search(downsample(search, ds), levels, threshold, max_hits):
+                x1, y1 = left + col * ds, top + row * ds #back to frame pixels
+                hits.append((level, score))
+                boxes.append((x1, y1, x1 + level.width * ds, y1 + level.height * ds))
+
+        matches = []
+        if hits:
+            for (level, score), box in zip(hits, transform.inverse().rects(boxes).tolist()):
+                matches.append(Match(level.name, (box[0] + box[2]) / 2, (box[1] + box[3]) / 2, score, level.scale, tuple(box)))
+        matches.sort(key=lambda match: match.score, reverse=True)
+        return matches
@@ -0,0 +1,263 @@
+import collections
+import hashlib
+import sys
+import threading
+from concurrent.futures import Future
+
+import instrument
+from lazyimport import lazy_import
+
+Image = lazy_import('PIL.Image')
+
+OcrResult = collections.namedtuple('OcrResult', ['text', 'confidence', 'box'])
+
+GAP = 24 #white rows between stitched regions, keeps tesseract from joining lines
+
+_api = None #per worker process tesserocr.PyTessBaseAPI, None when only pytesseract is available
+_pytesseract = None
+
+
+def _init_worker(tesseract_cmd, lang) -> None:
+    """Runs once in every pool process, the tesseract model stays loaded between calls with tesserocr."""
+    global _api, _pytesseract
+    try:
+        import tesserocr
+        _api = tesserocr.PyTessBaseAPI(lang=lang, psm=tesserocr.PSM.SINGLE_BLOCK)
+    except ImportError:
+        import pytesseract
+        if tesseract_cmd:
+            pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+        _pytesseract = pytesseract
+
+
+def _words(strip, lang, config) -> list:
+    """(text, confidence, left, top, width, height) for every word of the strip."""
+    if _api is not None:
+        import tesserocr
+        _api.SetImage(strip)
+        _api.Recognize()
+        words = []
+        iterator = _api.GetIterator()
+        level = tesserocr.RIL.WORD
+        for word in tesserocr.iterate_level(iterator, level):
+            text = word.GetUTF8Text(level)
+            box = word.BoundingBox(level)
+            if text and box:
+                words.append((text, word.Confidence(level), box[0], box[1], box[2] - box[0], box[3] - box[1]))
+        return words
+
+    data = _pytesseract.image_to_data(strip, lang=lang, config=f'--psm 6 {config}'.strip(), output_type=_pytesseract.Output.DICT)
+    return [(text, float(conf), left, top, width, height)
+            for text, conf, left, top, width, height in zip(data['text'], data['conf'], data['left'], data['top'], data['width'], data['height'])
+            if text.strip() and float(conf) >= 0]
+
+
+def _read_strip(strip, offsets, lang, config) -> list:
+    """OCR one stitched strip, words are handed back to the region whose rows they sit in."""
+    per_region = [[] for _ in offsets]
+    for text, conf, left, top, width, height in _words(strip, lang, config):
+        middle = top + height / 2
+        for i, (y, region_height, x1, y1) in enumerate(offsets):
+            if y - GAP / 2 <= middle < y + region_height + GAP / 2:
+                per_region[i].append((text, conf, x1 + left - GAP, y1 + top - y, width, height))
+                break
+
+    results = []
+    for words in per_region:
+        if not words:
+            results.append(OcrResult('', 0.0, None))
+            continue
+        words.sort(key=lambda w: (round(w[3] / max(w[5], 1)), w[2])) #reading order, rows then columns
+        box = (min(w[2] for w in words), min(w[3] for w in words),
+               max(w[2] + w[4] for w in words), max(w[3] + w[5] for w in words))
+        results.append(OcrResult(' '.join(w[0] for w in words), sum(w[1] for w in words) / len(words), box))
+    return results
+
+
+def _shift(result, dx, dy) -> OcrResult:
+    if result.box is None:
+        return result
+    x1, y1, x2, y2 = result.box
+    return result._replace(box=(x1 + dx, y1 + dy, x2 + dx, y2 + dy))
+
+
+def crop_regions(image, regions) -> list:
+    return [image.crop(tuple(int(round(v)) for v in region)).convert('L') for region in regions]
+
+
+def stitch(crops, regions) -> tuple:
+    """Stack the crops of regions into one grayscale strip, returns (strip, offsets)."""
+    width = max(crop.width for crop in crops) + 2 * GAP
+    height = sum(crop.height for crop in crops) + GAP * (len(crops) + 1)
+    strip = Image.new('L', (width, height), 255)
+
+    offsets = [] #(y in strip, height, x1, y1 in image)
+    y = GAP
+    for crop, region in zip(crops, regions):
+        strip.paste(crop, (GAP, y))
+        offsets.append((y, crop.height, int(round(region[0])), int(round(region[1]))))
+        y += crop.height + GAP
+    return strip, offsets
+
+
+def dhash(image) -> int:
+    """64 bit difference hash, equal for crops that only differ by noise or slight scaling."""
+    pixels = list(image.convert('L').resize((9, 8)).getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return bits
+
+
+def _size(value) -> int:
+    """Bytes held by a cached result, the containers plus every string, number and box in them."""
+    size = sys.getsizeof(value)
+    if isinstance(value, (list, tuple)): #get_text word lists, OcrResults and their boxes
+        size += sum(_size(item) for item in value)
+    return size
+
+
+class OcrCache:
+    """LRU memo of OCR results keyed by the cropped pixels and the OCR config.
+
+    Lists (get_text words) are copied on the way in and out, a caller editing its result cannot change later
+    hits. max_bytes bounds the sum of the key and result sizes, see _size().
+
+    perceptual=True keys by dhash instead of an exact hash, faster to match through compression noise but
+    digits that change a few pixels (a score going 128 -> 126) can collide, so exact is the default.
+    """
+
+    def __init__(self, max_entries=4096, max_bytes=8 * 1024 * 1024, perceptual=False) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.perceptual = perceptual
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes = 0
+
+        self._entries = collections.OrderedDict() #key -> (value, size), oldest first
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def key(self, image, config='') -> bytes:
+        digest = hashlib.blake2b(f'{image.mode}{image.size}{config}'.encode(), digest_size=16)
+        if self.perceptual:
+            digest.update(dhash(image).to_bytes(8, 'little'))
+        else:
+            digest.update(image.tobytes())
+        return digest.digest()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return list(entry[0]) if isinstance(entry[0], list) else entry[0]
+
+    def put(self, key, value) -> None:
+        if isinstance(value, list):
+            value = list(value)
+        size = sys.getsizeof(key) + _size(value)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._entries[key] = (value, size)
+            self.bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self.bytes > self.max_bytes):
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {'entries': len(self._entries), 'bytes': self.bytes, 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'hit_rate': self.hits / total if total else 0.0}
+
+
+class OcrEngine:
+    """Reads many regions of one frame with one OCR call per strip, spread over a pool of worker processes.
+
+    With tesserocr installed every worker keeps a loaded tesseract API, otherwise pytesseract is used.
+    workers=0 runs in the calling process. Regions found in the OcrCache skip OCR entirely, cache=None turns
+    memoizing off.
+    """
+
+    def __init__(self, workers=2, lang='eng', config='', tesseract_cmd=None, regions_per_strip=16, cache=True) -> None:
+        self.cache = OcrCache() if cache is True else (None if cache in (None, False) else cache)
+        self.lang = lang
+        self.config = config
+        self.regions_per_strip = regions_per_strip
+        self.pool = None
+        if workers:
+            from concurrent.futures import ProcessPoolExecutor #pulls in multiprocessing, only for pooled engines
+            self.pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(tesseract_cmd, lang))
+        else:
+            _init_worker(tesseract_cmd, lang)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _run(self, strip, offsets) -> Future:
+        if self.pool is not None:
+            return self.pool.submit(_read_strip, strip, offsets, self.lang, self.config)
+        future = Future()
+        try:
+            future.set_result(_read_strip(strip, offsets, self.lang, self.config))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def submit(self, image, regions) -> list:
+        """Start reading (x1, y1, x2, y2) pixel regions of image, returns one Future per strip in region order."""
+        return self._submit(crop_regions(image, regions), list(regions))
+
+    def _submit(self, crops, regions) -> list:
+        futures = []
+        for start in range(0, len(regions), self.regions_per_strip):
+            end = start + self.regions_per_strip
+            futures.append(self._run(*stitch(crops[start:end], regions[start:end])))
+        return futures
+
+    def read_regions(self, image, regions) -> list:
+        """OcrResult (text, mean word confidence, word bounding box in image pixels) per region."""
+        with instrument.span('ocr', call='read_regions'):
+            return self._read_regions(image, regions)
+
+    def _read_regions(self, image, regions) -> list:
+        regions = list(regions)
+        crops = crop_regions(image, regions)
+        if self.cache is None:
+            return [result for future in self._submit(crops, regions) for result in future.result()]
+
+        config = f'{self.lang}|{self.config}'
+        keys = [self.cache.key(crop, config) for crop in crops]
+        results = [self.cache.get(key) for key in keys] #boxes are cached relative to the region origin
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            fresh = [result for future in self._submit([crops[i] for i in missing], [regions[i] for i in missing])
+                     for result in future.result()]
+            for i, result in zip(missing, fresh):
+                results[i] = _shift(result, -int(round(regions[i][0])), -int(round(regions[i][1])))
+                self.cache.put(keys[i], results[i])
+        return [_shift(result, int(round(region[0])), int(round(region[1]))) for result, region in zip(results, regions)]
+
+    def close(self) -> None:
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
@@ -0,0 +1,99 @@
+"""
+Replays a recorded adb server transcript against AdbClient, no device or adb binary needed.
+
+    python replay.py                                          #replays transcripts/emulator-5554.json
+    python replay.py --record phone.json --serial R5CRC0WAGML #records the same session against the adb server
+    python replay.py --record transcripts/emulator-5554.json --fake
+
+The session covers host queries, shell commands, an input batch script, a raw screencap and a sync push, stat
+and pull. Replaying fails when AdbClient sends a single byte the recording did not, or leaves a recorded
+connection unused.
+"""
+import argparse
+import hashlib
+import os
+import sys
+
+from adbclient import AdbClient
+from fakeadb import DeviceServer, FakeDevice, TranscriptRecorder, TranscriptServer, load_transcript
+from inputbatch import InputBatch
+from screencap import RawFrame
+
+TRANSCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'transcripts', 'emulator-5554.json')
+PUSH_PATH = '/data/local/tmp/adbapi-replay.bin'
+PUSH_DATA = b'adbapi transcript replay\n' * 200
+
+
+def session(client, serial) -> list:
+    """The recorded calls, (name, result) pairs."""
+    out = [('version', client.version()),
+           ('devices', client.devices().strip()),
+           ('serialno', client.serialno(serial))]
+    for command in ('wm size', 'dumpsys window | grep -E "mCurrentFocus|mCurrentRotation"', 'adbapi-missing-command'):
+        result = client.shell(serial, command)
+        out.append((command, (result.returncode, result.stdout.strip())))
+    batch = InputBatch(lambda script: client.shell(serial, script)).tap(10, 10).swipe(10, 10, 20, 20, 100)
+    out.append(('input batch', [(step.kind, step.returncode) for step in batch.run()]))
+    frame = RawFrame(client.exec_out(serial, 'screencap'))
+    out.append(('screencap', (frame.width, frame.height, frame.pixel_format)))
+    with client.sync(serial) as sync:
+        sync.push(PUSH_DATA, PUSH_PATH, mtime=1700000000)
+        mode, size, mtime = sync.stat(PUSH_PATH)
+        out.append(('sync stat', (oct(mode), size, mtime)))
+        out.append(('sync pull', hashlib.md5(sync.pull(PUSH_PATH)).hexdigest() == hashlib.md5(PUSH_DATA).hexdigest()))
+    return out
+
+
+def record(path, serial, port=None, fake=False) -> list:
+    """Runs session() through a TranscriptRecorder and saves what went over the wire."""
+    upstream = DeviceServer([FakeDevice(serial, width=64, height=36)]).start() if fake else None
+    try:
+        with TranscriptRecorder(upstream_port=upstream.port if fake else AdbClient(port=port).port) as recorder:
+            results = session(AdbClient(port=recorder.port, timeout=30), serial)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        recorder.save(path)
+    finally:
+        if upstream is not None:
+            upstream.stop()
+    return results
+
+
+def replay(path, serial) -> tuple:
+    """(results, mismatches, unused conversations) of session() against the transcript."""
+    with TranscriptServer(load_transcript(path)) as server:
+        try:
+            results = session(AdbClient(port=server.port, timeout=10), serial)
+        except ConnectionError as e: #the server refused a request it has no recording for, see server.errors
+            results = [('stopped', e)]
+    return results, server.errors, server.unused()
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('transcript', nargs='?', default=TRANSCRIPT)
+    parser.add_argument('--serial', default='emulator-5554')
+    parser.add_argument('--record', metavar='PATH', help='record a new transcript here instead of replaying')
+    parser.add_argument('--port', type=int, help='adb server port to record from, default 5037')
+    parser.add_argument('--fake', action='store_true', help='record from a fakeadb.DeviceServer instead')
+    args = parser.parse_args(argv)
+
+    if args.record:
+        for name, result in record(args.record, args.serial, args.port, args.fake):
+            print(f'{name}: {result}')
+        print(f'Saved {args.record}')
+        return
+
+    results, errors, unused = replay(args.transcript, args.serial)
+    for name, result in results:
+        print(f'{name}: {result}')
+    for error in errors:
+        print(f'Mismatch: {error}')
+    if unused:
+        print(f'{unused} recorded connections were never made')
+    if errors or unused:
+        sys.exit(1)
+    print(f'Replayed {args.transcript}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,259 @@
+"""
+Structured adb errors, retries with jitter and a circuit breaker per device.
+
+Every failure of an adb call becomes an AdbError subclass (still a ConnectionError, so old handlers keep
+working): DeviceOffline, DeviceUnauthorized, CommandTimeout, CommandFailed or ServerUnavailable. call() runs an action under a
+RetryPolicy and a CircuitBreaker; a device that keeps failing is quarantined, its calls fail at once with
+DeviceQuarantined instead of tying up a worker, and after a cooldown a single probe call decides whether it
+comes back.
+
+    breaker = CircuitBreaker('emulator-5554')
+    result = call(lambda: client.shell('emulator-5554', 'wm size', timeout=10), 'emulator-5554', 'wm size',
+                  breaker, RetryPolicy(attempts=3))
+"""
+import random
+import re
+import subprocess
+import threading
+import time
+
+#adb's own wording, a command's output that merely contains 'not found' (sh: foo: not found) is not a missing device
+OFFLINE_MESSAGES = re.compile(r"device (?:'[^']*' )?(?:not found|offline|still connecting|still authorizing)|no (?:devices|emulators)[/a-z]* found")
+UNAUTHORIZED_MESSAGES = re.compile(r"device (?:'[^']*' )?unauthorized")
+SERVER_MESSAGES = re.compile(r'cannot connect to daemon|daemon not running|connection refused')
+ADB_PREFIXES = ('error:', 'adb:') #lines the adb client prints about itself, not about the command
+
+
+class AdbError(ConnectionError):
+    """An adb call that did not produce a result, device, command, returncode and output say which and why."""
+
+    retryable = True #the same call can succeed when repeated, eg. the connection dropped
+    device_fault = True #counts against the device's circuit breaker
+
+    def __init__(self, message, device=None, command=None, returncode=None, output=None) -> None:
+        super().__init__(message)
+        self.device = device
+        self.command = command
+        self.returncode = returncode
+        self.output = output
+
+
+class DeviceOffline(AdbError):
+    """The device is missing, offline or still connecting, adb never reached it."""
+
+
+class DeviceUnauthorized(AdbError):
+    """The device has not accepted this host's adb key, retrying does not help until someone taps allow."""
+
+    retryable = False
+
+
+class CommandTimeout(AdbError, TimeoutError):
+    """No answer within the timeout, the command may or may not have run."""
+
+
+class ServerUnavailable(AdbError):
+    """The adb server refused or reset the connection, it is down or restarting and no device is to blame."""
+
+    device_fault = False
+
+    def __init__(self, message, device=None, command=None, returncode=None, output=None, dropped=False) -> None:
+        super().__init__(message, device, command, returncode, output)
+        self.dropped = dropped #reset mid call, the command may already have run
+
+
+class CommandFailed(AdbError):
+    """The command ran and exited nonzero, the device itself is fine."""
+
+    retryable = False
+    device_fault = False
+
+
+class DeviceQuarantined(AdbError):
+    """The device's circuit breaker is open, the call was not attempted."""
+
+    retryable = False
+    device_fault = False
+
+
+def classify(message, device=None, command=None, returncode=None, output=None) -> AdbError:
+    """AdbError subclass for an adb or adb server error message."""
+    text = message.lower()
+    if SERVER_MESSAGES.search(text):
+        kind = ServerUnavailable
+    elif OFFLINE_MESSAGES.search(text): #before unauthorized, 'still authorizing' is transient
+        kind = DeviceOffline
+    elif UNAUTHORIZED_MESSAGES.search(text):
+        kind = DeviceUnauthorized
+    elif returncode:
+        kind = CommandFailed
+    else:
+        kind = AdbError
+    return kind(message, device, command, returncode, output)
+
+
+def from_result(result, device=None) -> AdbError:
+    """Error for a nonzero CompletedProcess, adb's own error lines decide between offline, unauthorized and a failed command."""
+    output = '\n'.join(text for text in (result.stdout, result.stderr) if isinstance(text, str))
+    for line in output.splitlines():
+        if line.strip().lower().startswith(ADB_PREFIXES):
+            return classify(line.strip(), device, result.args, result.returncode, output)
+    return CommandFailed(f'{result.args!r} exited with {result.returncode}', device, result.args, result.returncode, output)
+
+
+def from_exception(error, device=None, command=None):
+    """AdbError for a connection level exception, None for anything else (a bug, a missing adb binary...)."""
+    if isinstance(error, AdbError):
+        return error
+    if isinstance(error, (subprocess.TimeoutExpired, TimeoutError)): #socket.timeout is a TimeoutError
+        return CommandTimeout(f'{command!r} on {device} timed out', device, command)
+    if isinstance(error, (ConnectionRefusedError, ConnectionResetError)): #the server's socket, not the device's
+        return ServerUnavailable(f'adb server unavailable: {error}', device, command,
+                                 dropped=isinstance(error, ConnectionResetError))
+    if isinstance(error, ConnectionError):
+        return classify(str(error) or type(error).__name__, device, command)
+    return None
+
+
+class RetryPolicy:
+    """attempts calls at most, sleeping uniform(0, min(cap, base * 2**n)) seconds before retry n ("full jitter").
+
+    The jitter keeps a fleet of workers that failed together from retrying in lockstep. Only retryable errors
+    are repeated. A timeout (retry_timeouts) or a connection dropped mid command (retry_dropped) may come after
+    the command already ran, turn both off for anything that is not idempotent, see INPUT_RETRY.
+    """
+
+    def __init__(self, attempts=3, base=0.2, cap=2.0, retry_timeouts=True, retry_dropped=True) -> None:
+        self.attempts = attempts
+        self.base = base
+        self.cap = cap
+        self.retry_timeouts = retry_timeouts
+        self.retry_dropped = retry_dropped
+
+    def should_retry(self, error, attempt) -> bool:
+        """attempt is the number of calls made so far."""
+        if attempt >= self.attempts or not error.retryable:
+            return False
+        if isinstance(error, CommandTimeout):
+            return self.retry_timeouts
+        if type(error) is AdbError or getattr(error, 'dropped', False): #connection lost, the device may have run the command
+            return self.retry_dropped
+        return True
+
+    def delay(self, attempt) -> float:
+        return random.uniform(0, min(self.cap, self.base * 2 ** (attempt - 1)))
+
+
+INPUT_RETRY = RetryPolicy(retry_timeouts=False, retry_dropped=False) #taps and swipes, retried only when adb never reached the device
+
+
+class CircuitBreaker:
+    """Health of one device: 'closed' (normal), 'open' (quarantined) or 'half_open' (one probe call allowed).
+
+    threshold device faults in a row open it, calls then raise DeviceQuarantined without touching adb. After
+    cooldown seconds the next call goes through as a probe, success closes the breaker, failure opens it again
+    with the cooldown doubled (up to max_cooldown). Listeners get callback(breaker, old state, new state).
+    """
+
+    def __init__(self, device=None, threshold=3, cooldown=5.0, max_cooldown=60.0) -> None:
+        self.device = device
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.state = 'closed'
+        self.failures = 0 #device faults in a row
+        self.trips = 0 #times it opened since it was last closed
+        self.last_error = None
+        self.listeners = []
+
+        self._opened = 0.0 #time.monotonic() it opened
+        self._probing = None #thread making the probe call, its nested calls belong to the probe
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback) -> None:
+        self.listeners.append(callback)
+
+    def _set(self, state) -> None:
+        old, self.state = self.state, state
+        if old != state:
+            for callback in self.listeners:
+                callback(self, old, state)
+
+    def retry_in(self) -> float:
+        """Seconds until an open breaker lets a probe through."""
+        if self.state != 'open':
+            return 0.0
+        cooldown = min(self.max_cooldown, self.cooldown * 2 ** max(0, self.trips - 1))
+        return max(0.0, self._opened + cooldown - time.monotonic())
+
+    def allow(self) -> None:
+        """Raises DeviceQuarantined unless a call may go ahead now."""
+        with self._lock:
+            if self.state == 'open' and self.retry_in() == 0:
+                self._set('half_open')
+            if self.state == 'half_open' and self._probing in (None, threading.get_ident()):
+                self._probing = threading.get_ident()
+                return
+            if self.state != 'closed':
+                raise DeviceQuarantined(f'{self.device} is quarantined after {self.failures} failures, '
+                                        f'next probe in {self.retry_in():.1f}s: {self.last_error}', self.device)
+
+    def success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self._probing = None
+            if self.state != 'closed':
+                self.trips = 0
+                self._set('closed')
+
+    def release(self) -> None:
+        """End a call that said nothing about the device's health, a half open breaker takes the next probe."""
+        with self._lock:
+            self._probing = None
+
+    def failure(self, error) -> None:
+        if not getattr(error, 'device_fault', True):
+            if isinstance(error, CommandFailed): #the device answered, a failed command is not its fault
+                return self.success()
+            return self.release() #eg. the adb server is down, says nothing about this device
+        with self._lock:
+            self.failures += 1
+            self.last_error = error
+            if self.state == 'half_open' or (self.state == 'closed' and self.failures >= self.threshold):
+                self._probing = None
+                self.trips += 1
+                self._opened = time.monotonic()
+                self._set('open')
+
+
+def call(action, device=None, command=None, breaker=None, policy=None, recover=None):
+    """action() under breaker with policy's retries, connection failures come out as AdbErrors.
+
+    recover(error) runs before every retry, eg. to reconnect the device or drop a dead shell session.
+    """
+    attempt = 0
+    while True:
+        if breaker is not None:
+            breaker.allow()
+        try:
+            result = action()
+        except BaseException as e:
+            error = from_exception(e, device, command)
+            if error is None: #not the device's doing, eg. adb itself is missing or a parse error
+                if breaker is not None:
+                    breaker.release()
+                raise
+            if breaker is not None:
+                breaker.failure(error)
+            attempt += 1
+            if policy is None or not policy.should_retry(error, attempt):
+                if error is e:
+                    raise
+                raise error from e
+            if recover is not None:
+                recover(error)
+            time.sleep(policy.delay(attempt))
+            continue
+        if breaker is not None:
+            breaker.success()
+        return result
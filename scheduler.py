@@ -0,0 +1,178 @@
+import collections
+import threading
+import time
+from concurrent.futures import Future
+
+LANES = ('input', 'query', 'telemetry') #highest priority first
+
+
+class DeadlineExceeded(TimeoutError):
+    """The action was still queued when its deadline passed, it never ran."""
+
+
+class TokenBucket:
+    """rate tokens a second, at most burst saved up. Not locked, DeviceScheduler holds its own lock around it."""
+
+    def __init__(self, rate, burst=1) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def _fill(self, now) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait(self, now=None) -> float:
+        """Seconds until a token is available, 0 when one is."""
+        self._fill(time.monotonic() if now is None else now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now=None) -> bool:
+        if self.wait(now):
+            return False
+        self.tokens -= 1
+        return True
+
+
+class _Job:
+    __slots__ = ('function', 'args', 'kwargs', 'lane', 'key', 'deadline', 'future')
+
+    def __init__(self, function, args, kwargs, lane, key, deadline) -> None:
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.lane = lane
+        self.key = key
+        self.deadline = deadline #time.monotonic() after which it is dropped, None never
+        self.future = Future()
+
+
+class DeviceScheduler:
+    """One worker thread that owns a device's command stream, fed by any number of producer threads.
+
+    Actions wait in priority lanes (LANES, input first) and the worker always takes the head of the highest
+    lane that may run: a lane with a TokenBucket (limit()) waits for a token, lower lanes go ahead meanwhile.
+    submit(key=...) coalesces: while an action with the same key is queued or running, later submissions get
+    its Future instead of a second device call, so a dozen threads asking for the focus cost one dumpsys.
+    Actions still queued at their deadline are dropped with DeadlineExceeded, a stale tap is worse than none.
+
+    Actions should be single device calls. One that waits on a thread which itself waits on this scheduler
+    deadlocks. Screencaps, streams and sync transfers use their own connections and are not scheduled.
+    """
+
+    def __init__(self, device=None, rates=None) -> None:
+        self.device = device
+        self.buckets = {} #lane -> TokenBucket
+        self.stats = collections.Counter() #'run', 'coalesced', 'dropped' and 'run.<lane>'
+
+        self._lanes = {lane: collections.deque() for lane in LANES}
+        self._keys = {} #key -> _Job queued or running
+        self._cond = threading.Condition()
+        self._closed = False
+        for lane, (rate, burst) in (rates or {}).items():
+            self.limit(lane, rate, burst)
+        self._thread = threading.Thread(target=self._run, daemon=True, name=f'scheduler-{device}')
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def limit(self, lane, rate, burst=1) -> None:
+        """At most rate actions a second in lane (bursts of burst), rate None lifts the limit."""
+        if lane not in LANES:
+            raise ValueError(f'unknown lane: {lane}')
+        with self._cond:
+            if rate is None:
+                self.buckets.pop(lane, None)
+            else:
+                self.buckets[lane] = TokenBucket(rate, burst)
+            self._cond.notify()
+
+    def submit(self, function, *args, lane='query', key=None, deadline=None, **kwargs) -> Future:
+        """Queue function(*args, **kwargs), deadline is seconds from now. Returns a concurrent.futures.Future."""
+        if lane not in LANES:
+            raise ValueError(f'unknown lane: {lane}')
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('scheduler is closed')
+            if key is not None and key in self._keys:
+                self.stats['coalesced'] += 1
+                return self._keys[key].future
+            job = _Job(function, args, kwargs, lane, key, None if deadline is None else time.monotonic() + deadline)
+            if key is not None:
+                self._keys[key] = job
+            self._lanes[lane].append(job)
+            self._cond.notify()
+        return job.future
+
+    def call(self, function, *args, lane='query', key=None, deadline=None, **kwargs):
+        """submit() and wait for the result. On the worker thread itself (an action calling back into the
+        scheduler) the function runs right away, waiting for the queue would deadlock."""
+        if threading.current_thread() is self._thread:
+            return function(*args, **kwargs)
+        return self.submit(function, *args, lane=lane, key=key, deadline=deadline, **kwargs).result()
+
+    def pending(self) -> dict:
+        with self._cond:
+            return {lane: len(queue) for lane, queue in self._lanes.items()}
+
+    def _forget(self, job) -> None:
+        if job.key is not None and self._keys.get(job.key) is job:
+            del self._keys[job.key]
+
+    def _next(self, now) -> tuple:
+        """(job, None) to run now, else (None, seconds until a token or deadline is due, None for never)."""
+        wake = None
+        for lane in LANES:
+            queue = self._lanes[lane]
+            while queue and (queue[0].future.cancelled() or (queue[0].deadline is not None and queue[0].deadline <= now)):
+                job = queue.popleft()
+                self._forget(job)
+                if job.future.set_running_or_notify_cancel(): #False when it was cancelled
+                    self.stats['dropped'] += 1
+                    job.future.set_exception(DeadlineExceeded(f'{lane} action for {self.device} missed its deadline'))
+            if not queue:
+                continue
+            bucket = self.buckets.get(lane)
+            wait = bucket.wait(now) if bucket is not None else 0.0
+            if not wait:
+                if bucket is not None:
+                    bucket.take(now)
+                return queue.popleft(), None
+            due = [wait] + [job.deadline - now for job in queue if job.deadline is not None]
+            wake = min(due) if wake is None else min(wake, *due)
+        return None, wake
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while True:
+                    job, wake = self._next(time.monotonic())
+                    if job is not None:
+                        break
+                    if self._closed and not any(self._lanes.values()):
+                        return
+                    self._cond.wait(wake)
+            if job.future.set_running_or_notify_cancel():
+                try:
+                    result = job.function(*job.args, **job.kwargs)
+                except BaseException as e:
+                    job.future.set_exception(e)
+                else:
+                    job.future.set_result(result)
+            with self._cond:
+                self._forget(job)
+                self.stats['run'] += 1
+                self.stats[f'run.{job.lane}'] += 1
+
+    def close(self) -> None:
+        """Run what is already queued, then stop the worker."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if threading.current_thread() is not self._thread:
+            self._thread.join()
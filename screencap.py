@@ -0,0 +1,57 @@
+import struct
+
+from lazyimport import lazy_import
+
+Image = lazy_import('PIL.Image')
+
+#screencap pixel formats (android PixelFormat) -> (bytes per pixel, PIL raw mode)
+PIXEL_FORMATS = {
+    1: (4, 'RGBA'), #RGBA_8888
+    2: (4, 'RGBX'), #RGBX_8888
+    3: (3, 'RGB'),  #RGB_888
+    5: (4, 'BGRA'), #BGRA_8888
+}
+
+
+def parse_header(data) -> tuple:
+    """Returns (width, height, pixel_format, offset) of raw `screencap` output.
+
+    The header is width, height, format and, since android 9, a colorspace word, so it is 12 or 16 bytes.
+    """
+    width, height, pixel_format = struct.unpack_from('<III', data)
+    if pixel_format not in PIXEL_FORMATS:
+        raise ValueError(f'unsupported screencap pixel format {pixel_format}')
+    offset = len(data) - width * height * PIXEL_FORMATS[pixel_format][0]
+    if offset not in (12, 16):
+        raise ValueError(f'screencap output is {len(data)} bytes, not a {width}x{height} frame')
+    return width, height, pixel_format, offset
+
+
+def frame_size(width, height, pixel_format=1) -> int:
+    """Largest possible raw screencap output for the given frame, header included."""
+    return 16 + width * height * PIXEL_FORMATS[pixel_format][0]
+
+
+class RawFrame:
+    """Raw screencap output kept in its original buffer, views over the pixels are created without copying."""
+
+    def __init__(self, data) -> None:
+        self.data = data
+        self.width, self.height, self.pixel_format, self.offset = parse_header(data)
+        self.bpp, self.rawmode = PIXEL_FORMATS[self.pixel_format]
+
+    @property
+    def pixels(self) -> memoryview:
+        return memoryview(self.data)[self.offset:]
+
+    def to_image(self) -> Image:
+        mode = 'RGB' if self.bpp == 3 else 'RGBA'
+        if self.rawmode in (mode, 'RGBX'): #PIL shares the buffer for these
+            return Image.frombuffer(mode, (self.width, self.height), self.pixels, 'raw', mode, 0, 1)
+        return Image.frombuffer(mode, (self.width, self.height), self.pixels, 'raw', self.rawmode, 0, 1) #BGRA is converted
+
+    def to_array(self):
+        """(height, width, channels) uint8 view, channel order is the device format (see rawmode)."""
+        import numpy as np
+        return np.frombuffer(self.data, dtype=np.uint8, count=self.width * self.height * self.bpp,
+                             offset=self.offset).reshape(self.height, self.width, self.bpp)
@@ -0,0 +1,93 @@
+import functools
+import json
+import os
+import shutil
+import sys
+import threading
+
+#environment variables checked for each tool, first one set wins
+ENV_VARS = {'adb': ('ADBAPI_ADB', 'ADB_PATH'), 'tesseract': ('ADBAPI_TESSERACT', 'TESSERACT_CMD')}
+CONFIG_FILES = ('adbapi.json', os.path.join('~', '.adbapi.json')) #{"adb": "...", "tesseract": "..."}, or ADBAPI_CONFIG
+
+_resolved = {} #(name, search_path) -> path
+_lock = threading.Lock()
+
+
+def executable_names(name) -> tuple:
+    """'adb' -> ('adb', 'adb.exe') on Windows, ('adb',) elsewhere, an explicit extension is kept."""
+    name = os.path.basename(name)
+    if name.lower().endswith('.exe'):
+        return (name,) if sys.platform == 'win32' else (name, name[:-4])
+    return (name + '.exe', name) if sys.platform == 'win32' else (name,)
+
+
+@functools.lru_cache(maxsize=None)
+def config() -> dict:
+    """Tool paths from the first config file found, read once."""
+    paths = [os.environ['ADBAPI_CONFIG']] if os.environ.get('ADBAPI_CONFIG') else CONFIG_FILES
+    for path in paths:
+        path = os.path.expanduser(path)
+        if os.path.isfile(path):
+            with open(path) as f:
+                return json.load(f)
+    return {}
+
+
+@functools.lru_cache(maxsize=None)
+def walk(filename, search_path) -> str:
+    """First filename under search_path, the old find_executable, walked once per (filename, path)."""
+    for root, dirs, files in os.walk(search_path):
+        if filename in files:
+            return os.path.join(root, filename)
+    return None
+
+
+def _sdk_dirs() -> list:
+    return [os.path.join(os.environ[var], 'platform-tools') for var in ('ANDROID_SDK_ROOT', 'ANDROID_HOME')
+            if os.environ.get(var)]
+
+
+def _locate(name, search_path) -> str:
+    tool = os.path.splitext(os.path.basename(name))[0].lower()
+    for var in ENV_VARS.get(tool, ()):
+        if os.environ.get(var):
+            return os.environ[var]
+    if config().get(tool):
+        return os.path.expanduser(config()[tool])
+    for filename in executable_names(name):
+        found = shutil.which(filename)
+        if found:
+            return found
+    if tool == 'adb':
+        for directory in _sdk_dirs():
+            for filename in executable_names(name):
+                found = shutil.which(filename, path=directory)
+                if found:
+                    return found
+    if search_path is not None:
+        for filename in executable_names(name):
+            found = walk(filename, search_path)
+            if found:
+                return found
+    return None
+
+
+def find_tool(name, search_path=None) -> str:
+    """Path of an executable ('adb', 'tesseract'), None when it is nowhere to be found.
+
+    Looked up in order: env var (ENV_VARS), config file, PATH, the Android SDK (adb only) and finally a walk
+    of search_path, the cwd tree the old lookup searched. Results, misses too, are remembered for the process,
+    clear_cache() after installing something.
+    """
+    key = (name, search_path)
+    with _lock:
+        if key not in _resolved:
+            _resolved[key] = _locate(name, search_path)
+        return _resolved[key]
+
+
+def clear_cache() -> None:
+    with _lock:
+        _resolved.clear()
+    config.cache_clear()
+    walk.cache_clear()
@@ -0,0 +1,176 @@
+import collections
+import hashlib
+import os
+import shlex
+import threading
+
+TransferResult = collections.namedtuple('TransferResult', ['remote', 'local', 'size', 'skipped', 'data'])
+
+SKIP_MODES = (None, 'stat', 'hash') #None transfers everything
+BATCH_BYTES = 8 * 1024 * 1024 #pushes queued before their acks are collected
+
+_digests = {} #(path, size, mtime_ns) -> md5 hex, local files hashed once per version
+_digests_lock = threading.Lock()
+
+
+def tree(local_dir, remote_dir) -> dict:
+    """{remote path: local path} for every file under local_dir, for push()ing a whole directory."""
+    files = {}
+    for root, dirs, names in os.walk(local_dir):
+        for name in names:
+            local = os.path.join(root, name)
+            relative = os.path.relpath(local, local_dir).replace(os.sep, '/')
+            files[f'{remote_dir.rstrip("/")}/{relative}'] = local
+    return files
+
+
+def _is_path(source) -> bool:
+    return isinstance(source, (str, os.PathLike))
+
+
+def _file_md5(f) -> str:
+    digest = hashlib.md5()
+    for chunk in iter(lambda: f.read(1024 * 1024), b''):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def md5(source) -> str:
+    """Hex md5 of a local path (cached while its size and mtime do not change), bytes or a seekable file."""
+    if _is_path(source):
+        st = os.stat(source)
+        key = (os.fspath(source), st.st_size, st.st_mtime_ns)
+        with _digests_lock:
+            if key in _digests:
+                return _digests[key]
+        with open(source, 'rb') as f:
+            digest = _file_md5(f)
+        with _digests_lock:
+            _digests[key] = digest
+        return digest
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return hashlib.md5(source).hexdigest()
+    position = source.tell()
+    digest = _file_md5(source)
+    source.seek(position)
+    return digest
+
+
+def remote_md5(shell, remote_paths) -> dict:
+    """{path: md5 hex} of the remote files that exist, one `md5sum` call for all of them."""
+    paths = list(remote_paths)
+    if not paths:
+        return {}
+    output = shell(f'md5sum {" ".join(shlex.quote(path) for path in paths)} 2>/dev/null').stdout
+    digests = {}
+    for line in output.splitlines():
+        digest, _, path = line.partition(' ')
+        if len(digest) == 32:
+            digests[path.lstrip(' *')] = digest
+    return digests
+
+
+def _size(source) -> int:
+    if _is_path(source):
+        return os.path.getsize(source)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return memoryview(source).nbytes
+    return None
+
+
+def push(sync, files, skip='stat', shell=None, mode=None) -> list:
+    """Push {remote path: source} over one SyncConnection, returns a TransferResult per file.
+
+    A source is a local path, bytes or a readable file object. skip='stat' leaves alone remote files with the
+    same size and mtime (only local paths have an mtime, pushes carry it over), skip='hash' compares md5s
+    through shell, one `md5sum` for the batch. Sends are pipelined, acks are collected every BATCH_BYTES.
+    """
+    if skip not in SKIP_MODES:
+        raise ValueError(f'unknown skip mode: {skip}')
+    if skip == 'hash' and shell is None:
+        raise ValueError("skip='hash' needs a shell to run md5sum")
+    files = dict(files)
+    unchanged = set()
+    if skip == 'stat':
+        paths = [remote for remote, source in files.items() if _is_path(source)]
+        for remote, (remote_mode, size, mtime) in zip(paths, sync.stat_many(paths)):
+            st = os.stat(files[remote])
+            if remote_mode and size == st.st_size and mtime == int(st.st_mtime):
+                unchanged.add(remote)
+    elif skip == 'hash':
+        digests = remote_md5(shell, files)
+        unchanged = {remote for remote, source in files.items() if digests.get(remote) == md5(source)}
+
+    results, pending, queued = [], [], 0
+    for remote, source in files.items():
+        local = os.fspath(source) if _is_path(source) else None
+        if remote in unchanged:
+            results.append(TransferResult(remote, local, _size(source), True, None))
+            continue
+        if local is not None:
+            st = os.stat(local)
+            with open(local, 'rb') as f:
+                size = sync.send_file(f, remote, st.st_mode & 0o777 if mode is None else mode, st.st_mtime)
+        else:
+            size = sync.send_file(source, remote, 0o644 if mode is None else mode)
+        pending.append(remote)
+        results.append(TransferResult(remote, local, size, False, None))
+        queued += size
+        if queued >= BATCH_BYTES:
+            for path in pending:
+                sync.read_ack(path)
+            pending, queued = [], 0
+    for path in pending:
+        sync.read_ack(path)
+    return results
+
+
+def pull(sync, files, skip='stat', shell=None) -> list:
+    """Pull {remote path: target} over one SyncConnection, returns a TransferResult per file.
+
+    A target is a local path (parent directories are created and its mtime set to the remote one, so the
+    next skip='stat' pull is free), a writable file object, or None to get the bytes in TransferResult.data.
+    Missing remote files raise FileNotFoundError before anything is transferred.
+    """
+    if skip not in SKIP_MODES:
+        raise ValueError(f'unknown skip mode: {skip}')
+    if skip == 'hash' and shell is None:
+        raise ValueError("skip='hash' needs a shell to run md5sum")
+    files = dict(files)
+    stats = dict(zip(files, sync.stat_many(files)))
+    missing = [remote for remote, (remote_mode, _, _) in stats.items() if not remote_mode]
+    if missing:
+        raise FileNotFoundError(f'not on the device: {", ".join(missing)}')
+
+    unchanged = set()
+    local_files = {remote: target for remote, target in files.items() if _is_path(target) and os.path.isfile(target)}
+    if skip == 'stat':
+        for remote, target in local_files.items():
+            st = os.stat(target)
+            if stats[remote][1] == st.st_size and stats[remote][2] == int(st.st_mtime):
+                unchanged.add(remote)
+    elif skip == 'hash' and local_files:
+        digests = remote_md5(shell, local_files)
+        unchanged = {remote for remote, target in local_files.items() if digests.get(remote) == md5(target)}
+
+    wanted = [remote for remote in files if remote not in unchanged]
+    for remote in wanted: #queued up front, the files then stream back to back
+        sync.request_file(remote)
+    results = {remote: TransferResult(remote, os.fspath(files[remote]), stats[remote][1], True, None) for remote in unchanged}
+    for remote in wanted:
+        target = files[remote]
+        if _is_path(target):
+            directory = os.path.dirname(os.fspath(target))
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(target, 'wb') as f:
+                sync.receive(f)
+            os.utime(target, (stats[remote][2], stats[remote][2]))
+            results[remote] = TransferResult(remote, os.fspath(target), stats[remote][1], False, None)
+        elif target is None:
+            data = sync.receive()
+            results[remote] = TransferResult(remote, None, len(data), False, data)
+        else:
+            sync.receive(target)
+            results[remote] = TransferResult(remote, None, stats[remote][1], False, None)
+    return [results[remote] for remote in files]
@@ -0,0 +1,103 @@
+import math
+
+from lazyimport import lazy_import
+
+np = lazy_import('numpy')
+
+
+class Transform:
+    """Affine map between coordinate spaces (base resolution, screen pixels, raw touch axes) as a 3x3 matrix.
+
+    Points and rects are mapped as whole arrays, a gesture path or every Locator hit is one matrix product.
+    a.then(b) is a followed by b, inverse() maps back, eg. screenshot pixels to base resolution.
+    The two affine rows are kept as floats, single points and composition never load numpy.
+    """
+
+    def __init__(self, matrix=None) -> None:
+        matrix = matrix if matrix is not None else ((1, 0, 0), (0, 1, 0))
+        self.rows = tuple(tuple(float(v) for v in row[:3]) for row in matrix[:2]) #((a, b, c), (d, e, f))
+
+    @property
+    def matrix(self) -> 'np.ndarray':
+        return np.array(self.rows + ((0.0, 0.0, 1.0),))
+
+    def __repr__(self) -> str:
+        return f'Transform({[[round(v, 6) for v in row] for row in self.rows]})'
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Transform) and all(math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-8)
+                                                    for row, other_row in zip(self.rows, other.rows)
+                                                    for a, b in zip(row, other_row))
+
+    @classmethod
+    def scale(cls, sx, sy=None):
+        return cls([[sx, 0, 0], [0, sx if sy is None else sy, 0], [0, 0, 1]])
+
+    @classmethod
+    def translate(cls, dx, dy):
+        return cls([[1, 0, dx], [0, 1, dy], [0, 0, 1]])
+
+    @classmethod
+    def rotation(cls, quarter_turns, width, height):
+        """Display coordinates in a rotation (0-3, like Surface.ROTATION_*) to the panel's natural orientation,
+        width and height are the natural size."""
+        return cls({0: [[1, 0, 0], [0, 1, 0], [0, 0, 1]],
+                    1: [[0, -1, width - 1], [1, 0, 0], [0, 0, 1]],
+                    2: [[-1, 0, width - 1], [0, -1, height - 1], [0, 0, 1]],
+                    3: [[0, 1, 0], [-1, 0, height - 1], [0, 0, 1]]}[quarter_turns % 4])
+
+    @classmethod
+    def fit(cls, base, screen, mode='stretch', insets=None):
+        """Base resolution (w, h) onto a screen (w, h) in its current orientation.
+
+        insets (left, top, right, bottom) are screen pixels the content does not cover (cutouts, bars).
+        mode 'stretch' scales each axis on its own, 'letterbox' keeps the aspect ratio and centers.
+        """
+        left, top, right, bottom = insets or (0, 0, 0, 0)
+        width, height = screen[0] - left - right, screen[1] - top - bottom
+        sx, sy = width / base[0], height / base[1]
+        if mode == 'letterbox':
+            sx = sy = min(sx, sy)
+            left, top = left + (width - base[0] * sx) / 2, top + (height - base[1] * sy) / 2
+        elif mode != 'stretch':
+            raise ValueError(f'unknown fit mode: {mode}')
+        return cls.scale(sx, sy).then(cls.translate(left, top))
+
+    @property
+    def scale_x(self) -> float:
+        return math.hypot(self.rows[0][0], self.rows[1][0])
+
+    @property
+    def scale_y(self) -> float:
+        return math.hypot(self.rows[0][1], self.rows[1][1])
+
+    def then(self, other):
+        (a, b, c), (d, e, f) = self.rows
+        return Transform([(p * a + q * d, p * b + q * e, p * c + q * f + r) for p, q, r in other.rows])
+
+    def inverse(self):
+        (a, b, c), (d, e, f) = self.rows
+        det = a * e - b * d
+        if det == 0:
+            raise ValueError('singular transform has no inverse')
+        return Transform([(e / det, -b / det, (b * f - c * e) / det), (-d / det, a / det, (c * d - a * f) / det)])
+
+    def apply(self, points) -> 'np.ndarray':
+        """(n, 2) array of mapped points from anything shaped (..., 2)."""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        matrix = np.array(self.rows)
+        return points @ matrix[:, :2].T + matrix[:, 2]
+
+    def rects(self, rects) -> 'np.ndarray':
+        """(n, 4) array of mapped (x1, y1, x2, y2) rects, corners reordered so x1 <= x2 and y1 <= y2."""
+        rects = np.asarray(rects, dtype=np.float64).reshape(-1, 4)
+        corners = self.apply(rects).reshape(-1, 2, 2) #opposite corners stay opposite under rotation
+        return np.concatenate([corners.min(axis=1), corners.max(axis=1)], axis=1)
+
+    def point(self, x, y) -> tuple:
+        (a, b, c), (d, e, f) = self.rows
+        return float(a * x + b * y + c), float(d * x + e * y + f)
+
+    def rect(self, x1, y1, x2, y2) -> tuple:
+        (ax, ay), (bx, by) = self.point(x1, y1), self.point(x2, y2)
+        return min(ax, bx), min(ay, by), max(ax, bx), max(ay, by)
@@ -0,0 +1,150 @@
+import collections
+import re
+import xml.etree.ElementTree as ElementTree
+
+from lazyimport import lazy_import
+
+np = lazy_import('numpy')
+
+UI_DUMP = 'uiautomator dump /data/local/tmp/adbapi_ui.xml >/dev/null && cat /data/local/tmp/adbapi_ui.xml' #/dev/tty is not on every build
+
+UiNode = collections.namedtuple('UiNode', ['index', 'parent', 'depth', 'resource_id', 'text', 'desc', 'class_name', 'package',
+                                           'bounds', 'clickable', 'enabled', 'focused', 'selected', 'checked', 'scrollable'])
+ActivityInfo = collections.namedtuple('ActivityInfo', ['package', 'activity', 'pid', 'task', 'bounds', 'app_bounds'])
+
+_BOUNDS = re.compile(r'\[(-?\d+),(-?\d+)\]\[(-?\d+),(-?\d+)\]')
+_RECT = re.compile(r'(mBounds|mAppBounds)=Rect\((-?\d+), (-?\d+) - (-?\d+), (-?\d+)\)')
+
+
+def center(node) -> tuple:
+    x1, y1, x2, y2 = node.bounds
+    return (x1 + x2) / 2, (y1 + y2) / 2
+
+
+def iter_lines(chunks):
+    """str lines from an iterator of bytes chunks, as they arrive."""
+    pending = b''
+    for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b'\n')
+        for line in lines:
+            yield line.decode(errors='replace').rstrip('\r')
+    if pending:
+        yield pending.decode(errors='replace').rstrip('\r')
+
+
+def parse_hierarchy(chunks):
+    """UiNodes of a `uiautomator dump` XML fed chunk by chunk, parents always come before their children."""
+    parser = ElementTree.XMLPullParser(events=('start', 'end'))
+    stack = [] #indexes of the open nodes
+    index = 0
+    for chunk in chunks:
+        error = None
+        try:
+            parser.feed(chunk)
+        except ElementTree.ParseError as e: #text after the root ("UI hierchary dumped to...") is not xml
+            error = e
+        for event, element in parser.read_events():
+            if element.tag == 'hierarchy' and event == 'end':
+                return
+            if element.tag != 'node':
+                continue
+            if event == 'end':
+                stack.pop()
+                element.clear()
+                continue
+            attrs = element.attrib
+            bounds = _BOUNDS.match(attrs.get('bounds', ''))
+            yield UiNode(index, stack[-1] if stack else None, len(stack), attrs.get('resource-id', ''), attrs.get('text', ''),
+                         attrs.get('content-desc', ''), attrs.get('class', ''), attrs.get('package', ''),
+                         tuple(map(int, bounds.groups())) if bounds else (0, 0, 0, 0),
+                         attrs.get('clickable') == 'true', attrs.get('enabled') == 'true', attrs.get('focused') == 'true',
+                         attrs.get('selected') == 'true', attrs.get('checked') == 'true', attrs.get('scrollable') == 'true')
+            stack.append(index)
+            index += 1
+        if error is not None:
+            raise error
+
+
+def parse_activity_top(lines):
+    """ActivityInfo for every ACTIVITY block of `dumpsys activity top`, yielded as each block ends."""
+    current = None
+    task = None
+    for line in lines:
+        stripped = line.strip()
+        if stripped.startswith('TASK '):
+            found = re.search(r'\bid=(\d+)', stripped)
+            task = int(found.group(1)) if found else None
+        elif stripped.startswith('ACTIVITY '):
+            if current is not None:
+                yield ActivityInfo(**current)
+            parts = stripped.split()
+            component = parts[1] if len(parts) > 1 else ''
+            package, _, activity = component.partition('/')
+            pid = re.search(r'\bpid=(\d+)', stripped)
+            current = {'package': package, 'activity': activity, 'pid': int(pid.group(1)) if pid else None, 'task': task,
+                       'bounds': None, 'app_bounds': None}
+        elif current is not None and current['bounds'] is None and 'mBounds=Rect(' in stripped:
+            for name, *rect in _RECT.findall(stripped): #first configuration of the block is the current one
+                current['bounds' if name == 'mBounds' else 'app_bounds'] = tuple(map(int, rect))
+    if current is not None:
+        yield ActivityInfo(**current)
+
+
+class UiIndex:
+    """UiNodes of one dump, looked up by resource-id, text or screen position.
+
+    resource ids match in full ('com.app:id/login') or by their short name ('login').
+    Bounds are screen pixels in the rotation of the dump.
+    """
+
+    def __init__(self, nodes) -> None:
+        self.nodes = list(nodes)
+        self.by_id = collections.defaultdict(list)
+        self.by_text = collections.defaultdict(list)
+        for node in self.nodes:
+            if node.resource_id:
+                self.by_id[node.resource_id].append(node)
+                if ':id/' in node.resource_id:
+                    self.by_id[node.resource_id.rpartition(':id/')[2]].append(node)
+            for text in {node.text, node.desc} - {''}:
+                self.by_text[text].append(node)
+        self.bounds = np.array([node.bounds for node in self.nodes], dtype=np.int32).reshape(-1, 4)
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def __iter__(self):
+        return iter(self.nodes)
+
+    def children(self, node) -> list:
+        return [child for child in self.nodes[node.index + 1:] if child.parent == node.index]
+
+    def find(self, resource_id=None, text=None, contains=None, clickable=None, enabled=None) -> list:
+        """Nodes matching every given criterion, text matches text or content-desc exactly, contains is a substring."""
+        if resource_id is not None:
+            candidates = self.by_id.get(resource_id, [])
+        elif text is not None:
+            candidates = self.by_text.get(text, [])
+        else:
+            candidates = self.nodes
+        return [node for node in candidates
+                if (text is None or text in (node.text, node.desc))
+                and (contains is None or contains in node.text or contains in node.desc)
+                and (clickable is None or node.clickable == clickable)
+                and (enabled is None or node.enabled == enabled)]
+
+    def first(self, **criteria) -> UiNode:
+        """First match in document order, LookupError when there is none."""
+        found = self.find(**criteria)
+        if not found:
+            raise LookupError(f'no ui node with {criteria}')
+        return min(found, key=lambda node: node.index)
+
+    def at(self, x, y) -> UiNode:
+        """Topmost node whose bounds contain (x, y), the last one in document order, None outside every node."""
+        if not self.nodes:
+            return None
+        b = self.bounds
+        inside = np.nonzero((b[:, 0] <= x) & (x < b[:, 2]) & (b[:, 1] <= y) & (y < b[:, 3]))[0]
+        return self.nodes[inside[-1]] if len(inside) else None #document order, children after parents
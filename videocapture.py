@@ -0,0 +1,182 @@
+import io
+import socket
+import subprocess
+
+from capture import FrameCapture
+from lazyimport import lazy_import
+import instrument
+
+av = lazy_import('av') #PyAV, only needed once a VideoCapture starts
+np = lazy_import('numpy')
+Image = lazy_import('PIL.Image')
+
+LOW_DELAY = {'probesize': '32', 'analyzeduration': '0'} #start decoding on the first packets instead of probing ahead
+
+
+def screenrecord_command(size=None, bit_rate=8_000_000, time_limit=None) -> str:
+    """`screenrecord` writing a raw H.264 elementary stream to stdout, size is (width, height) of the video."""
+    command = f'screenrecord --output-format=h264 --bit-rate {int(bit_rate)}'
+    if size:
+        command += f' --size {int(size[0])}x{int(size[1])}'
+    if time_limit:
+        command += f' --time-limit {int(time_limit)}'
+    return command + ' -'
+
+
+class SocketStream(io.RawIOBase):
+    """Readable file over an exec: connection, close() from another thread wakes a blocked read."""
+
+    def __init__(self, sock) -> None:
+        self.sock = sock
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        try:
+            return self.sock.recv_into(buffer)
+        except OSError:
+            if self.closed:
+                return 0
+            raise
+
+    def close(self) -> None:
+        if not self.closed:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.sock.close()
+        super().close()
+
+
+class ProcessStream(io.RawIOBase):
+    """Readable file over the stdout of `adb exec-out`, close() kills the process."""
+
+    def __init__(self, proc) -> None:
+        self.proc = proc
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        try:
+            return self.proc.stdout.readinto(buffer)
+        except (OSError, ValueError):
+            if self.closed:
+                return 0
+            raise
+
+    def close(self) -> None:
+        if not self.closed:
+            self.proc.kill()
+            self.proc.wait()
+            self.proc.stdout.close()
+        super().close()
+
+
+def exec_stream(client, adb, device_identifier, command) -> io.RawIOBase:
+    """Binary stdout of a long running command, over the adb server socket when client is set, else `adb exec-out`."""
+    if client:
+        return SocketStream(client.open_service(device_identifier, f'exec:{command}'))
+    return ProcessStream(subprocess.Popen([adb, '-s', device_identifier, 'exec-out', command], stdout=subprocess.PIPE,
+                                          bufsize=0)) #unbuffered, reads return whatever has arrived
+
+
+class DecodedFrame:
+    """RGB pixels of one decoded video frame, the same views as a RawFrame so Frame works unchanged."""
+
+    bpp = 3
+    rawmode = 'RGB'
+
+    def __init__(self, data, width, height, pts=None) -> None:
+        self.data = data
+        self.width = width
+        self.height = height
+        self.pts = pts #seconds on the encoder clock, None when the stream has no timestamps
+
+    @property
+    def pixels(self) -> memoryview:
+        return memoryview(self.data)[:self.width * self.height * 3]
+
+    def to_image(self) -> Image:
+        return Image.frombuffer('RGB', (self.width, self.height), self.pixels, 'raw', 'RGB', 0, 1)
+
+    def to_array(self):
+        """(height, width, 3) uint8 RGB view."""
+        return np.frombuffer(self.data, dtype=np.uint8, count=self.width * self.height * 3).reshape(self.height, self.width, 3)
+
+
+class VideoCapture(FrameCapture):
+    """FrameCapture fed by one long running `screenrecord` H.264 stream instead of a screencap per frame.
+
+    The device encodes in hardware and only sends changed frames, so a static screen costs next to nothing and
+    a busy one arrives at the display rate (30-60 fps) where screencap manages a few. Frames are decoded on the
+    capture thread with PyAV, converted to RGB and copied into the ring, consumers use latest(), wait_newer(),
+    frames() and Frame.array / image() exactly like with stills.
+
+    open_stream() must start screenrecord and return a binary file over its stdout. It is called again when
+    the stream ends while running, screenrecord stops at its time limit (180 s on most builds).
+    """
+
+    def __init__(self, open_stream, slots=4, device=None) -> None:
+        super().__init__(None, slots)
+        self.open_stream = open_stream
+        self.device = device #device identifier for instrument spans
+        self.restarts = 0 #times screenrecord was started again after its stream ended
+        self._stream = None
+        self._decoded = None
+
+    def _decode(self):
+        """Decoded av.VideoFrames, across screenrecord restarts, until stop()."""
+        while self._running:
+            self._stream = self.open_stream()
+            if not self._running: #stop() ran while the stream was opening
+                self._stream.close()
+                return
+            count, error = 0, None
+            try:
+                with av.open(self._stream, mode='r', format='h264', options=LOW_DELAY) as container:
+                    for video in container.decode(video=0):
+                        count += 1
+                        yield video
+            except av.FFmpegError as e: #also what a stream cut by stop() looks like
+                error = e
+            finally:
+                self._stream.close()
+            if not self._running:
+                return
+            if not count:
+                raise ConnectionError('screenrecord produced no video, is the screen on and the size supported?') from error
+            if error is not None:
+                raise error
+            self.restarts += 1
+
+    def _capture_once(self) -> None:
+        video = next(self._decoded, None)
+        if video is None: #stopped
+            return
+        with instrument.span('video.decode', self.device):
+            array = video.to_ndarray(format='rgb24')
+            index = self.index + 1
+            if not self.slots or len(self.slots[0].buffer) != array.nbytes: #first frame or a new video size
+                self._allocate(array.nbytes)
+            slot = self.slots[index % self.slot_count]
+            slot.index = -1 #being written, frames still pointing here are invalid
+            np.copyto(np.frombuffer(slot.buffer, dtype=np.uint8).reshape(array.shape), array)
+        self._publish(index, DecodedFrame(slot.buffer, video.width, video.height, video.time), slot)
+
+    def start(self):
+        if not self._running:
+            self._decoded = self._decode()
+        return super().start()
+
+    def stop(self) -> None:
+        self._running = False
+        stream = self._stream
+        if stream is not None:
+            stream.close() #wakes the capture thread out of its read
+        super().stop()
+        if self._decoded is not None:
+            self._decoded.close()
+            self._decoded = None